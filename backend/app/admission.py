@@ -0,0 +1,265 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from app.metrics import current_db_time
+
+
+class TokenBuckets:
+    """One token bucket per key (client IP, username), refilled at `rate` tokens per second.
+
+    Only the `max_keys` most recently seen keys are tracked; a key that was
+    evicted starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max(1, max_keys)
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, key: str) -> float:
+        """Take a token for `key`; 0 when allowed, else the seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        self.limited += 1
+        return (1.0 - bucket[0]) / self.rate
+
+
+class ConcurrencyLimiter:
+    """Caps the requests of one route in flight, with a bounded FIFO wait queue.
+
+    A request beyond the limit waits for at most `queue_timeout` seconds, and
+    only while fewer than `max_queue` others are waiting; otherwise it is
+    rejected at once. The limit adapts to the database latency measured by
+    the admitted requests: while the average (an EWMA) stays above
+    `target_db_latency` the limit is cut by a quarter each
+    `adjust_interval`, and it grows back by one per interval once the
+    latency recovers, between `min_limit` and `max_limit`.
+    """
+
+    def __init__(self, max_limit: int, max_queue: Optional[int] = None, queue_timeout: float = 0.25,
+                 target_db_latency: float = 0.1, min_limit: Optional[int] = None,
+                 adjust_interval: float = 1.0, smoothing: float = 0.2):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit or self.max_limit // 10, self.max_limit))
+        self.limit = self.max_limit
+        self.max_queue = self.max_limit if max_queue is None else max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.target_db_latency = target_db_latency
+        self.adjust_interval = adjust_interval
+        self.smoothing = smoothing
+
+        self.in_flight = 0
+        self.db_latency = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._adjusted_at = time.monotonic()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if needed; False when the request should be shed"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue or self.queue_timeout <= 0:
+            self.rejected += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended, so pass it on
+                self.release()
+            else:
+                waiter.cancel()
+                self._remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.timed_out += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def _remove(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, db_seconds: Optional[float] = None):
+        """Give a slot back, recording how long the request spent in the database"""
+        self.in_flight -= 1
+        if db_seconds:
+            self.db_latency += self.smoothing * (db_seconds - self.db_latency)
+        self._adjust()
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adjust(self):
+        now = time.monotonic()
+        if now - self._adjusted_at < self.adjust_interval:
+            return
+        self._adjusted_at = now
+        if self.target_db_latency <= 0:
+            return
+        if self.db_latency > self.target_db_latency:
+            self.limit = max(self.min_limit, int(self.limit * 0.75))
+        elif self.limit < self.max_limit:
+            self.limit += 1
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "db_latency_ms": round(self.db_latency * 1000, 2),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+def _client_ip(scope, trust_forwarded_for: bool) -> str:
+    if trust_forwarded_for:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.split(b",", 1)[0].strip().decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _query_username(scope) -> Optional[str]:
+    query = scope.get("query_string", b"")
+    if b"username=" not in query:
+        return None
+    for name, value in parse_qsl(query.decode("latin-1")):
+        if name == "username":
+            return value
+    return None
+
+
+def _segments(path: str) -> Tuple[str, ...]:
+    return tuple(path.strip("/").split("/"))
+
+
+def _matches_template(segments: Tuple[str, ...], template: Tuple[str, ...]) -> bool:
+    """Whether path segments fit a route template, where `{name}` stands for any one segment"""
+    if len(segments) != len(template):
+        return False
+    for segment, pattern in zip(segments, template):
+        if pattern.startswith("{") and pattern.endswith("}"):
+            if not segment:
+                return False
+        elif segment != pattern:
+            return False
+    return True
+
+
+class AdmissionMiddleware:
+    """Pure ASGI admission control for the database-bound routes.
+
+    `limiters` maps (method, route template) to the ConcurrencyLimiter of
+    that route, with templates written as in the route decorators
+    (`/users/{username}`); other requests pass straight through. Literal
+    paths are found with one dict lookup, templated ones by comparing path
+    segments. Requests to a limited route are
+    first charged to the token bucket of their client IP and, when the
+    query string names one, of their username (429 when empty), then wait
+    for a slot of the route (503 when shed). Both responses carry
+    Retry-After.
+    """
+
+    def __init__(self, app, limiters: Dict[Tuple[str, str], ConcurrencyLimiter],
+                 ip_buckets: Optional[TokenBuckets] = None, user_buckets: Optional[TokenBuckets] = None,
+                 trust_forwarded_for: bool = False, retry_after_seconds: int = 1):
+        self.app = app
+        self.limiters = limiters
+        self._exact = {key: limiter for key, limiter in limiters.items() if "{" not in key[1]}
+        self._templates = [(method, _segments(path), limiter)
+                           for (method, path), limiter in limiters.items() if "{" in path]
+        self.ip_buckets = ip_buckets if ip_buckets is not None and ip_buckets.enabled else None
+        self.user_buckets = user_buckets if user_buckets is not None and user_buckets.enabled else None
+        self.trust_forwarded_for = trust_forwarded_for
+        self.retry_after = str(max(1, retry_after_seconds)).encode("latin-1")
+
+    @staticmethod
+    async def _reject(send, status: int, detail: bytes, retry_after: bytes):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"retry-after", retry_after)]})
+        await send({"type": "http.response.body", "body": b'{"detail":"' + detail + b'"}'})
+
+    def limiter_for(self, method: str, path: str) -> Optional[ConcurrencyLimiter]:
+        limiter = self._exact.get((method, path))
+        if limiter is None and self._templates:
+            segments = _segments(path)
+            for template_method, template, candidate in self._templates:
+                if template_method == method and _matches_template(segments, template):
+                    return candidate
+        return limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiter_for(scope["method"], scope["path"])
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        wait = 0.0
+        if self.ip_buckets is not None:
+            wait = self.ip_buckets.take(_client_ip(scope, self.trust_forwarded_for))
+        if not wait and self.user_buckets is not None:
+            username = _query_username(scope)
+            if username:
+                wait = self.user_buckets.take(username)
+        if wait:
+            await self._reject(send, 429, b"Too many requests", str(math.ceil(wait)).encode("latin-1"))
+            return
+
+        if not await limiter.acquire():
+            await self._reject(send, 503, b"Server busy, please retry", self.retry_after)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(current_db_time())
@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+class EncodedDestinations(NamedTuple):
+    """JSON encodings of the destination fields, built once per snapshot"""
+    cities: List[bytes]
+    options: List[bytes]  # {"city": ..., "country": ...}
+    clues: List[List[bytes]]
+    fun_facts: List[List[bytes]]
+
+
+class CatalogData(NamedTuple):
+    """Immutable snapshot of the destination data, stored as parallel arrays"""
+    cities: List[str]
+    countries: List[str]
+    clues: List[List[str]]
+    fun_facts: List[List[str]]
+    trivia: List[List[str]]
+    index: Dict[str, int]  # city -> slot
+    loaded_at: float
+    source: str = "database"
+    encoded: EncodedDestinations = EncodedDestinations([], [], [], [])
+    fingerprint: str = ""  # content hash; equal fingerprints mean equal destination data
+
+
+EMPTY_CATALOG = CatalogData([], [], [], [], [], {}, 0.0, "empty")
+
+# How soon to retry the database while still serving a bundled snapshot
+SNAPSHOT_RETRY_SECONDS = 10.0
+
+DIFFICULTIES = ("easy", "medium", "hard")
+# Most similar destinations kept per destination; hard questions draw from the closest ones
+NEIGHBOURS = 16
+
+
+def build_catalog_data(documents, source: str = "database") -> CatalogData:
+    """Build a catalog snapshot from an iterable of city documents"""
+    cities, countries, clues, fun_facts, trivia = [], [], [], [], []
+    index = {}
+    for doc in documents:
+        city = doc["city"]
+        if city in index:
+            continue
+        index[city] = len(cities)
+        cities.append(city)
+        countries.append(doc.get("country", ""))
+        clues.append(list(doc.get("clues") or []))
+        fun_facts.append(list(doc.get("fun_fact") or []))
+        trivia.append(list(doc.get("trivia") or []))
+    encoded = EncodedDestinations(
+        [orjson.dumps(city) for city in cities],
+        [orjson.dumps({"city": city, "country": country}) for city, country in zip(cities, countries)],
+        [[orjson.dumps(clue) for clue in slot_clues] for slot_clues in clues],
+        [[orjson.dumps(fact) for fact in slot_facts] for slot_facts in fun_facts],
+    )
+    digest = hashlib.blake2b(digest_size=16)
+    for slot in range(len(cities)):
+        digest.update(encoded.options[slot])
+        for fragments in (encoded.clues[slot], encoded.fun_facts[slot]):
+            digest.update(b"[%s]" % b",".join(fragments))
+        digest.update(orjson.dumps(trivia[slot]))
+    return CatalogData(cities, countries, clues, fun_facts, trivia, index, time.time(), source, encoded,
+                       digest.hexdigest())
+
+
+def _sample_question(data: CatalogData, correct: int, num_options: int,
+                     distractors: Optional[List[int]] = None) -> Tuple[List[int], List[int]]:
+    """Pick the clue indexes and the shuffled option slots of a question"""
+    total = len(data.cities)
+    num_clues = len(data.clues[correct])
+    clue_indexes = random.sample(range(num_clues), min(random.randint(1, 2), num_clues))
+
+    if distractors is None:
+        # Sample distractor slots from [0, total - 1) and skip over the correct slot
+        num_options = min(num_options, total)
+        slots = [s + 1 if s >= correct else s for s in random.sample(range(total - 1), num_options - 1)]
+    else:
+        slots = list(distractors)
+    slots.append(correct)
+    random.shuffle(slots)
+    return clue_indexes, slots
+
+
+def build_question(data: CatalogData, correct: int, num_options: int = 4,
+                   distractors: Optional[List[int]] = None) -> dict:
+    """Build a question whose answer is the destination in slot `correct`"""
+    clue_indexes, slots = _sample_question(data, correct, num_options, distractors)
+    clues = data.clues[correct]
+    return {
+        "clues": [clues[i] for i in clue_indexes],
+        "options": [{"city": data.cities[s], "country": data.countries[s]} for s in slots],
+        "correct_answer": data.cities[correct],
+    }
+
+
+def build_question_payload(data: CatalogData, correct: int, num_options: int = 4) -> bytes:
+    """Like build_question, but joins pre-encoded fragments into the JSON response body"""
+    clue_indexes, slots = _sample_question(data, correct, num_options)
+    encoded = data.encoded
+    clues = encoded.clues[correct]
+    return b"".join((
+        b'{"clues":[', b",".join([clues[i] for i in clue_indexes]),
+        b'],"options":[', b",".join([encoded.options[s] for s in slots]),
+        b'],"correct_answer":', encoded.cities[correct], b"}",
+    ))
+
+
+def build_neighbours(data: CatalogData) -> List[List[int]]:
+    """Per slot, the slots of the most similar destinations, most similar first"""
+    # Imported here so NumPy stays off the cold-start path until a difficulty is requested
+    from app.similarity import build_neighbour_table
+
+    texts = [list(data.clues[slot]) + list(data.fun_facts[slot]) + list(data.trivia[slot])
+             for slot in range(len(data.cities))]
+    table = build_neighbour_table(list(data.countries), texts, k=NEIGHBOURS)
+    return [[slot for slot in row if slot >= 0] for row in table.tolist()]
+
+
+class DestinationCatalog:
+    """Process-level cache of the cities collection.
+
+    Readers always see a complete snapshot: a refresh builds new arrays and
+    swaps them in with a single reference assignment.
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0):
+        self.ttl_seconds = ttl_seconds
+        self._data = EMPTY_CATALOG
+        self._neighbours: Tuple[CatalogData, List[List[int]]] = (EMPTY_CATALOG, [])
+        self._neighbours_task: Optional[asyncio.Task] = None
+        self._neighbours_failed: Optional[CatalogData] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._data.cities)
+
+    @property
+    def data(self) -> CatalogData:
+        return self._data
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._data.cities)
+
+    @property
+    def source(self) -> str:
+        return self._data.source
+
+    @property
+    def age(self) -> float:
+        return time.time() - self._data.loaded_at if self._data.loaded_at else float("inf")
+
+    async def load(self, repository) -> int:
+        """Reload the catalog from the repository and return the number of destinations"""
+        documents = await repository.list_destinations()
+        data = build_catalog_data(documents)
+        current = self._data
+        if data.fingerprint == current.fingerprint and data.source == current.source:
+            # Unchanged: keep the snapshot so the question pool, sampler and neighbour table stay valid
+            return len(current.cities)
+        self._data = data
+        await self.prepare_neighbours()
+        return len(data.cities)
+
+    def set_data(self, data: CatalogData):
+        """Swap in a snapshot built elsewhere, e.g. one mapped from a shared file"""
+        self._data = data
+        self._schedule_neighbours()
+
+    def load_file(self, path: str) -> int:
+        """Load the catalog from a JSON file such as the bundled data.json"""
+        with open(path, encoding="utf-8") as f:
+            data = build_catalog_data(json.load(f), source="snapshot")
+        self._data = data
+        self._schedule_neighbours()
+        return len(data.cities)
+
+    async def ensure_loaded(self, repository):
+        """Load the catalog on first use if startup could not"""
+        if not self.loaded:
+            await self.load(repository)
+
+    def neighbours(self, data: CatalogData) -> Optional[List[List[int]]]:
+        """The neighbour table of `data`, or None while it is being built in the background"""
+        built_for, table = self._neighbours
+        if built_for is not data:
+            self._schedule_neighbours()
+            return None
+        return table
+
+    def _schedule_neighbours(self) -> Optional[asyncio.Task]:
+        """Start building the table of the current snapshot unless it exists or is underway"""
+        data = self._data
+        if self._neighbours[0] is data or self._neighbours_failed is data:
+            return None
+        if self._neighbours_task is None or self._neighbours_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # No event loop (e.g. a CLI); the next request schedules it
+                return None
+            self._neighbours_task = loop.create_task(self._build_neighbours())
+        return self._neighbours_task
+
+    async def _build_neighbours(self):
+        # Building takes seconds for large catalogs, so it always runs off the event loop
+        while self._neighbours[0] is not self._data:
+            data = self._data
+            try:
+                table = await asyncio.to_thread(build_neighbours, data)
+            except Exception as e:
+                logger.error("Error building the destination similarity table: %s", e)
+                self._neighbours_failed = data
+                return
+            if self._data is data:
+                self._neighbours = (data, table)
+
+    async def prepare_neighbours(self):
+        """Build the neighbour table of the current snapshot off the event loop"""
+        task = self._schedule_neighbours()
+        if task is not None:
+            await asyncio.shield(task)
+
+    def pick_distractors(self, data: CatalogData, correct: int, count: int, difficulty: str) -> Optional[List[int]]:
+        """Distractor slots for a difficulty, or None to pick them uniformly (medium, and any
+        difficulty until the neighbour table of `data` is ready)"""
+        if difficulty not in ("easy", "hard"):
+            return None
+        table = self.neighbours(data)
+        if table is None:
+            return None
+        total = len(data.cities)
+        near = table[correct]
+        if difficulty == "hard":
+            # Vary among the closest few so hard questions do not always repeat the same options
+            picked = random.sample(near[:2 * count], min(count, len(near)))
+        else:
+            # Rejection sampling outside the neighbourhood, cheap because most slots qualify
+            excluded = set(near)
+            excluded.add(correct)
+            picked = []
+            for _ in range(20 * count):
+                slot = random.randrange(total)
+                if slot not in excluded:
+                    picked.append(slot)
+                    excluded.add(slot)
+                    if len(picked) == count:
+                        break
+        if len(picked) < count:
+            # Catalogs too small to fill the options this way get uniform ones
+            taken = set(picked)
+            taken.add(correct)
+            picked += random.sample([slot for slot in range(total) if slot not in taken], count - len(picked))
+        return picked
+
+    def slot_of(self, city: str) -> Optional[int]:
+        return self._data.index.get(city)
+
+    def random_fun_fact_json(self, city: str) -> Optional[bytes]:
+        """A JSON-encoded fun fact for a city, "" if it has none; None if the city is unknown"""
+        data = self._data
+        slot = data.index.get(city)
+        if slot is None:
+            return None
+        facts = data.encoded.fun_facts[slot]
+        return random.choice(facts) if facts else b'""'
+
+    def random_question(self, num_options: int = 4, difficulty: str = "medium") -> Optional[dict]:
+        """Build a question without touching the database; None if the catalog is empty"""
+        data = self._data
+        if not data.cities:
+            return None
+        return self.question(data, random.randrange(len(data.cities)), num_options, difficulty)
+
+    def question(self, data: CatalogData, correct: int, num_options: int = 4, difficulty: str = "medium") -> dict:
+        """Build the question about slot `correct` of `data` at a difficulty"""
+        distractors = self.pick_distractors(data, correct, min(num_options, len(data.cities)) - 1, difficulty)
+        return build_question(data, correct, num_options, distractors)
+
+    def random_questions(self, count: int, exclude: Iterable[str] = (), num_options: int = 4,
+                         difficulty: str = "medium",
+                         draw: Optional[Callable[[CatalogData], Optional[int]]] = None) -> List[dict]:
+        """Up to `count` questions about distinct destinations, preferring ones not in `exclude`.
+
+        With `draw` (e.g. AdaptiveSampler.draw) answers are drawn from it;
+        whatever it cannot supply is filled uniformly.
+        """
+        data = self._data
+        total = len(data.cities)
+        count = min(count, total)
+        if count <= 0:
+            return []
+        excluded = {data.index[city] for city in exclude if city in data.index}
+        answers: List[int] = []
+        if draw is not None:
+            picked = set(excluded)
+            # A bounded number of draws, since repeats and excluded slots are redrawn
+            for _ in range(count * 8):
+                slot = draw(data)
+                if slot is None:
+                    break
+                if slot not in picked:
+                    picked.add(slot)
+                    answers.append(slot)
+                    if len(answers) == count:
+                        break
+            excluded.update(answers)
+            count -= len(answers)
+        fresh = [slot for slot in range(total) if slot not in excluded]
+        if len(fresh) >= count:
+            answers += random.sample(fresh, count)
+        else:
+            # Not enough unseen destinations left, so top up with excluded ones
+            answers += random.sample(fresh, len(fresh)) + random.sample(sorted(excluded.difference(answers)),
+                                                                        count - len(fresh))
+        num_distractors = min(num_options, total) - 1
+        return [build_question(data, slot, num_options, self.pick_distractors(data, slot, num_distractors, difficulty))
+                for slot in answers]
+
+    async def _refresh_loop(self, get_database, refresh_now: bool):
+        delay = 0 if refresh_now else self.ttl_seconds
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                count = await self.load(await get_database())
+                logger.info("Loaded %d destinations into the catalog", count)
+                if self.ttl_seconds <= 0:
+                    return
+                delay = self.ttl_seconds
+            except Exception as e:
+                logger.error("Error refreshing destination catalog: %s", e)
+                # Retry sooner while requests are still served from a bundled snapshot
+                if self.source == "snapshot" or self.ttl_seconds <= 0:
+                    delay = SNAPSHOT_RETRY_SECONDS
+                else:
+                    delay = self.ttl_seconds
+
+    def start_background_refresh(self, get_database, refresh_now: bool = False):
+        """Refresh the catalog every ttl_seconds until stopped, optionally loading right away"""
+        if (self.ttl_seconds > 0 or refresh_now) and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop(get_database, refresh_now))
+
+    async def stop_background_refresh(self):
+        if self._neighbours_task is not None:
+            self._neighbours_task.cancel()
+            self._neighbours_task = None
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
@@ -0,0 +1,97 @@
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class CORSMiddleware:
+    """Pure ASGI CORS layer.
+
+    Preflight requests are answered here with Access-Control-Max-Age so
+    browsers can cache them; other responses get the CORS headers appended to
+    their raw header list when the response starts. All header values are
+    encoded once at startup.
+    """
+
+    def __init__(self, app, allow_origins: Sequence[str] = ("*",),
+                 allow_methods: Sequence[str] = ("GET", "POST", "PUT", "DELETE", "OPTIONS"),
+                 allow_headers: Sequence[str] = ("Content-Type", "Authorization", "X-Requested-With"),
+                 expose_headers: Sequence[str] = (), max_age: int = 86400):
+        self.app = app
+        self.allow_all_origins = "*" in allow_origins
+        self.allow_origins = {origin.encode("latin-1") for origin in allow_origins if origin != "*"}
+
+        self._simple_headers: Headers = []
+        if expose_headers:
+            self._simple_headers.append((b"access-control-expose-headers", ", ".join(expose_headers).encode("latin-1")))
+        self._preflight_headers: Headers = [
+            (b"access-control-allow-methods", ", ".join(allow_methods).encode("latin-1")),
+            (b"access-control-allow-headers", ", ".join(allow_headers).encode("latin-1")),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+        if self.allow_all_origins:
+            wildcard = [(b"access-control-allow-origin", b"*")]
+            self._simple_headers = wildcard + self._simple_headers
+            self._preflight_headers = wildcard + self._preflight_headers
+
+    def _origin_headers(self, origin: bytes, base: Headers) -> Optional[Headers]:
+        """Headers for a request from `origin`, or None when the origin is not allowed"""
+        if self.allow_all_origins:
+            return base
+        if origin in self.allow_origins:
+            # The response differs per origin, so shared caches must key on it
+            return [(b"access-control-allow-origin", origin), (b"vary", b"Origin")] + base
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        preflight = False
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                preflight = True
+
+        if preflight and origin is not None and scope["method"] == "OPTIONS":
+            headers = self._origin_headers(origin, self._preflight_headers)
+            if headers is None:
+                await send({"type": "http.response.start", "status": 400,
+                            "headers": [(b"content-type", b"text/plain; charset=utf-8")]})
+                await send({"type": "http.response.body", "body": b"Disallowed CORS origin"})
+                return
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if self.allow_all_origins:
+            extra = self._simple_headers
+        elif origin is not None:
+            extra = self._origin_headers(origin, self._simple_headers) or [(b"vary", b"Origin")]
+        else:
+            extra = [(b"vary", b"Origin")]
+        response_started = False
+
+        async def send_with_cors(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+                message["headers"] = list(message.get("headers", [])) + extra
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cors)
+        except Exception:
+            if response_started:
+                raise
+            # Unhandled errors still carry CORS headers so the browser can read the 500
+            logger.exception("Unhandled error in %s %s", scope["method"], scope["path"])
+            await send({"type": "http.response.start", "status": 500,
+                        "headers": [(b"content-type", b"application/json")] + extra})
+            await send({"type": "http.response.body", "body": b'{"detail":"Internal Server Error"}'})
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.server_api import ServerApi
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Count CMAP events so the pool can be inspected without touching pymongo internals"""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # events fire from pymongo's background threads too
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failed = 0
+        self.pools_cleared = 0
+
+    def _bump(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump("pools_cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump("created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump("closed")
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._bump("checked_out")
+
+    def connection_checked_in(self, event):
+        self._bump("checked_in")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "in_use": self.checked_out - self.checked_in,
+                "created": self.created,
+                "closed": self.closed,
+                "checkouts": self.checked_out,
+                "checkout_failures": self.checkout_failed,
+                "pool_clears": self.pools_cleared,
+            }
+
+
+class ConnectionManager:
+    """Owns the single MongoDB client and connection pool of this process"""
+
+    def __init__(self, uri: str, database_name: str = "city_data",
+                 max_pool_size: int = 100, min_pool_size: int = 0,
+                 max_idle_time_ms: Optional[int] = None, wait_queue_timeout_ms: Optional[int] = None,
+                 connect_timeout_ms: int = 5000, socket_timeout_ms: int = 5000,
+                 server_selection_timeout_ms: int = 5000, ping_on_connect: bool = True,
+                 event_listeners: Optional[list] = None):
+        self.uri = uri
+        self.ping_on_connect = ping_on_connect
+        self.database_name = database_name
+        self.options = {
+            "maxPoolSize": max_pool_size,
+            "minPoolSize": min_pool_size,
+            "maxIdleTimeMS": max_idle_time_ms,
+            "waitQueueTimeoutMS": wait_queue_timeout_ms,
+            "connectTimeoutMS": connect_timeout_ms,
+            "socketTimeoutMS": socket_timeout_ms,
+            "serverSelectionTimeoutMS": server_selection_timeout_ms,
+        }
+        self.pool_listener = PoolStatsListener()
+        self.event_listeners = [self.pool_listener] + list(event_listeners or [])
+        self._client: Optional[AsyncIOMotorClient] = None
+        self._connected = False
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def client(self) -> AsyncIOMotorClient:
+        """The shared client, created on first use without any network I/O"""
+        if self._client is None:
+            options = {key: value for key, value in self.options.items() if value is not None}
+            self._client = AsyncIOMotorClient(
+                self.uri,
+                server_api=ServerApi('1'),
+                event_listeners=self.event_listeners,
+                **options
+            )
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.database_name]
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    async def connect(self):
+        """Ping the server once and return the database handle"""
+        if self._connected:
+            return self.db
+        if not self.ping_on_connect:
+            # The first real query pays for server selection instead of a separate ping
+            self._connected = True
+            return self.db
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if not self._connected:
+                await self.client.admin.command('ping')
+                self._connected = True
+                logger.info("Successfully connected to MongoDB Atlas!")
+        return self.db
+
+    async def warm_up(self, connections: Optional[int] = None) -> int:
+        """Open `connections` pooled sockets up front by running that many pings concurrently"""
+        connections = connections or self.options["minPoolSize"] or 1
+        await asyncio.gather(*(self.client.admin.command('ping') for _ in range(connections)))
+        return self.pool_listener.snapshot()["open_connections"]
+
+    def pool_stats(self) -> dict:
+        stats = self.pool_listener.snapshot()
+        stats["max_pool_size"] = self.options["maxPoolSize"]
+        stats["min_pool_size"] = self.options["minPoolSize"]
+        return stats
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        self._connected = False
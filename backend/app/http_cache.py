@@ -0,0 +1,84 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Response
+
+
+def weak_etag(*parts) -> str:
+    """Weak validator derived from the values a response body depends on"""
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode("utf-8"), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def cache_control(s_maxage: int, max_age: int = 0, stale_while_revalidate: int = 0) -> str:
+    """Cache-Control for shared caches (the Vercel edge) that browsers revalidate"""
+    value = f"public, max-age={max_age}, s-maxage={s_maxage}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={stale_while_revalidate}"
+    return value
+
+
+def not_modified(etag: str, cache_control_value: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control_value})
+
+
+class UserCache:
+    """Short-lived LRU of user documents keyed by username.
+
+    Entries expire after `ttl_seconds` so writes made by other workers show
+    up within that window; this worker's own score writes invalidate the
+    entry immediately.
+    """
+
+    def __init__(self, ttl_seconds: float = 5.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, username: str) -> Optional[dict]:
+        entry = self._entries.get(username)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, username: str, user: dict):
+        if self.ttl_seconds <= 0:
+            return
+        self._entries[username] = (time.monotonic() + self.ttl_seconds, user)
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,81 @@
+import logging
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+
+# Indexes every deployment needs, keyed by collection
+REQUIRED_INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("score", DESCENDING)], name="score_desc"),
+    ],
+    "cities": [
+        IndexModel([("city", ASCENDING)], name="city_unique", unique=True),
+    ],
+    # Answered question tokens, removed once they could no longer be verified anyway
+    "question_tokens": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+def _hot_queries():
+    """The queries that run on every request, as (label, collection, cursor factory)"""
+    return [
+        ("users by username", "users", lambda db: db.users.find({"username": "__explain__"})),
+        ("cities by city", "cities", lambda db: db.cities.find({"city": "__explain__"})),
+        ("users ranked by score", "users", lambda db: db.users.find({}).sort("score", DESCENDING).limit(10)),
+    ]
+
+
+async def ensure_indexes(db, collections=None) -> Tuple[List[str], Dict[str, str]]:
+    """Create any missing indexes; returns the names that exist afterwards and the errors by collection"""
+    created = []
+    errors = {}
+    for collection, indexes in REQUIRED_INDEXES.items():
+        if collections is not None and collection not in collections:
+            continue
+        try:
+            created.extend(await db[collection].create_indexes(indexes))
+        except Exception as e:
+            # Usually duplicate values that block a unique index; keep starting up but report it
+            logger.error("Error creating indexes on %s: %s", collection, e)
+            errors[collection] = str(e)
+    return created, errors
+
+
+def _plan_stages(plan) -> List[str]:
+    """Flatten the stage names of an explain() winning plan"""
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        if "queryPlan" in node:
+            pending.append(node["queryPlan"])
+        if "inputStage" in node:
+            pending.append(node["inputStage"])
+        pending.extend(node.get("inputStages", []))
+    return stages
+
+
+async def verify_query_plans(db) -> List[Tuple[str, List[str]]]:
+    """Explain each hot query and warn about the ones that fall back to COLLSCAN"""
+    collscans = []
+    for label, collection, make_cursor in _hot_queries():
+        try:
+            explanation = await make_cursor(db).explain()
+        except Exception as e:
+            logger.warning("Could not explain query '%s': %s", label, e)
+            continue
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in stages:
+            logger.warning("Query '%s' on %s uses a collection scan (%s)", label, collection, " -> ".join(stages))
+            collscans.append((label, stages))
+    return collscans
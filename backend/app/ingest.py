@@ -0,0 +1,260 @@
+"""Load destinations from a JSON file into the cities collection.
+
+The file is a JSON array of destination objects, such as data.json. It is
+parsed incrementally, each record is validated against the Destination
+model, and only new or changed destinations are written, in batched
+unordered bulk upserts. A content hash stored with each city tells whether
+a destination changed.
+
+Usage (from the backend directory):
+    python -m app.ingest data.json
+    python -m app.ingest data.json --dry-run
+    python -m app.ingest data.json --prune --refresh-url https://globetrotterbackend.vercel.app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import urllib.request
+from typing import Dict, Iterator, List, Optional, TextIO
+
+from pydantic import ValidationError
+from pymongo import DeleteMany, UpdateOne
+
+from app.models import Destination
+
+logger = logging.getLogger(__name__)
+
+HASH_FIELD = "content_hash"
+_WHITESPACE = " \t\r\n"
+# Matches when only characters that can continue a number follow, e.g. "-0.5" cut short of "-0.5e3"
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*\Z")
+
+
+def iter_json_array(f: TextIO, chunk_size: int = 1 << 16) -> Iterator[object]:
+    """Yield the elements of a top-level JSON array without reading the whole file.
+
+    Raises ValueError on anything that is not a well-formed array, such as a
+    missing or extra comma.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    # "start" before the "[", "first" right after it, "value" after a comma, "next" after an element
+    state, count = "start", 0
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of file: the JSON array is not closed")
+            chunk = f.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise ValueError("Expected a JSON array of destinations")
+            pos, state = pos + 1, "first"
+            continue
+        if state == "next":
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' after element {count}")
+            pos, state = pos + 1, "value"
+            continue
+        if char == "]" and state == "first":
+            return
+        if char in ",]":
+            raise ValueError(f"Expected element {count + 1}, found {char!r}")
+
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            end = len(buffer)
+        if not eof and _NUMBER_TAIL.match(buffer, end):
+            # The element may continue past the buffered input (a number can decode cut short)
+            chunk = f.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        yield element
+        pos, state, count = end, "next", count + 1
+
+
+def content_hash(destination: Destination) -> str:
+    """Stable hash of the fields of a destination"""
+    canonical = json.dumps(destination.model_dump(), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class IngestReport:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors: List[str] = []
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def as_dict(self) -> dict:
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "deleted": self.deleted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": self.errors[:20],
+        }
+
+
+async def load_existing_hashes(db) -> Dict[str, Optional[str]]:
+    """city -> stored content hash (None for documents written before hashes existed)"""
+    hashes = {}
+    async for doc in db.cities.find({}, {"_id": 0, "city": 1, HASH_FIELD: 1}):
+        hashes[doc["city"]] = doc.get(HASH_FIELD)
+    return hashes
+
+
+async def ingest(db, records, batch_size: int = 1000, prune: bool = False,
+                 dry_run: bool = False, catalog=None, repository=None) -> IngestReport:
+    """Upsert changed destinations from `records` and return what was done.
+
+    With `prune`, cities missing from `records` are deleted. Cities whose
+    record failed validation are kept, and nothing is pruned when an invalid
+    record does not name its city. When a DestinationCatalog is given and
+    anything changed, it is reloaded from `repository` (a Repository over
+    the same database).
+    """
+    if catalog is not None and repository is None:
+        raise ValueError("Reloading the catalog needs the repository to read it from")
+    report = IngestReport()
+    existing = await load_existing_hashes(db)
+    seen = set()
+    # Cities of invalid records, which pruning must not delete
+    kept = set()
+    unnamed_invalid = False
+    batch: List[UpdateOne] = []
+
+    async def write(operations):
+        if operations and not dry_run:
+            await db.cities.bulk_write(operations, ordered=False)
+
+    for position, record in enumerate(records):
+        report.read += 1
+        try:
+            destination = Destination.model_validate(record)
+        except ValidationError as e:
+            report.invalid += 1
+            city = record.get("city") if isinstance(record, dict) else None
+            report.errors.append(f"record {position} ({city}): {e.errors()[0]['msg']}")
+            if isinstance(city, str):
+                kept.add(city)
+            else:
+                unnamed_invalid = True
+            continue
+
+        city = destination.city
+        if city in seen:
+            # The catalog keeps the first record of a city, so do the same here
+            report.duplicates += 1
+            continue
+        seen.add(city)
+
+        digest = content_hash(destination)
+        if city not in existing:
+            report.inserted += 1
+        elif existing[city] != digest:
+            report.updated += 1
+        else:
+            report.unchanged += 1
+            continue
+
+        batch.append(UpdateOne({"city": city}, {"$set": {**destination.model_dump(), HASH_FIELD: digest}}, upsert=True))
+        if len(batch) >= batch_size:
+            await write(batch)
+            batch = []
+    await write(batch)
+
+    if prune and unnamed_invalid:
+        report.errors.append("not pruning: an invalid record has no city, so it may be an existing one")
+    elif prune:
+        stale = [city for city in existing if city not in seen and city not in kept]
+        report.deleted = len(stale)
+        for start in range(0, len(stale), batch_size):
+            await write([DeleteMany({"city": {"$in": stale[start:start + batch_size]}})])
+
+    if catalog is not None and report.changed and not dry_run:
+        count = await catalog.load(repository)
+        logger.info("Reloaded the destination catalog with %d destinations", count)
+    return report
+
+
+async def ingest_file(path: str, db, **options) -> IngestReport:
+    """ingest() over the records of a JSON file, streamed from disk"""
+    with open(path, encoding="utf-8") as f:
+        return await ingest(db, iter_json_array(f), **options)
+
+
+def request_catalog_refresh(base_url: str, admin_token: str, timeout: float = 10.0) -> dict:
+    """Ask a running API to reload its catalog through POST /admin/catalog/refresh"""
+    request = urllib.request.Request(
+        base_url.rstrip("/") + "/admin/catalog/refresh",
+        method="POST",
+        headers={"X-Admin-Token": admin_token},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+async def _main(args) -> IngestReport:
+    from app.database import ConnectionManager
+
+    manager = ConnectionManager(args.mongodb_uri, database_name=args.database)
+    try:
+        db = await manager.connect()
+        return await ingest_file(args.path, db, batch_size=args.batch_size, prune=args.prune, dry_run=args.dry_run)
+    finally:
+        manager.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSON array of destinations, e.g. data.json")
+    parser.add_argument("--mongodb-uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="city_data")
+    parser.add_argument("--batch-size", type=int, default=1000, help="operations per bulk_write")
+    parser.add_argument("--prune", action="store_true", help="delete cities that are not in the file")
+    parser.add_argument("--dry-run", action="store_true", help="report the changes without writing them")
+    parser.add_argument("--refresh-url", help="API base URL whose catalog should be reloaded afterwards")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN", ""))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    report = asyncio.run(_main(args))
+    print(json.dumps(report.as_dict(), indent=2))
+
+    if args.refresh_url and report.changed and not args.dry_run:
+        print(json.dumps(request_catalog_refresh(args.refresh_url, args.admin_token)))
+    sys.exit(1 if report.invalid else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class FenwickTree:
+    """Binary indexed tree of counts per score, growing as higher scores appear"""
+
+    def __init__(self, size: int = 1024):
+        self._size = 1
+        while self._size < size:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+
+    def _grow(self, index: int):
+        counts = [self.prefix_sum(i) - self.prefix_sum(i - 1) for i in range(self._size)]
+        while self._size <= index:
+            self._size *= 2
+        self._tree = [0] * (self._size + 1)
+        for i, count in enumerate(counts):
+            if count:
+                self.add(i, count)
+
+    def add(self, index: int, delta: int):
+        if index >= self._size:
+            self._grow(index)
+        i = index + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, index: int) -> int:
+        """Sum of counts for scores 0..index inclusive"""
+        if index < 0:
+            return 0
+        i = min(index + 1, self._size)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find_kth(self, k: int) -> int:
+        """Smallest score whose prefix sum reaches k (1-based)"""
+        position = 0
+        step = self._size
+        while step:
+            nxt = position + step
+            if nxt <= self._size and self._tree[nxt] < k:
+                position = nxt
+                k -= self._tree[nxt]
+            step //= 2
+        return position
+
+
+class Leaderboard:
+    """In-process ranking of users by score.
+
+    Counts per score live in a Fenwick tree, so rank and the start of any
+    top-N page are found in O(log max_score). Users with the same score are
+    kept in a sorted list per score and ordered by username. Each worker
+    applies its own score updates as they happen, and a periodic reconcile
+    against the users collection picks up writes made by other workers.
+    """
+
+    def __init__(self, reconcile_seconds: float = 300.0,
+                 score_adjuster: Optional[Callable[[str], int]] = None):
+        self.reconcile_seconds = reconcile_seconds
+        # Returns score changes not yet in the database (e.g. buffered writes) for a user
+        self.score_adjuster = score_adjuster
+        self._scores: Dict[str, int] = {}
+        self._buckets: Dict[int, List[str]] = {}
+        self._counts = FenwickTree()
+        self._loaded = False
+        # Changes made while a reconcile awaits the database, {username: score or None if removed}
+        self._journals: List[Dict[str, Optional[int]]] = []
+        self.reconciled_at = 0.0
+        self._reconcile_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._scores)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _insert(self, username: str, score: int):
+        self._scores[username] = score
+        bisect.insort(self._buckets.setdefault(score, []), username)
+        self._counts.add(score, 1)
+
+    def _remove(self, username: str, score: int):
+        bucket = self._buckets[score]
+        del bucket[bisect.bisect_left(bucket, username)]
+        if not bucket:
+            del self._buckets[score]
+        self._counts.add(score, -1)
+        del self._scores[username]
+
+    def update(self, username: str, score: int):
+        """Record the current score of a user"""
+        score = max(0, int(score))
+        for journal in self._journals:
+            journal[username] = score
+        previous = self._scores.get(username)
+        if previous == score:
+            return
+        if previous is not None:
+            self._remove(username, previous)
+        self._insert(username, score)
+
+    def remove(self, username: str):
+        for journal in self._journals:
+            journal[username] = None
+        score = self._scores.get(username)
+        if score is not None:
+            self._remove(username, score)
+
+    def score_of(self, username: str) -> Optional[int]:
+        return self._scores.get(username)
+
+    def rank(self, username: str) -> Optional[dict]:
+        """Competition rank (ties share a rank) and percentile of a user, or None if unknown"""
+        score = self._scores.get(username)
+        if score is None:
+            return None
+        total = len(self._scores)
+        higher = total - self._counts.prefix_sum(score)
+        lower = self._counts.prefix_sum(score - 1)
+        return {
+            "username": username,
+            "score": score,
+            "rank": higher + 1,
+            "total_players": total,
+            "percentile": round(100.0 * lower / total, 2),
+        }
+
+    def top(self, limit: int = 10, offset: int = 0) -> List[dict]:
+        """A page of the leaderboard, highest score first"""
+        total = len(self._scores)
+        entries = []
+        position = max(0, offset)
+        while len(entries) < limit and position < total:
+            # The (position + 1)-th user from the top is the (total - position)-th from the bottom
+            score = self._counts.find_kth(total - position)
+            higher = total - self._counts.prefix_sum(score)
+            bucket = self._buckets[score]
+            start = position - higher
+            taken = bucket[start:start + limit - len(entries)]
+            entries.extend({"rank": higher + 1, "username": username, "score": score} for username in taken)
+            position += len(taken)
+        return entries
+
+    def replace_all(self, scores: Dict[str, int]):
+        """Rebuild the ranking from a full {username: score} mapping"""
+        fresh = Leaderboard(self.reconcile_seconds)
+        for username, score in scores.items():
+            fresh._insert(username, max(0, int(score)))
+        self._scores, self._buckets, self._counts = fresh._scores, fresh._buckets, fresh._counts
+        self._loaded = True
+        self.reconciled_at = time.time()
+
+    async def reconcile(self, repository) -> int:
+        """Reload every user's score from the repository and return the number of players"""
+        journal: Dict[str, Optional[int]] = {}
+        self._journals.append(journal)
+        try:
+            scores = await repository.user_scores()
+        finally:
+            self._journals.remove(journal)
+        if self.score_adjuster is not None:
+            for username in scores:
+                scores[username] += self.score_adjuster(username)
+        # Updates made during the read may be missing from it, so they win over what was read
+        for username, score in journal.items():
+            if score is None:
+                scores.pop(username, None)
+            else:
+                scores[username] = score
+        self.replace_all(scores)
+        return len(self._scores)
+
+    async def ensure_loaded(self, repository):
+        if not self._loaded:
+            await self.reconcile(repository)
+
+    async def _reconcile_loop(self, get_database, reconcile_now: bool):
+        delay = 0 if reconcile_now else self.reconcile_seconds
+        while True:
+            await asyncio.sleep(delay)
+            delay = self.reconcile_seconds
+            try:
+                count = await self.reconcile(await get_database())
+                logger.info("Reconciled leaderboard with %d players", count)
+            except Exception as e:
+                logger.error("Error reconciling leaderboard: %s", e)
+
+    def start_background_reconcile(self, get_database, reconcile_now: bool = False):
+        """Reconcile with the database every reconcile_seconds until stopped"""
+        if self.reconcile_seconds > 0 and self._reconcile_task is None:
+            self._reconcile_task = asyncio.create_task(self._reconcile_loop(get_database, reconcile_now))
+
+    async def stop_background_reconcile(self):
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            try:
+                await self._reconcile_task
+            except asyncio.CancelledError:
+                pass
+            self._reconcile_task = None
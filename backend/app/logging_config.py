@@ -0,0 +1,144 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+# (request id, perf_counter at request start) of the request being handled
+_request_context: ContextVar[Optional[Tuple[str, float]]] = ContextVar("request_context", default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id", "duration_ms"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp each record with the request id and the time since the request started"""
+
+    def filter(self, record):
+        context = _request_context.get()
+        if context is None:
+            record.request_id = None
+            record.duration_ms = None
+        else:
+            record.request_id = context[0]
+            record.duration_ms = round((time.perf_counter() - context[1]) * 1000, 3)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "duration_ms", None) is not None:
+            entry["duration_ms"] = record.duration_ms
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        elif record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with their message resolved but leave JSON encoding and I/O to the listener"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = "INFO", logger_name: str = "app") -> logging.Logger:
+    """Send records from `logger_name` through a queue to a JSON stream handler on a background thread"""
+    global _listener
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(level.upper())
+    if _listener is not None:
+        return logger
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    return logger
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware that assigns a request id and logs one record per request with its duration"""
+
+    def __init__(self, app, logger: logging.Logger):
+        self.app = app
+        self.logger = logger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+        header_value = request_id.encode("latin-1")
+
+        start = time.perf_counter()
+        token = _request_context.set((request_id, start))
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", header_value)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(
+                    "%s %s %d",
+                    scope["method"], scope["path"], status_code,
+                    extra={"method": scope["method"], "path": scope["path"], "status": status_code},
+                )
+            _request_context.reset(token)
@@ -1,23 +1,49 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request, Response
-from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
+from fastapi import FastAPI, HTTPException, Depends, Query, status, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import random
+from typing import List, Literal, Optional, Tuple
 import os
 import json
+import logging
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+import random
 import secrets
-from dotenv import load_dotenv
+import time
 import urllib.parse
-from functools import lru_cache
 from contextlib import asynccontextmanager
-
-# Load environment variables
-load_dotenv()
+from app.admission import AdmissionMiddleware, ConcurrencyLimiter, TokenBuckets
+from app.catalog import DestinationCatalog
+from app.cors import CORSMiddleware
+from app.database import ConnectionManager
+from app.http_cache import UserCache, cache_control, etag_matches, not_modified, weak_etag
+from app.indexes import verify_query_plans
+from app.leaderboard import Leaderboard
+from app.metrics import MetricsMiddleware, MetricsRegistry
+from app.models import Destination
+from app.question_pool import QuestionPool, append_token, encode_question
+from app.question_tokens import InvalidQuestionToken, QuestionTokenSigner, token_id
+from app.repository import DuplicateUserError, EmbeddedRepository, MongoRepository
+from app.sampling import AdaptiveSampler
+from app.seen import SEEN_PROJECTION, SeenSets
+from app.sessions import SessionStore, SessionStoreFull
+from app.snapshot import SharedCatalogSnapshot
+from app.write_behind import ScoreWriteBuffer
+from app.responses import FastJSONResponse, dumps
+from app.logging_config import RequestLoggingMiddleware, setup_logging
+
+# Load environment variables (Vercel injects them directly, so skip the .env lookup there)
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# Serverless cold-start mode: no startup round trips, destinations from the bundled data.json
+COLD_START_MODE = os.getenv("COLD_START_MODE", "true" if os.getenv("VERCEL") else "false").lower() in ("1", "true", "yes")
+BUNDLED_DATA_PATH = os.getenv("BUNDLED_DATA_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data.json"))
+
+# Structured JSON logs, written from a background thread
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+setup_logging(LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 # Database connection variables
 MONGODB_USERNAME = os.getenv("MONGODB_USERNAME", "")
@@ -30,110 +56,360 @@ if MONGODB_USERNAME and MONGODB_PASSWORD:
 else:
     MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 
-# Global variables for database connections
-client = None
-db = None
+# Admin token for maintenance endpoints (disabled when unset)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# JWT settings
+SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+
+# Signed question tokens; every worker must share SECRET_KEY to verify each other's tokens
+QUESTION_TOKEN_MAX_AGE_SECONDS = float(os.getenv("QUESTION_TOKEN_MAX_AGE_SECONDS", "3600"))
+QUESTION_TOKEN_REQUIRED = os.getenv("QUESTION_TOKEN_REQUIRED", "true").lower() in ("1", "true", "yes")
+if QUESTION_TOKEN_REQUIRED and not os.getenv("SECRET_KEY"):
+    # With a per-process random key, answers reaching another worker or instance would all be rejected
+    logger.error("QUESTION_TOKEN_REQUIRED needs a SECRET_KEY shared by every worker; "
+                 "accepting correct_city until one is set")
+    QUESTION_TOKEN_REQUIRED = False
+question_tokens = QuestionTokenSigner(SECRET_KEY, max_age_seconds=QUESTION_TOKEN_MAX_AGE_SECONDS)
+
+# Request, MongoDB command and cache metrics served at /metrics
+metrics = MetricsRegistry()
+
+# The one MongoDB client of this process and its pool settings
+connection_manager = ConnectionManager(
+    MONGODB_URI,
+    max_pool_size=int(os.getenv("MONGODB_MAX_POOL_SIZE", "100")),
+    min_pool_size=int(os.getenv("MONGODB_MIN_POOL_SIZE", "2")),
+    max_idle_time_ms=int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "60000")),
+    wait_queue_timeout_ms=int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+    ping_on_connect=not COLD_START_MODE,
+    event_listeners=[metrics.command_listener],
+)
+
+# Where users and destinations are stored: "mongodb", or "embedded" to run without a database
+# (destinations from BUNDLED_DATA_PATH, users in memory and optionally in a snapshot file)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongodb").lower()
+if STORAGE_BACKEND == "embedded":
+    repository = EmbeddedRepository(
+        BUNDLED_DATA_PATH,
+        snapshot_path=os.getenv("EMBEDDED_SNAPSHOT_PATH") or None,
+        snapshot_seconds=float(os.getenv("EMBEDDED_SNAPSHOT_SECONDS", "5")),
+    )
+else:
+    repository = MongoRepository(connection_manager)
+
+# In-memory destination catalog, refreshed in the background
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+catalog = DestinationCatalog(ttl_seconds=CATALOG_TTL_SECONDS)
+
+# Optional memory-mapped catalog file shared by all workers on the host; one worker
+# rebuilds it every CATALOG_TTL_SECONDS and the others remap it when its version changes
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+catalog_snapshot = SharedCatalogSnapshot(
+    catalog,
+    CATALOG_SNAPSHOT_PATH,
+    max_age_seconds=CATALOG_TTL_SECONDS,
+    check_seconds=float(os.getenv("CATALOG_SNAPSHOT_CHECK_SECONDS", "5")),
+) if CATALOG_SNAPSHOT_PATH else None
+
+# Ready-to-serve /game/question payloads, refilled in the background
+QUESTION_POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "2048"))
+QUESTION_POOL_REPEATS = os.getenv("QUESTION_POOL_REPEATS", "false").lower() in ("1", "true", "yes")
+# Upper bound on rounds fetched by one GET /game/questions request
+QUESTION_BATCH_MAX = int(os.getenv("QUESTION_BATCH_MAX", "20"))
+# Per-city answer statistics; with ADAPTIVE_SAMPLING the pool draws answers weighted by them
+ADAPTIVE_SAMPLING = os.getenv("ADAPTIVE_SAMPLING", "false").lower() in ("1", "true", "yes")
+question_sampler = AdaptiveSampler(
+    catalog,
+    drift_threshold=float(os.getenv("SAMPLING_DRIFT_THRESHOLD", "0.05")),
+    recent_window=int(os.getenv("SAMPLING_RECENT_WINDOW", "20")),
+)
+question_pool = QuestionPool(catalog, capacity=QUESTION_POOL_SIZE, allow_repeats=QUESTION_POOL_REPEATS,
+                             token_issuer=question_tokens.issue,
+                             sampler=question_sampler if ADAPTIVE_SAMPLING else None)
+
+# Per-user seen-destination bitsets: /game/question?username= asks about unseen destinations first
+seen_sets = SeenSets(ttl_seconds=float(os.getenv("SEEN_CACHE_TTL_SECONDS", "60")),
+                     max_entries=int(os.getenv("SEEN_CACHE_MAX_ENTRIES", "10000")))
+
+# Optional write-behind mode: coalesce score increments and flush them with bulk_write
+SCORE_WRITE_BEHIND = os.getenv("SCORE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+score_buffer = ScoreWriteBuffer(
+    flush_interval_ms=int(os.getenv("SCORE_FLUSH_INTERVAL_MS", "250")),
+    max_pending_events=int(os.getenv("SCORE_FLUSH_MAX_EVENTS", "500")),
+    drain_timeout_seconds=float(os.getenv("SCORE_FLUSH_DRAIN_TIMEOUT_SECONDS", "5")),
+)
+
+# HTTP caching: a short in-process user cache plus Cache-Control for the Vercel edge
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "5"))
+user_cache = UserCache(ttl_seconds=USER_CACHE_TTL_SECONDS)
+USER_CACHE_CONTROL = cache_control(s_maxage=int(os.getenv("USER_S_MAXAGE_SECONDS", "5")), stale_while_revalidate=30)
+# Challenge links are shared widely and a slightly stale score is fine there
+CHALLENGE_CACHE_CONTROL = cache_control(s_maxage=int(os.getenv("CHALLENGE_S_MAXAGE_SECONDS", "60")), stale_while_revalidate=300)
+HEALTH_CACHE_CONTROL = cache_control(s_maxage=int(os.getenv("HEALTH_S_MAXAGE_SECONDS", "5")))
+# Questions are random and carry a fresh token, so no cache may reuse them
+NO_STORE = "no-store"
+
+# Ranking of all users by score, kept current by update_user_score
+LEADERBOARD_RECONCILE_SECONDS = float(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "300"))
+LEADERBOARD_MAX_PAGE_SIZE = 100
+leaderboard = Leaderboard(reconcile_seconds=LEADERBOARD_RECONCILE_SECONDS, score_adjuster=score_buffer.pending_score)
+
+# Timed game sessions, kept in this worker's memory (clients must stick to one worker)
+SESSION_MAX_ROUNDS = int(os.getenv("SESSION_MAX_ROUNDS", "50"))
+SESSION_MAX_SECONDS = float(os.getenv("SESSION_MAX_SECONDS", "3600"))
+
+
+def session_results_written(batch: dict):
+    """Reflect session results written by the expiry task in the caches"""
+    for username, deltas in batch.items():
+        user_cache.invalidate(username)
+        score = leaderboard.score_of(username)
+        if score is not None:
+            leaderboard.update(username, score + deltas["score"])
+
+
+session_store = SessionStore(
+    max_bytes=int(float(os.getenv("SESSION_MAX_MEMORY_MB", "64")) * 1024 * 1024),
+    result_ttl_seconds=float(os.getenv("SESSION_RESULT_TTL_SECONDS", "60")),
+    tick_seconds=float(os.getenv("SESSION_TICK_SECONDS", "1")),
+    on_written=session_results_written,
+)
+
+# Admission control: per-route concurrency limits that shrink while MongoDB is slow, a short
+# wait queue beyond them (503 + Retry-After once full or past the deadline) and token buckets
+ADMISSION_QUEUE_TIMEOUT_MS = int(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "250"))
+ADMISSION_TARGET_DB_LATENCY_MS = float(os.getenv("ADMISSION_TARGET_DB_LATENCY_MS", "100"))
+
+
+def admission_limiter(max_limit: int) -> ConcurrencyLimiter:
+    return ConcurrencyLimiter(
+        max_limit,
+        max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", str(max_limit))),
+        queue_timeout=ADMISSION_QUEUE_TIMEOUT_MS / 1000,
+        target_db_latency=ADMISSION_TARGET_DB_LATENCY_MS / 1000,
+    )
+
+
+# Every route that can reach the database, with the setting of its concurrency limit; each gets its own
+# limiter. Health, metrics and admin routes are never shed.
+ADMISSION_ROUTES = {
+    ("POST", "/game/answer"): ("ADMISSION_LIMIT_ANSWER", 64),
+    ("POST", "/users"): ("ADMISSION_LIMIT_USERS", 16),
+    ("DELETE", "/users/{username}"): ("ADMISSION_LIMIT_USERS", 16),
+    ("GET", "/game/question"): ("ADMISSION_LIMIT_QUESTION", 128),
+    ("GET", "/game/questions"): ("ADMISSION_LIMIT_QUESTION", 128),
+    ("GET", "/users/{username}"): ("ADMISSION_LIMIT_READ", 128),
+    ("GET", "/users/{username}/rank"): ("ADMISSION_LIMIT_READ", 128),
+    ("GET", "/game/challenge/{username}"): ("ADMISSION_LIMIT_READ", 128),
+    ("GET", "/leaderboard"): ("ADMISSION_LIMIT_READ", 128),
+    ("POST", "/game/session"): ("ADMISSION_LIMIT_SESSION", 64),
+    ("GET", "/game/session/{session_id}"): ("ADMISSION_LIMIT_SESSION", 64),
+    ("GET", "/game/session/{session_id}/question"): ("ADMISSION_LIMIT_SESSION", 64),
+    ("POST", "/game/session/{session_id}/answer"): ("ADMISSION_LIMIT_SESSION", 64),
+}
+admission_limiters = {route: admission_limiter(int(os.getenv(setting, str(default))))
+                      for route, (setting, default) in ADMISSION_ROUTES.items()}
+# Requests per second and burst size; 0 disables the limit
+ip_rate_limit = TokenBuckets(float(os.getenv("RATE_LIMIT_IP_PER_SECOND", "0")),
+                             float(os.getenv("RATE_LIMIT_IP_BURST", "40")))
+user_rate_limit = TokenBuckets(float(os.getenv("RATE_LIMIT_USER_PER_SECOND", "0")),
+                               float(os.getenv("RATE_LIMIT_USER_BURST", "10")))
+
+
+def admission_stats() -> dict:
+    return {f"{method} {path}": limiter.stats() for (method, path), limiter in admission_limiters.items()}
+
+
+def collect_gauges():
+    """Connection pool and question cache figures, read when /metrics is scraped"""
+    questions = question_pool.stats()
+    gauges = [
+        ("question_cache_requests_total", "counter", "Questions served from the pool (hit) or built on demand (miss)",
+         [({"result": "hit"}, questions["served"]), ({"result": "miss"}, questions["misses"])]),
+        ("question_cache_size", "gauge", "Questions ready in the pool", [({}, questions["size"])]),
+        ("admission_limit", "gauge", "Current concurrency limit by route",
+         [({"route": path}, limiter.limit) for (_, path), limiter in admission_limiters.items()]),
+        ("admission_in_flight", "gauge", "Admitted requests in flight by route",
+         [({"route": path}, limiter.in_flight) for (_, path), limiter in admission_limiters.items()]),
+        ("admission_shed_total", "counter", "Requests answered 503 by route and reason",
+         [sample for (_, path), limiter in admission_limiters.items()
+          for sample in (({"route": path, "reason": "queue_full"}, limiter.rejected),
+                         ({"route": path, "reason": "queue_timeout"}, limiter.timed_out))]),
+        ("rate_limited_total", "counter", "Requests answered 429 by key type",
+         [({"key": "ip"}, ip_rate_limit.limited), ({"key": "username"}, user_rate_limit.limited)]),
+    ]
+    if isinstance(repository, MongoRepository):
+        pool = connection_manager.pool_stats()
+        gauges += [
+            ("mongodb_pool_connections", "gauge", "Pooled MongoDB connections by state",
+             [({"state": "open"}, pool["open_connections"]), ({"state": "in_use"}, pool["in_use"])]),
+            ("mongodb_pool_max_size", "gauge", "Configured maxPoolSize", [({}, pool["max_pool_size"])]),
+            ("mongodb_pool_checkouts_total", "counter", "Connection checkouts", [({}, pool["checkouts"])]),
+            ("mongodb_pool_checkout_failures_total", "counter", "Failed connection checkouts", [({}, pool["checkout_failures"])]),
+        ]
+    return gauges
+
+
+metrics.add_collector(collect_gauges)
 
 # Replace on_event with the new lifespan approach
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic (previously in on_event("startup"))
-    global client, db
+    if STORAGE_BACKEND == "embedded":
+        await embedded_startup()
+    elif COLD_START_MODE:
+        await cold_startup()
+    else:
+        await full_startup()
+
+    if catalog_snapshot is not None:
+        catalog_snapshot.start(get_database)
+    else:
+        catalog.start_background_refresh(get_database, refresh_now=COLD_START_MODE)
+    if ADAPTIVE_SAMPLING:
+        # Build the first alias table before the pool fills so it starts out weighted
+        if catalog.loaded:
+            question_sampler.rebuild()
+        question_sampler.start()
+    question_pool.start()
+    leaderboard.start_background_reconcile(get_database, reconcile_now=COLD_START_MODE)
+    if SCORE_WRITE_BEHIND:
+        score_buffer.start(get_database)
+    session_store.start(get_database)
+    
+    yield  # This is where FastAPI runs the actual application
+    
+    # Shutdown logic (previously in on_event("shutdown"))
+    # Drain buffered score updates and session results while the connection is still open
+    await score_buffer.stop()
+    await session_store.stop()
+    await leaderboard.stop_background_reconcile()
+    await question_pool.stop()
+    await question_sampler.stop()
+    await catalog.stop_background_refresh()
+    if catalog_snapshot is not None:
+        await catalog_snapshot.stop()
+    await repository.close()
+    logger.info("Storage backend %s closed", repository.backend)
+
+
+async def cold_startup():
+    """Serve from the bundled snapshot and leave the database to the background refresh"""
+    if catalog_snapshot is not None:
+        try:
+            if catalog_snapshot.map():
+                logger.info("Cold start: serving %d destinations from %s", len(catalog), CATALOG_SNAPSHOT_PATH)
+                return
+        except Exception as e:
+            logger.error("Error mapping the destination snapshot: %s", e)
     try:
-        print(f"Connecting to MongoDB with URI: {MONGODB_URI.replace(MONGODB_PASSWORD, '********') if MONGODB_PASSWORD else MONGODB_URI}")
-        
-        # Connect to MongoDB Atlas with a timeout
-        client = MongoClient(MONGODB_URI, server_api=ServerApi('1'), connectTimeoutMS=5000, socketTimeoutMS=5000)
-        
-        # Ping the database to confirm connection
-        client.admin.command('ping')
-        print("Successfully connected to MongoDB Atlas!")
+        loaded = catalog.load_file(BUNDLED_DATA_PATH)
+        logger.info("Cold start: serving %d destinations from %s", loaded, BUNDLED_DATA_PATH)
+    except Exception as e:
+        logger.error("Error loading bundled destinations: %s", e)
+
+
+async def embedded_startup():
+    """Load the embedded store; everything after this is served from memory"""
+    try:
+        await repository.connect()
+        loaded = await catalog.load(repository)
+        players = await leaderboard.reconcile(repository)
+        logger.info("Embedded storage: %d destinations from %s, %d players", loaded, BUNDLED_DATA_PATH, players)
+    except Exception as e:
+        logger.error("Error loading embedded storage: %s", e)
+
+
+async def full_startup():
+    """Connect, run the startup diagnostics and prepare indexes before serving"""
+    try:
+        logger.info("Connecting to MongoDB with URI: %s", MONGODB_URI.replace(MONGODB_PASSWORD, '********') if MONGODB_PASSWORD else MONGODB_URI)
         
-        # Use the city_data database and cities collection
-        db = client.city_data
+        # Ping the database to confirm connection and use the city_data database
+        db = await connection_manager.connect()
+
+        # Open the minimum pool up front so the first request skips connection setup
+        open_connections = await connection_manager.warm_up()
+        logger.info("Warmed MongoDB pool with %d connections", open_connections)
         
         # Check if we can access the cities collection
-        cities_count = db.cities.count_documents({})
-        print(f"Found {cities_count} cities in the database")
+        cities_count = await db.cities.count_documents({})
+        logger.info("Found %d cities in the database", cities_count)
+
+        # Load the destination catalog once so questions never scan the collection
+        if catalog_snapshot is not None:
+            # Map the shared snapshot; only the worker that publishes it reads the collection
+            await catalog_snapshot.sync(get_database)
+            loaded = len(catalog)
+        else:
+            loaded = await catalog.load(repository)
+        logger.info("Loaded %d destinations into the catalog", loaded)
         
         # Check if users collection exists, create it if not
-        if 'users' not in db.list_collection_names():
-            print("Creating users collection")
-            db.create_collection('users')
+        if 'users' not in await db.list_collection_names():
+            logger.info("Creating users collection")
+            await db.create_collection('users')
         
-        users_count = db.users.count_documents({})
-        print(f"Found {users_count} users in the database")
+        users_count = await db.users.count_documents({})
+        logger.info("Found %d users in the database", users_count)
 
         # List the usernames of all found users
-        if users_count > 0:
-            users_list = list(db.users.find({}, {'username': 1, '_id': 0}))
+        if users_count > 0 and logger.isEnabledFor(logging.DEBUG):
+            users_list = await db.users.find({}, {'username': 1, '_id': 0}).to_list(None)
             usernames = [user['username'] for user in users_list]
-            print(f"Registered users: {', '.join(usernames)}")
+            logger.debug("Registered users: %s", ", ".join(usernames))
+
+        # Make sure the hot lookups are indexed and warn if any still scan
+        index_names = await repository.ensure_indexes()
+        logger.info("Ensured indexes: %s", ", ".join(index_names))
+        if repository.index_errors:
+            logger.error("Missing indexes on %s; /health reports degraded", ", ".join(repository.index_errors))
+        await verify_query_plans(db)
+
+        # Build the in-process leaderboard from the stored scores
+        players = await leaderboard.reconcile(repository)
+        logger.info("Loaded %d players into the leaderboard", players)
         
     except Exception as e:
-        print(f"Error connecting to MongoDB Atlas: {str(e)}")
+        logger.error("Error connecting to MongoDB Atlas: %s", e)
         # Don't raise the exception, just log it
         # This allows the app to start even if the database connection fails
         # We'll handle database errors in the individual endpoints
-    
-    yield  # This is where FastAPI runs the actual application
-    
-    # Shutdown logic (previously in on_event("shutdown"))
-    if client:
-        client.close()
-        print("MongoDB connection closed")
+
 
 # Initialize FastAPI app with the lifespan handler
-app = FastAPI(title="Globetrotter API", lifespan=lifespan)
+app = FastAPI(title="Globetrotter API", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# Shed load on the database-bound routes; inside CORS so 429 and 503 responses stay readable
+app.add_middleware(
+    AdmissionMiddleware,
+    limiters=admission_limiters,
+    ip_buckets=ip_rate_limit,
+    user_buckets=user_rate_limit,
+    # Vercel's edge sets X-Forwarded-For to the real client address
+    trust_forwarded_for=os.getenv("TRUST_FORWARDED_FOR", "true" if os.getenv("VERCEL") else "false").lower() in ("1", "true", "yes"),
+)
 
-# Add CORS middleware
+# CORS for the frontend; preflights are answered by the middleware and cached by browsers for max_age
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"],
+    allow_origins=[origin.strip() for origin in os.getenv("CORS_ALLOW_ORIGINS", "*").split(",") if origin.strip()],
+    allow_methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"],
+    allow_headers=["Accept", "Authorization", "Content-Type", "If-None-Match", "X-Admin-Token",
+                   "X-Request-ID", "X-Requested-With"],
+    expose_headers=["ETag", "Retry-After", "Server-Timing", "X-Request-ID"],
+    max_age=int(os.getenv("CORS_MAX_AGE_SECONDS", "86400")),
 )
 
-# JWT settings
-SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_hex(32))
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 1 week
+# Assign request ids and log one record per request with its duration
+app.add_middleware(RequestLoggingMiddleware, logger=logging.getLogger("app.access"))
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Add CORS preflight handler for all routes
-@app.options("/{full_path:path}")
-async def options_handler(request: Request, full_path: str):
-    response = Response()
-    response.headers["Access-Control-Allow-Origin"] = "*"
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
-    return response
-
-# Add middleware to ensure CORS headers are added to all responses
-@app.middleware("http")
-async def add_cors_headers(request: Request, call_next):
-    try:
-        response = await call_next(request)
-        # Add CORS headers to the response
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
-        return response
-    except Exception as e:
-        # If an error occurs, create a response with CORS headers
-        error_response = Response(
-            content=json.dumps({"detail": str(e)}),
-            status_code=500,
-            media_type="application/json"
-        )
-        error_response.headers["Access-Control-Allow-Origin"] = "*"
-        error_response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-        error_response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With"
-        return error_response
+# Per-route latency histograms and a Server-Timing header on every response
+app.add_middleware(MetricsMiddleware, registry=metrics)
 
 # Models
 class User(BaseModel):
@@ -145,21 +421,27 @@ class User(BaseModel):
 class UserCreate(BaseModel):
     username: str
 
-class Destination(BaseModel):
-    city: str
-    country: str
-    clues: List[str]
-    fun_fact: List[str]
-    trivia: List[str]
-
 class GameQuestion(BaseModel):
     clues: List[str]
     options: List[dict]
     correct_answer: str
+    token: Optional[str] = None
 
 class AnswerSubmission(BaseModel):
     selected_city: str
-    correct_city: str
+    # Signed token from /game/question; correct_city is only read, from clients that send none,
+    # when QUESTION_TOKEN_REQUIRED is turned off
+    token: Optional[str] = None
+    correct_city: Optional[str] = None
+
+class SessionStart(BaseModel):
+    username: Optional[str] = None
+    rounds: int = 10
+    time_limit_seconds: float = 60
+    difficulty: Literal["easy", "medium", "hard"] = "medium"
+
+class SessionAnswer(BaseModel):
+    selected_city: str
 
 class Token(BaseModel):
     access_token: str
@@ -167,44 +449,21 @@ class Token(BaseModel):
     username: str
 
 
-# Function to get a database connection - cached to reduce connection overhead
-@lru_cache(maxsize=1)
-def get_database_connection():
-    """Get a MongoDB connection and return the client and database"""
-    try:
-        print(
-            f"Creating new MongoDB connection to {MONGODB_URI.replace(MONGODB_PASSWORD, '********') if MONGODB_PASSWORD else MONGODB_URI}")
-
-        # Connect to MongoDB Atlas with a timeout
-        client = MongoClient(
-            MONGODB_URI,
-            server_api=ServerApi('1'),
-            connectTimeoutMS=5000,
-            socketTimeoutMS=5000,
-            serverSelectionTimeoutMS=5000
-        )
-
-        # Ping the database to confirm connection
-        client.admin.command('ping')
-        print("Successfully connected to MongoDB Atlas!")
-
-        # Use the city_data database
-        db = client.city_data
-
-        return client, db
-    except Exception as e:
-        print(f"Error connecting to MongoDB Atlas: {str(e)}")
-        raise
-
-
 # Dependency for routes that need database access
 async def get_db():
-    """Dependency that provides database access"""
+    """Dependency that provides the storage repository"""
+    # Only connection failures map to this error; route exceptions propagate unchanged
     try:
-        client, db = get_database_connection()
-        yield db
+        db = await repository.connect()
     except Exception as e:
+        logger.error("Error connecting to %s: %s", repository.backend, e)
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
+    yield db
+
+
+async def get_database():
+    """Return the shared repository for background tasks"""
+    return await repository.connect()
 
 
 # Now update your debug endpoint to use this dependency
@@ -212,19 +471,16 @@ async def get_db():
 async def debug_database(db=Depends(get_db)):
     """Debug endpoint to check database connection"""
     try:
-        # Check collections
-        collections = db.list_collection_names()
-
         # Count documents in collections
-        collection_counts = {}
-        for collection in collections:
-            collection_counts[collection] = db[collection].count_documents({})
+        collection_counts = await db.count_documents()
 
         return {
             "status": "connected",
+            "backend": db.backend,
             "database_name": db.name,
-            "collections": collections,
+            "collections": list(collection_counts),
             "document_counts": collection_counts,
+            "connection_pool": connection_manager.pool_stats() if isinstance(db, MongoRepository) else None,
         }
     except Exception as e:
         return {
@@ -234,22 +490,35 @@ async def debug_database(db=Depends(get_db)):
 
 
 @app.get("/health")
-async def health_check():
+async def health_check(response: Response):
     """Health check endpoint that also validates database connection"""
     try:
         # Try to get a database connection directly for the health check
-        client, db = get_database_connection()
+        db = await repository.connect()
 
         # Try to ping the database
-        client.admin.command('ping')
+        await db.ping()
 
         # Check if we can query the cities collection
-        city_count = db.cities.count_documents({})
+        city_count = await db.count_destinations()
 
+        response.headers["Cache-Control"] = HEALTH_CACHE_CONTROL
+        indexes = db.index_stats() if isinstance(db, MongoRepository) else None
         return {
-            "status": "healthy",
+            # A missing unique index lets duplicate users and cities in, so it is worth paging on
+            "status": "degraded" if indexes and indexes["errors"] else "healthy",
             "database": "connected",
-            "cities_count": city_count
+            "backend": db.backend,
+            "cities_count": city_count,
+            "question_pool": question_pool.stats(),
+            "catalog_snapshot": catalog_snapshot.stats() if catalog_snapshot is not None else None,
+            "connection_pool": connection_manager.pool_stats() if isinstance(db, MongoRepository) else None,
+            "indexes": indexes,
+            "score_buffer": score_buffer.stats() if SCORE_WRITE_BEHIND else None,
+            "user_cache": user_cache.stats(),
+            "seen_sets": seen_sets.stats(),
+            "sessions": session_store.stats(),
+            "admission": admission_stats(),
         }
     except Exception as e:
         return {
@@ -258,62 +527,103 @@ async def health_check():
             "error": str(e)
         }
 
+
+@app.get("/metrics")
+async def get_metrics():
+    """Process metrics in the Prometheus text exposition format"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Helper functions
-def get_random_question(db, num_options=4):
-    # Get all destinations from the database
-    all_destinations = list(db.cities.find({}))
+async def get_random_question(db, num_options=4, difficulty="medium"):
+    # Questions are built from the in-memory catalog, no database round trip
+    await catalog.ensure_loaded(db)
+    question = catalog.random_question(num_options, difficulty)
+    if question is None:
+        raise HTTPException(status_code=404, detail="No destinations found")
+    return question
 
-    if not all_destinations:
+
+async def get_unseen_question(db, username: str, num_options=4, difficulty="medium"):
+    """A question about a destination `username` has not been asked about yet"""
+    await catalog.ensure_loaded(db)
+    data = catalog.data
+    if not data.cities:
         raise HTTPException(status_code=404, detail="No destinations found")
+    seen = seen_sets.get(username, data)
+    if seen is None:
+        user = await db.find_user(username, SEEN_PROJECTION)
+        if user is None:
+            raise HTTPException(status_code=404, detail=f"User {username} not found")
+        seen = seen_sets.load(username, user, data)
+    return catalog.question(data, seen_sets.pick(seen, data), num_options, difficulty)
 
-    # Select a random destination as the correct answer
-    correct_destination = random.choice(all_destinations)
 
-    # Select 1-2 random clues from the correct destination
-    num_clues = random.randint(1, 2)
-    selected_clues = random.sample(correct_destination["clues"], min(num_clues, len(correct_destination["clues"])))
+async def get_random_fun_fact_json(db, city: str) -> bytes:
+    await catalog.ensure_loaded(db)
+    fun_fact = catalog.random_fun_fact_json(city)
+    if fun_fact is None:
+        raise HTTPException(status_code=404, detail=f"Destination {city} not found")
+    return fun_fact
 
-    # Select random destinations as options (including the correct one)
-    other_destinations = [d for d in all_destinations if d["city"] != correct_destination["city"]]
-    if len(other_destinations) < num_options - 1:
-        num_options = len(other_destinations) + 1
 
-    option_destinations = random.sample(other_destinations, num_options - 1)
-    option_destinations.append(correct_destination)
-    random.shuffle(option_destinations)
+# Fields returned to clients alongside an answer
+USER_SCORE_PROJECTION = {"_id": 0, "username": 1, "score": 1, "correct_answers": 1, "total_answers": 1}
+# The user document minus the seen-set, for GET /users and challenge links
+USER_PUBLIC_PROJECTION = {"seen": 0, "seen_catalog": 0}
 
-    options = [{"city": d["city"], "country": d["country"]} for d in option_destinations]
 
-    return {
-        "clues": selected_clues,
-        "options": options,
-        "correct_answer": correct_destination["city"]
-    }
+async def update_user_score(db, username: str, correct: bool, city: Optional[str] = None):
+    # The bit of the answered destination goes into the same update as the score
+    slot = catalog.slot_of(city) if city else None
+    update = seen_sets.mark(username, slot, catalog.data) if slot is not None else {}
+    if SCORE_WRITE_BEHIND:
+        # Score increments are batched by the buffer, so seen-sets stay in this worker's cache
+        return await buffer_user_score(db, username, correct)
 
+    # Update user score
+    deltas = {
+        "total_answers": 1,
+        "score": 1 if correct else 0,
+        "correct_answers": 1 if correct else 0
+    }
 
-def get_destination_by_city(db, city: str):
-    destination = db.cities.find_one({"city": city})
-    if not destination:
-        raise HTTPException(status_code=404, detail=f"Destination {city} not found")
-    return destination
+    # One atomic update; None means the user does not exist
+    user = await db.increment_user(username, deltas, USER_SCORE_PROJECTION, **update)
+    if not user:
+        raise HTTPException(status_code=404, detail=f"User {username} not found")
+    user_cache.invalidate(username)
+    leaderboard.update(user["username"], user["score"])
+    return user
 
 
-def update_user_score(db, username: str, correct: bool):
-    user = db.users.find_one({"username": username})
+async def buffer_user_score(db, username: str, correct: bool):
+    """Write-behind variant of update_user_score: read the user, queue the increment"""
+    user = await db.find_user(username, USER_SCORE_PROJECTION)
     if not user:
         raise HTTPException(status_code=404, detail=f"User {username} not found")
+    score_buffer.add(username, correct)
+    user_cache.invalidate(username)
+    score_buffer.merge(user)
+    leaderboard.update(user["username"], user["score"])
+    return user
+
+async def get_cached_user(db, username: str) -> Optional[dict]:
+    """The user document with pending score updates merged in, from the user cache when fresh"""
+    user = user_cache.get(username)
+    if user is None:
+        user = await db.find_user(username, USER_PUBLIC_PROJECTION)
+        if not user:
+            return None
+        # Include score updates that are still waiting to be flushed
+        score_buffer.merge(user)
+        user_cache.put(username, user)
+    return user
 
-    # Update user score
-    update_data = {
-        "$inc": {
-            "total_answers": 1,
-            "score": 1 if correct else 0,
-            "correct_answers": 1 if correct else 0
-        }
-    }
 
-    db.users.update_one({"username": username}, update_data)
-    return db.users.find_one({"username": username})
+def user_etag(user: dict) -> str:
+    # The score counters change on every answer, _id when a name is deleted and reused
+    return weak_etag(user["_id"], user.get("score", 0), user.get("correct_answers", 0), user.get("total_answers", 0))
+
 
 # Helper function for JWT token creation
 def create_access_token(data: dict, expires_delta: timedelta = None):
@@ -323,6 +633,8 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
+    # Imported lazily to keep python-jose off the cold-start path
+    from jose import jwt
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -348,34 +660,30 @@ async def debug_info(request: Request):
 
 
 @app.get("/users/{username}")
-async def get_user(username: str, db=Depends(get_db)):
+async def get_user(username: str, request: Request, db=Depends(get_db)):
     try:
-        print(f"Getting user: {username}")
-        user = db.users.find_one({"username": username})
+        logger.debug("Getting user: %s", username)
+        user = await get_cached_user(db, username)
         if not user:
-            print(f"User {username} not found")
+            logger.info("User %s not found", username)
             raise HTTPException(status_code=404, detail=f"User {username} not found")
 
-        # Convert ObjectId to string for JSON serialization
-        user["_id"] = str(user["_id"])
-        print(f"Returning user: {user}")
-        return user
+        etag = user_etag(user)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag, USER_CACHE_CONTROL)
+        logger.debug("Returning user: %s", user)
+        # Returned directly so the ObjectId and datetime fields skip jsonable_encoder
+        return FastJSONResponse(user, headers={"ETag": etag, "Cache-Control": USER_CACHE_CONTROL})
     except Exception as e:
         error_msg = f"Error getting user: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 
 @app.post("/users")  # Remove response_model=Token to bypass validation
 async def create_user(user: UserCreate, db=Depends(get_db)):
     try:
-        print(f"Creating user: {user.username}")
-
-        # Check if username already exists
-        existing_user = db.users.find_one({"username": user.username})
-        if existing_user:
-            print(f"User {user.username} already exists")
-            raise HTTPException(status_code=400, detail="Username already registered")
+        logger.info("Creating user: %s", user.username)
 
         # Create new user
         new_user = {
@@ -386,18 +694,28 @@ async def create_user(user: UserCreate, db=Depends(get_db)):
             "created_at": datetime.utcnow()
         }
 
-        print(f"Inserting new user: {new_user}")
-        result = db.users.insert_one(new_user)
-        print(f"User created with ID: {result.inserted_id}")
+        logger.debug("Inserting new user: %s", new_user)
+        try:
+            # The repository rejects duplicates, through the unique username index once it exists
+            await db.insert_user(new_user)
+        except DuplicateUserError:
+            logger.info("User %s already exists", user.username)
+            return Response(
+                content=json.dumps({"detail": "Username already registered"}),
+                status_code=400,
+                media_type="application/json",
+            )
+        logger.info("User created with ID: %s", new_user["_id"])
+        leaderboard.update(user.username, 0)
 
         try:
             # Create access token
-            print("Generating access token")
+            logger.debug("Generating access token")
             access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
             access_token = create_access_token(
                 data={"sub": user.username}, expires_delta=access_token_expires
             )
-            print(f"Access token generated successfully")
+            logger.debug("Access token generated successfully")
             
             # Create response
             response_data = {
@@ -405,12 +723,12 @@ async def create_user(user: UserCreate, db=Depends(get_db)):
                 "token_type": "bearer",
                 "username": user.username
             }
-            print(f"Returning response with username: {user.username}")
+            logger.debug("Returning response with username: %s", user.username)
             return response_data
             
         except Exception as token_error:
             # If token generation fails, still return a successful response
-            print(f"Error generating token: {str(token_error)}")
+            logger.error("Error generating token: %s", token_error)
             return {
                 "access_token": "",
                 "token_type": "bearer",
@@ -418,111 +736,379 @@ async def create_user(user: UserCreate, db=Depends(get_db)):
             }
     except Exception as e:
         error_msg = f"Error creating user: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         
-        # Create a direct response with CORS headers instead of raising an exception
+        # Create a direct response instead of raising an exception
         return Response(
             content=json.dumps({"detail": error_msg}),
             status_code=500,
             media_type="application/json",
-            headers={
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-                "Access-Control-Allow-Headers": "Content-Type, Authorization, X-Requested-With"
-            }
         )
 
 
 @app.get("/game/question", response_model=GameQuestion)
-async def get_question(db=Depends(get_db)):
+async def get_question(response: Response, difficulty: Optional[Literal["easy", "medium", "hard"]] = None,
+                       username: Optional[str] = None, db=Depends(get_db)):
     try:
-        print("Getting random question")
-        # Update the get_random_question function to accept db as a parameter
-        question = get_random_question(db)
-        print(f"Returning question with correct answer: {question['correct_answer']}")
+        logger.debug("Getting random question (difficulty: %s, username: %s)", difficulty, username)
+        if username:
+            # Players get destinations they have not seen yet, so the pool's random questions do not apply
+            response.headers["Cache-Control"] = NO_STORE
+            question = await get_unseen_question(db, username, difficulty=difficulty or "medium")
+            question["token"] = question_tokens.issue(question["correct_answer"])
+            return question
+
+        # Serve a pre-encoded question from the pool when one is ready; pooled questions are medium
+        if difficulty in (None, "medium"):
+            payload = question_pool.pop()
+            if payload is not None:
+                return Response(content=payload, media_type="application/json", headers={"Cache-Control": NO_STORE})
+
+        response.headers["Cache-Control"] = NO_STORE
+        question = await get_random_question(db, difficulty=difficulty or "medium")
+        question["token"] = question_tokens.issue(question["correct_answer"])
+        logger.debug("Returning question with correct answer: %s", question["correct_answer"])
         return question
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         error_msg = f"Error getting question: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.get("/game/questions")
+async def get_questions(response: Response, count: int = 5, exclude: List[str] = Query(default=[]),
+                        stream: bool = False, difficulty: Literal["easy", "medium", "hard"] = "medium",
+                        db=Depends(get_db)):
+    """Several rounds at once, each about a different destination, skipping recently seen ones"""
+    try:
+        count = max(1, min(count, QUESTION_BATCH_MAX))
+        # Accept both ?exclude=Paris&exclude=Tokyo and ?exclude=Paris,Tokyo
+        seen = {city.strip() for value in exclude for city in value.split(",") if city.strip()}
+        await catalog.ensure_loaded(db)
+        questions = catalog.random_questions(count, seen, difficulty=difficulty,
+                                             draw=question_sampler.draw if ADAPTIVE_SAMPLING else None)
+        if not questions:
+            raise HTTPException(status_code=404, detail="No destinations found")
+        logger.debug("Returning %d questions (%d excluded)", len(questions), len(seen))
+
+        if stream:
+            # One JSON object per line, encoded as it is sent so the first round renders early
+            def lines():
+                for question in questions:
+                    yield append_token(encode_question(question), question_tokens.issue(question["correct_answer"])) + b"\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": NO_STORE})
+
+        response.headers["Cache-Control"] = NO_STORE
+        for question in questions:
+            question["token"] = question_tokens.issue(question["correct_answer"])
+        return {"questions": questions}
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        error_msg = f"Error getting questions: {str(e)}"
+        logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 
+def resolve_correct_city(answer: AnswerSubmission) -> Tuple[str, bool]:
+    """The city a question was about, and whether it came from a verified token"""
+    if answer.token:
+        try:
+            city, _ = question_tokens.verify(answer.token)
+            return city, True
+        except InvalidQuestionToken as e:
+            # correct_city is trusted anyway when tokens are optional
+            if QUESTION_TOKEN_REQUIRED or not answer.correct_city:
+                raise HTTPException(status_code=400, detail=str(e))
+    if QUESTION_TOKEN_REQUIRED or not answer.correct_city:
+        raise HTTPException(status_code=400, detail="A question token is required")
+    return answer.correct_city, False
+
+
 @app.post("/game/answer")
 async def submit_answer(answer: AnswerSubmission, username: Optional[str] = None, db=Depends(get_db)):
     try:
-        print(f"Submitting answer: {answer.selected_city} for correct answer: {answer.correct_city}")
-        print(f"Username received: {username}")
-        correct = answer.selected_city == answer.correct_city
-        print(f"Answer is correct: {correct}")
-
-        # Get fun fact for the correct destination
-        print(f"Getting destination for city: {answer.correct_city}")
-        destination = get_destination_by_city(db, answer.correct_city)
-        fun_fact = random.choice(destination["fun_fact"]) if destination["fun_fact"] else ""
+        correct_city, verified = resolve_correct_city(answer)
+        if username and verified and not await db.consume_question_token(
+                token_id(answer.token), time.time() + QUESTION_TOKEN_MAX_AGE_SECONDS):
+            # Each token scores once, whichever worker the replay reaches
+            raise HTTPException(status_code=409, detail="This question was already answered")
+        logger.debug("Submitting answer: %s for correct answer: %s (username: %s)",
+                     answer.selected_city, correct_city, username)
+        correct = answer.selected_city == correct_city
+        logger.debug("Answer is correct: %s", correct)
+
+        # Get the pre-encoded fun fact for the correct destination from the in-memory catalog
+        logger.debug("Getting fun fact for city: %s", correct_city)
+        fun_fact = await get_random_fun_fact_json(db, correct_city)
+        # Only known cities reach this point, so client-sent names cannot grow the statistics
+        question_sampler.record(correct_city, correct)
 
         # Update user score if username is provided
         user = None
         if username:
-            print(f"Updating score for user: {username}")
-            user = update_user_score(db, username, correct)
-            user["_id"] = str(user["_id"])
-
-        response = {
-            "correct": correct,
-            "fun_fact": fun_fact,
-            "user": user
-        }
-        print(f"Returning response: {response}")
-        return response
+            logger.debug("Updating score for user: %s", username)
+            user = await update_user_score(db, username, correct, correct_city)
+
+        # {"correct": ..., "fun_fact": ..., "user": ...} assembled from encoded parts
+        body = b"".join((
+            b'{"correct":', b"true" if correct else b"false",
+            b',"fun_fact":', fun_fact,
+            b',"user":', dumps(user), b"}",
+        ))
+        logger.debug("Returning response: %s", body)
+        return Response(content=body, media_type="application/json")
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         error_msg = f"Error submitting answer: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 
 @app.get("/game/challenge/{username}")
-async def get_challenge_info(username: str, db=Depends(get_db)):
+async def get_challenge_info(username: str, request: Request, db=Depends(get_db)):
     try:
-        print(f"Getting challenge info for user: {username}")
-        user = db.users.find_one({"username": username})
+        logger.debug("Getting challenge info for user: %s", username)
+        user = await get_cached_user(db, username)
         if not user:
-            print(f"User {username} not found")
+            logger.info("User %s not found", username)
             raise HTTPException(status_code=404, detail=f"User {username} not found")
 
-        # Convert ObjectId to string for JSON serialization
-        user["_id"] = str(user["_id"])
+        etag = user_etag(user)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag, CHALLENGE_CACHE_CONTROL)
 
-        response = {
+        challenge = {
             "username": user["username"],
             "score": user["score"],
             "correct_answers": user["correct_answers"],
             "total_answers": user["total_answers"]
         }
-        print(f"Returning challenge info: {response}")
-        return response
+        logger.debug("Returning challenge info: %s", challenge)
+        return FastJSONResponse(challenge, headers={"ETag": etag, "Cache-Control": CHALLENGE_CACHE_CONTROL})
     except Exception as e:
         error_msg = f"Error getting challenge info: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 
+def get_session_or_404(session_id: str):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    return session
+
+
+async def end_session(db, session) -> Optional[dict]:
+    """Finish a session and write its result; returns the updated user when there was one to write"""
+    session_store.finish(session)
+    if session.written:
+        return None
+    # One update for the whole session; if it fails the expiry task retries it
+    user = await db.increment_user(session.username, session.result(), USER_SCORE_PROJECTION)
+    session.written = True
+    if user:
+        user_cache.invalidate(session.username)
+        # In write-behind mode the stored score lacks the answers still buffered
+        score_buffer.merge(user)
+        leaderboard.update(user["username"], user["score"])
+    return user
+
+
+@app.post("/game/session")
+async def start_session(start: SessionStart, db=Depends(get_db)):
+    """Start a timed game of several rounds, each about a different destination"""
+    try:
+        if start.username and not await db.find_user(start.username, {"_id": 0, "username": 1}):
+            raise HTTPException(status_code=404, detail=f"User {start.username} not found")
+        await catalog.ensure_loaded(db)
+        data = catalog.data
+        if not data.cities:
+            raise HTTPException(status_code=404, detail="No destinations found")
+        rounds = max(1, min(start.rounds, SESSION_MAX_ROUNDS, len(data.cities)))
+        time_limit = max(1.0, min(start.time_limit_seconds, SESSION_MAX_SECONDS))
+        try:
+            session = session_store.create(start.username or None, data, random.sample(range(len(data.cities)), rounds),
+                                           start.difficulty, time_limit)
+        except SessionStoreFull:
+            raise HTTPException(status_code=503, detail="Too many active sessions, please retry",
+                                headers={"Retry-After": "5"})
+        logger.debug("Started session %s for %s: %d rounds in %.0fs", session.id, start.username, rounds, time_limit)
+        return session.status()
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        error_msg = f"Error starting session: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.get("/game/session/{session_id}")
+async def get_session(session_id: str):
+    """Progress of a session, kept for SESSION_RESULT_TTL_SECONDS after it ends"""
+    return get_session_or_404(session_id).status()
+
+
+@app.get("/game/session/{session_id}/question")
+async def get_session_question(session_id: str, db=Depends(get_db)):
+    """The question of the current round; asking again returns the same question"""
+    try:
+        session = get_session_or_404(session_id)
+        if not session.finished and not session.remaining():
+            await end_session(db, session)
+        if session.finished:
+            raise HTTPException(status_code=410, detail="Session has ended")
+        if session.question is None:
+            question = catalog.question(session.data, session.slots[session.answered], difficulty=session.difficulty)
+            # The answer stays on the server, so the question carries no correct_answer or token
+            session_store.set_question(session, dumps({"clues": question["clues"], "options": question["options"]}))
+        body = b"".join((
+            b'{"round":', dumps(session.answered + 1),
+            b',"rounds":', dumps(session.rounds),
+            b',"remaining_seconds":', dumps(round(session.remaining(), 3)),
+            b',"question":', session.question, b"}",
+        ))
+        return Response(content=body, media_type="application/json", headers={"Cache-Control": NO_STORE})
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        error_msg = f"Error getting session question: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.post("/game/session/{session_id}/answer")
+async def submit_session_answer(session_id: str, answer: SessionAnswer, db=Depends(get_db)):
+    """Answer the current round; the result is written to the user once the last round is answered"""
+    try:
+        session = get_session_or_404(session_id)
+        if not session.finished and not session.remaining():
+            await end_session(db, session)
+        if session.finished:
+            raise HTTPException(status_code=410, detail="Session has ended")
+        if session.question is None:
+            raise HTTPException(status_code=409, detail="Fetch the question of this round first")
+
+        slot = session.slots[session.answered]
+        data = session.data
+        correct = answer.selected_city == data.cities[slot]
+        session.answered += 1
+        session.correct += int(correct)
+        session_store.set_question(session, None)
+        facts = data.encoded.fun_facts[slot]
+        fun_fact = random.choice(facts) if facts else b'""'
+
+        user = None
+        if session.answered == session.rounds:
+            user = await end_session(db, session)
+
+        body = b"".join((
+            b'{"correct":', b"true" if correct else b"false",
+            b',"correct_answer":', dumps(data.cities[slot]),
+            b',"fun_fact":', fun_fact,
+            b',"session":', dumps(session.status()),
+            b',"user":', dumps(user), b"}",
+        ))
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        error_msg = f"Error submitting session answer: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.get("/leaderboard")
+async def get_leaderboard(limit: int = 10, offset: int = 0, db=Depends(get_db)):
+    try:
+        limit = max(1, min(limit, LEADERBOARD_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        logger.debug("Getting leaderboard page: limit=%d offset=%d", limit, offset)
+        await leaderboard.ensure_loaded(db)
+        return {
+            "total_players": len(leaderboard),
+            "limit": limit,
+            "offset": offset,
+            "entries": leaderboard.top(limit, offset)
+        }
+    except Exception as e:
+        error_msg = f"Error getting leaderboard: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.get("/users/{username}/rank")
+async def get_user_rank(username: str, db=Depends(get_db)):
+    try:
+        logger.debug("Getting rank for user: %s", username)
+        await leaderboard.ensure_loaded(db)
+        rank = leaderboard.rank(username)
+        if rank is None:
+            logger.info("User %s not found", username)
+            raise HTTPException(status_code=404, detail=f"User {username} not found")
+        return rank
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        error_msg = f"Error getting user rank: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+async def require_admin(request: Request):
+    """Dependency that guards maintenance endpoints with the ADMIN_TOKEN header"""
+    if not ADMIN_TOKEN or not secrets.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.post("/admin/catalog/refresh", dependencies=[Depends(require_admin)])
+async def refresh_catalog(db=Depends(get_db)):
+    """Reload the destination catalog from the database"""
+    try:
+        if catalog_snapshot is not None:
+            # Publish a new shared snapshot so every worker picks the change up
+            await catalog_snapshot.publish(db, force=True)
+            count = len(catalog)
+        else:
+            count = await catalog.load(db)
+        logger.info("Destination catalog refreshed with %d destinations", count)
+        return {"status": "refreshed", "destinations": count}
+    except Exception as e:
+        error_msg = f"Error refreshing catalog: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+
+@app.get("/admin/questions/stats", dependencies=[Depends(require_admin)])
+async def get_question_stats(limit: int = 50):
+    """Per-city answer statistics and sampling weights, hardest cities first"""
+    return question_sampler.stats(max(1, min(limit, 1000)))
+
+
 @app.delete("/users/{username}")
 async def delete_user(username: str, db=Depends(get_db)):
     try:
-        print(f"Deleting user: {username}")
-        result = db.users.delete_one({"username": username})
+        logger.info("Deleting user: %s", username)
+        deleted = await db.delete_user(username)
 
-        if result.deleted_count == 0:
-            print(f"User {username} not found")
+        if not deleted:
+            logger.info("User %s not found", username)
             raise HTTPException(status_code=404, detail=f"User {username} not found")
 
-        print(f"User {username} deleted successfully")
+        leaderboard.remove(username)
+        score_buffer.discard(username)
+        user_cache.invalidate(username)
+        seen_sets.invalidate(username)
+        logger.info("User %s deleted successfully", username)
         return {"message": f"User {username} deleted successfully"}
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
         error_msg = f"Error deleting user: {str(e)}"
-        print(error_msg)
+        logger.error(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
 if __name__ == "__main__":
@@ -0,0 +1,217 @@
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Seconds; the Prometheus defaults plus finer steps below 5ms where most requests land
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request [db seconds, serialize seconds]; motor copies the context into its executor threads
+_request_timings: ContextVar[Optional[List[float]]] = ContextVar("request_timings", default=None)
+
+DB, SERIALIZE = 0, 1
+
+# (metric name, type, help text, [(labels, value), ...])
+Sample = Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]
+
+
+class Histogram:
+    """Fixed-bucket histogram updated with plain integer increments, no locks"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return result
+
+
+def add_db_time(seconds: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[DB] += seconds
+
+
+def current_db_time() -> float:
+    """Seconds the current request has spent in MongoDB commands so far"""
+    timings = _request_timings.get()
+    return timings[DB] if timings is not None else 0.0
+
+
+def add_serialize_time(seconds: float):
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[SERIALIZE] += seconds
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    """Count and time every MongoDB command, and charge its duration to the current request"""
+
+    def __init__(self):
+        self.durations: Dict[str, Histogram] = {}
+        self.failures: Dict[str, int] = {}
+
+    def _histogram(self, command: str) -> Histogram:
+        histogram = self.durations.get(command)
+        if histogram is None:
+            histogram = self.durations.setdefault(command, Histogram())
+        return histogram
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        self._histogram(event.command_name).observe(seconds)
+        add_db_time(seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        self._histogram(event.command_name).observe(seconds)
+        self.failures[event.command_name] = self.failures.get(event.command_name, 0) + 1
+        add_db_time(seconds)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """Request and database metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self, namespace: str = "globetrotter"):
+        self.namespace = namespace
+        self.request_durations: Dict[Tuple[str, str], Histogram] = {}
+        self.request_counts: Dict[Tuple[str, str, int], int] = {}
+        self.command_listener = CommandMetricsListener()
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """Register a callable returning gauge/counter samples read at scrape time"""
+        self._collectors.append(collector)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        key = (method, route)
+        histogram = self.request_durations.get(key)
+        if histogram is None:
+            histogram = self.request_durations[key] = Histogram()
+        histogram.observe(seconds)
+        count_key = (method, route, status)
+        self.request_counts[count_key] = self.request_counts.get(count_key, 0) + 1
+
+    def _histogram_lines(self, name: str, help_text: str, histograms: Iterable[Tuple[Dict[str, str], Histogram]]) -> List[str]:
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, histogram in histograms:
+            for bound, count in histogram.cumulative():
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return lines
+
+    def render(self) -> str:
+        ns = self.namespace
+        lines = self._histogram_lines(
+            f"{ns}_http_request_duration_seconds", "Time spent handling HTTP requests by route",
+            [({"method": method, "route": route}, histogram)
+             for (method, route), histogram in list(self.request_durations.items())],
+        )
+        lines += [f"# HELP {ns}_http_requests_total HTTP requests by route and status",
+                  f"# TYPE {ns}_http_requests_total counter"]
+        for (method, route, status), count in list(self.request_counts.items()):
+            lines.append(f"{ns}_http_requests_total{_format_labels({'method': method, 'route': route, 'status': status})} {count}")
+
+        listener = self.command_listener
+        lines += self._histogram_lines(
+            f"{ns}_mongodb_command_duration_seconds", "Time spent in MongoDB commands",
+            [({"command": command}, histogram) for command, histogram in list(listener.durations.items())],
+        )
+        lines += [f"# HELP {ns}_mongodb_commands_total MongoDB commands by outcome",
+                  f"# TYPE {ns}_mongodb_commands_total counter"]
+        for command, histogram in list(listener.durations.items()):
+            failed = listener.failures.get(command, 0)
+            lines.append(f"{ns}_mongodb_commands_total{_format_labels({'command': command, 'outcome': 'success'})} {histogram.count - failed}")
+            lines.append(f"{ns}_mongodb_commands_total{_format_labels({'command': command, 'outcome': 'failure'})} {failed}")
+
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f"# HELP {ns}_{name} {help_text}", f"# TYPE {ns}_{name} {kind}"]
+                lines.extend(f"{ns}_{name}{_format_labels(labels)} {value}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and adding a Server-Timing header.
+
+    The header splits the time until the response starts into db (MongoDB
+    commands, from the command listener), serialize (JSON encoding of the
+    response body) and handler (everything else).
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+        self._route_paths: Dict[Callable, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            # Label by route template rather than raw path to keep the series count bounded
+            for route in scope["app"].router.routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            else:
+                path = scope["path"]
+            self._route_paths[endpoint] = path
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings = [0.0, 0.0]
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                total_ms = (time.perf_counter() - start) * 1000
+                db_ms, serialize_ms = timings[DB] * 1000, timings[SERIALIZE] * 1000
+                handler_ms = max(total_ms - db_ms - serialize_ms, 0.0)
+                header = f"db;dur={db_ms:.2f}, handler;dur={handler_ms:.2f}, serialize;dur={serialize_ms:.2f}, total;dur={total_ms:.2f}"
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            self.registry.observe_request(scope["method"], self._route_label(scope), status_code, time.perf_counter() - start)
@@ -0,0 +1,12 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+# Shape of a document in the cities collection; shared by the API and app.ingest
+class Destination(BaseModel):
+    city: str
+    country: str
+    clues: List[str]
+    fun_fact: List[str]
+    trivia: List[str]
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+from typing import Callable, List, Optional
+
+import orjson
+
+from app.catalog import DestinationCatalog, build_question_payload
+
+logger = logging.getLogger(__name__)
+
+
+def encode_question(question: dict) -> bytes:
+    """Serialize a question exactly as the /game/question response body"""
+    return orjson.dumps(question)
+
+
+def append_token(payload: bytes, token: str) -> bytes:
+    """Add a "token" field to an encoded question object (tokens never need escaping)"""
+    return b"".join((payload[:-1], b',"token":"', token.encode("ascii"), b'"}'))
+
+
+class QuestionPool:
+    """Ring buffer of pre-encoded GameQuestion payloads.
+
+    The pool is only touched from the event loop, so push and pop never yield
+    and need no lock. A background task refills the buffer once it drains
+    below the low watermark, and the whole buffer is discarded when the
+    catalog swaps in new data. When a `token_issuer` is given, the signed
+    token of each question is added as it is served so its issue time is
+    the time the client received it.
+    """
+
+    def __init__(self, catalog: DestinationCatalog, capacity: int = 2048,
+                 low_watermark: float = 0.5, allow_repeats: bool = False,
+                 batch_size: int = 128, num_options: int = 4,
+                 token_issuer: Optional[Callable[[str], str]] = None, sampler=None):
+        self.catalog = catalog
+        self.capacity = max(1, capacity)
+        self.low_watermark = int(self.capacity * low_watermark)
+        self.allow_repeats = allow_repeats
+        self.batch_size = max(1, batch_size)
+        self.num_options = num_options
+        self.token_issuer = token_issuer
+        self.sampler = sampler
+
+        self._buffer: List[Optional[bytes]] = [None] * self.capacity
+        self._answers: List[Optional[str]] = [None] * self.capacity  # correct city of each buffered question
+        self._head = 0  # next slot to pop
+        self._size = 0
+        self._source = None  # catalog snapshot the buffered questions came from
+        self._order: List[int] = []  # shuffled answer slots when sampling without repeats
+        self._refill_needed = asyncio.Event()
+        self._refill_task: Optional[asyncio.Task] = None
+        self.served = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def fill_ratio(self) -> float:
+        return self._size / self.capacity
+
+    def stats(self) -> dict:
+        return {
+            "size": self._size,
+            "capacity": self.capacity,
+            "fill_ratio": round(self.fill_ratio, 3),
+            "allow_repeats": self.allow_repeats,
+            "served": self.served,
+            "misses": self.misses,
+        }
+
+    def clear(self):
+        self._buffer = [None] * self.capacity
+        self._answers = [None] * self.capacity
+        self._head = 0
+        self._size = 0
+        self._order = []
+
+    def _next_answer_slot(self, data) -> int:
+        total = len(data.cities)
+        if self.sampler is not None:
+            # Weighted by how often players miss each city; uniform until its table is built
+            slot = self.sampler.draw(data)
+            return random.randrange(total) if slot is None else slot
+        if self.allow_repeats:
+            return random.randrange(total)
+        # Walk a shuffled permutation so no answer repeats until all were used
+        if not self._order:
+            self._order = random.sample(range(total), total)
+        return self._order.pop()
+
+    def _sync_with_catalog(self) -> bool:
+        """Drop buffered questions built from an older catalog snapshot"""
+        data = self.catalog.data
+        if data is not self._source:
+            self.clear()
+            self._source = data
+        return bool(data.cities)
+
+    def fill(self, count: Optional[int] = None) -> int:
+        """Generate up to `count` questions into free slots and return how many were added"""
+        if not self._sync_with_catalog():
+            return 0
+        data = self._source
+        free = self.capacity - self._size
+        count = free if count is None else min(count, free)
+        for _ in range(count):
+            answer = self._next_answer_slot(data)
+            slot = (self._head + self._size) % self.capacity
+            self._buffer[slot] = build_question_payload(data, answer, self.num_options)
+            self._answers[slot] = data.cities[answer]
+            self._size += 1
+        return count
+
+    def pop(self) -> Optional[bytes]:
+        """Take the next ready-made payload, or None when the pool is empty"""
+        self._sync_with_catalog()
+        if self._size == 0:
+            self.misses += 1
+            self._refill_needed.set()
+            return None
+        payload = self._buffer[self._head]
+        if self.token_issuer is not None:
+            payload = append_token(payload, self.token_issuer(self._answers[self._head]))
+        self._buffer[self._head] = None
+        self._answers[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        self.served += 1
+        if self._size <= self.low_watermark:
+            self._refill_needed.set()
+        return payload
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                # Fill in small batches so request handlers get a turn in between
+                while self._size < self.capacity and self.fill(self.batch_size):
+                    await asyncio.sleep(0)
+            except Exception as e:
+                logger.error("Error refilling question pool: %s", e)
+
+    def start(self):
+        """Start the background refill task and request an initial fill"""
+        if self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+        self._refill_needed.set()
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
@@ -0,0 +1,66 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Optional, Tuple
+
+
+class InvalidQuestionToken(ValueError):
+    pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class QuestionTokenSigner:
+    """Issues and checks the signed token returned with every question.
+
+    A token is `<issued at, hex>.<destination id, base64url>.<nonce>.<signature>`,
+    where the signature is a truncated HMAC-SHA256 of the first three parts.
+    Checking an answer only needs the secret, so any worker can verify a token
+    issued by another one without shared session state. The random nonce makes
+    every token distinct, so token_id() can record which ones were answered.
+    """
+
+    def __init__(self, secret: str, max_age_seconds: float = 3600.0, digest_size: int = 16):
+        self._key = secret.encode("utf-8")
+        self.max_age_seconds = max_age_seconds
+        self.digest_size = digest_size
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode("utf-8"), hashlib.sha256).digest()[:self.digest_size])
+
+    def issue(self, destination_id: str, issued_at: Optional[int] = None) -> str:
+        issued_at = int(time.time()) if issued_at is None else issued_at
+        payload = f"{issued_at:x}.{_b64encode(destination_id.encode('utf-8'))}.{_b64encode(secrets.token_bytes(8))}"
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Tuple[str, int]:
+        """Return (destination id, issued at) or raise InvalidQuestionToken"""
+        payload, _, signature = token.rpartition(".")
+        if not payload or not hmac.compare_digest(signature.encode("utf-8"), self._sign(payload).encode("ascii")):
+            raise InvalidQuestionToken("Invalid question token")
+        parts = payload.split(".")
+        if len(parts) != 3:
+            raise InvalidQuestionToken("Malformed question token")
+        issued_hex, encoded_id, _ = parts
+        try:
+            issued_at = int(issued_hex, 16)
+            destination_id = _b64decode(encoded_id).decode("utf-8")
+        except ValueError:
+            raise InvalidQuestionToken("Malformed question token")
+        age = time.time() - issued_at
+        if self.max_age_seconds and not -60 <= age <= self.max_age_seconds:
+            raise InvalidQuestionToken("Question token expired")
+        return destination_id, issued_at
+
+
+def token_id(token: str) -> str:
+    """Identifies a verified token, e.g. to refuse a second answer with it"""
+    return token.rpartition(".")[2]
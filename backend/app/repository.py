@@ -0,0 +1,416 @@
+"""Storage behind the API.
+
+Routes and background tasks talk to a Repository instead of a database
+handle. MongoRepository is the production backend. EmbeddedRepository keeps
+everything in process: destinations come from a JSON file such as data.json,
+and users live in dicts that can be persisted to a snapshot file. It needs
+no network, which suits CI, load tests and edge deployments.
+"""
+import asyncio
+import copy
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+# How often insert_user and consume_question_token retry building their indexes while missing
+INDEX_RETRY_SECONDS = 60.0
+
+# Fields the destination catalog needs from each city document
+CATALOG_PROJECTION = {"_id": 0, "city": 1, "country": 1, "clues": 1, "fun_fact": 1, "trivia": 1}
+
+
+class DuplicateUserError(Exception):
+    pass
+
+
+class Repository:
+    """Operations the API needs from its storage"""
+
+    backend = "abstract"
+    name = ""
+
+    async def connect(self) -> "Repository":
+        """Make sure the backend is reachable and return the repository"""
+        return self
+
+    async def close(self):
+        pass
+
+    async def ping(self):
+        pass
+
+    async def find_user(self, username: str, projection: Optional[dict] = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def insert_user(self, user: dict):
+        """Store a new user, raising DuplicateUserError if the username is taken"""
+        raise NotImplementedError
+
+    async def increment_user(self, username: str, deltas: Dict[str, int], projection: Optional[dict] = None,
+                             bits: Optional[Dict[str, int]] = None, fields: Optional[dict] = None,
+                             unset: Optional[List[str]] = None) -> Optional[dict]:
+        """Apply $inc-style deltas, OR `bits` into integer fields, set `fields` and remove the `unset`
+        ones, all in one atomic update; return the updated user, or None if it does not exist.
+        Paths may be dotted."""
+        raise NotImplementedError
+
+    async def apply_increments(self, batch: Dict[str, Dict[str, int]]) -> List[str]:
+        """Apply deltas for many users at once; return the usernames that could not be written"""
+        raise NotImplementedError
+
+    async def consume_question_token(self, token_id: str, expires_at: float) -> bool:
+        """Record a question token as answered until `expires_at` (epoch seconds); False if it
+        already was"""
+        raise NotImplementedError
+
+    async def delete_user(self, username: str) -> bool:
+        raise NotImplementedError
+
+    async def user_scores(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    async def list_destinations(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def count_destinations(self) -> int:
+        raise NotImplementedError
+
+    async def count_documents(self) -> Dict[str, int]:
+        """Document count per collection"""
+        raise NotImplementedError
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    """Copy `document`, keeping only the fields an inclusion projection asks for
+    (or dropping those an exclusion projection names)"""
+    if not projection:
+        return copy.copy(document)
+    if not any(include for key, include in projection.items() if key != "_id"):
+        excluded = {key for key, include in projection.items() if not include}
+        return {key: value for key, value in document.items() if key not in excluded}
+    keep_id = projection.get("_id", 1)
+    result = {key: document[key] for key, include in projection.items() if include and key in document}
+    if keep_id and "_id" in document:
+        result["_id"] = document["_id"]
+    return result
+
+
+def _copy_document(value):
+    """Copy the dicts and lists of a document; the leaf values are immutable and shared"""
+    if isinstance(value, dict):
+        return {key: _copy_document(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_document(item) for item in value]
+    return value
+
+
+def _parent(document: dict, path: str):
+    """The dict holding the last key of a dotted path, creating the ones in between"""
+    *parents, key = path.split(".")
+    for name in parents:
+        document = document.setdefault(name, {})
+    return document, key
+
+
+class MongoRepository(Repository):
+    """Repository over the shared ConnectionManager"""
+
+    backend = "mongodb"
+
+    def __init__(self, connection_manager):
+        self.connection_manager = connection_manager
+        self.name = connection_manager.database_name
+        # Outcome of the last ensure_indexes(); None until it has run
+        self.indexes: Optional[List[str]] = None
+        self.index_errors: Dict[str, str] = {}
+        self._index_tried_at: Dict[str, float] = {}
+
+    @property
+    def db(self):
+        return self.connection_manager.db
+
+    async def connect(self) -> "MongoRepository":
+        await self.connection_manager.connect()
+        return self
+
+    async def close(self):
+        self.connection_manager.close()
+
+    async def ping(self):
+        await self.connection_manager.client.admin.command('ping')
+
+    async def find_user(self, username: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.db.users.find_one({"username": username}, projection)
+
+    @property
+    def unique_usernames(self) -> bool:
+        """Whether the unique username index is known to exist"""
+        return "username_unique" in (self.indexes or ()) and "users" not in self.index_errors
+
+    async def _ensure_collection_indexes(self, collection: str):
+        # Cold starts skip ensure_indexes, so the first write that relies on an index builds (or finds) it
+        now = time.monotonic()
+        tried_at = self._index_tried_at.get(collection)
+        if tried_at is not None and now - tried_at < INDEX_RETRY_SECONDS:
+            return
+        self._index_tried_at[collection] = now
+        await self.ensure_indexes([collection])
+
+    async def insert_user(self, user: dict):
+        from pymongo.errors import DuplicateKeyError
+        if not self.unique_usernames:
+            await self._ensure_collection_indexes("users")
+            # Without the index only this (racy) check keeps names unique, as it did before the index
+            if not self.unique_usernames and await self.db.users.find_one({"username": user["username"]}, {"_id": 1}):
+                raise DuplicateUserError(user["username"])
+        try:
+            # Once the unique username index exists it rejects duplicates, no pre-check needed
+            await self.db.users.insert_one(user)
+        except DuplicateKeyError:
+            raise DuplicateUserError(user["username"])
+
+    async def increment_user(self, username: str, deltas: Dict[str, int], projection: Optional[dict] = None,
+                             bits: Optional[Dict[str, int]] = None, fields: Optional[dict] = None,
+                             unset: Optional[List[str]] = None) -> Optional[dict]:
+        from pymongo import ReturnDocument
+        update = {"$inc": deltas}
+        if bits:
+            update["$bit"] = {path: {"or": value} for path, value in bits.items()}
+        if fields:
+            update["$set"] = fields
+        if unset:
+            update["$unset"] = {path: "" for path in unset}
+        # A single atomic round trip; None means the user does not exist
+        return await self.db.users.find_one_and_update(
+            {"username": username},
+            update,
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def apply_increments(self, batch: Dict[str, Dict[str, int]]) -> List[str]:
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        usernames = list(batch)
+        operations = [UpdateOne({"username": username}, {"$inc": batch[username]}) for username in usernames]
+        try:
+            await self.db.users.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Only the operations that reported an error were not applied
+            return [usernames[error["index"]] for error in e.details.get("writeErrors", [])]
+        return []
+
+    async def consume_question_token(self, token_id: str, expires_at: float) -> bool:
+        from pymongo.errors import DuplicateKeyError
+        if "expires_at_ttl" not in (self.indexes or ()):
+            await self._ensure_collection_indexes("question_tokens")
+        try:
+            # The _id index makes the insert the atomic check across workers
+            await self.db.question_tokens.insert_one(
+                {"_id": token_id, "expires_at": datetime.fromtimestamp(expires_at, timezone.utc)})
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def delete_user(self, username: str) -> bool:
+        result = await self.db.users.delete_one({"username": username})
+        return result.deleted_count > 0
+
+    async def user_scores(self) -> Dict[str, int]:
+        users = await self.db.users.find({}, {"_id": 0, "username": 1, "score": 1}).to_list(None)
+        return {user["username"]: user.get("score", 0) for user in users}
+
+    async def list_destinations(self) -> List[dict]:
+        return await self.db.cities.find({}, CATALOG_PROJECTION).to_list(None)
+
+    async def count_destinations(self) -> int:
+        return await self.db.cities.count_documents({})
+
+    async def count_documents(self) -> Dict[str, int]:
+        db = self.db
+        return {name: await db[name].count_documents({}) for name in await db.list_collection_names()}
+
+    async def ensure_indexes(self, collections=None) -> List[str]:
+        """Create the required indexes, recording which exist and which could not be built"""
+        from app.indexes import ensure_indexes
+        names, errors = await ensure_indexes(self.db, collections)
+        self.indexes = sorted(set(self.indexes or []) | set(names))
+        if collections is None:
+            self.index_errors = errors
+        else:
+            for collection in collections:
+                self.index_errors.pop(collection, None)
+            self.index_errors.update(errors)
+        return names
+
+    def index_stats(self) -> dict:
+        return {"ensured": self.indexes, "errors": self.index_errors}
+
+    def pool_stats(self) -> dict:
+        return self.connection_manager.pool_stats()
+
+
+class EmbeddedRepository(Repository):
+    """In-process storage: destinations from a JSON file, users in memory.
+
+    Users are indexed by username in a dict, so every lookup and update is a
+    hash lookup. With a `snapshot_path` the users are loaded from that file on
+    connect and written back, atomically, every `snapshot_seconds` when they
+    changed and on close. Answered question tokens are kept in memory only.
+    """
+
+    backend = "embedded"
+    name = "embedded"
+
+    def __init__(self, data_path: str, snapshot_path: Optional[str] = None, snapshot_seconds: float = 5.0):
+        self.data_path = data_path
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self._destinations: Optional[List[dict]] = None
+        self._users: Dict[str, dict] = {}
+        self._dirty = False
+        self._loaded = False
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._answered_tokens: Dict[str, float] = {}  # token id -> expiry
+        self._answered_tokens_limit = 1024
+
+    async def connect(self) -> "EmbeddedRepository":
+        if not self._loaded:
+            self._loaded = True
+            with open(self.data_path, encoding="utf-8") as f:
+                destinations = json.load(f)
+            # Like the unique city index, keep the first record of each city
+            by_city: Dict[str, dict] = {}
+            for destination in destinations:
+                by_city.setdefault(destination["city"], destination)
+            self._destinations = list(by_city.values())
+            if self.snapshot_path and os.path.exists(self.snapshot_path):
+                self._users = self._read_snapshot(self.snapshot_path)
+                logger.info("Loaded %d users from %s", len(self._users), self.snapshot_path)
+            if self.snapshot_path and self.snapshot_seconds > 0:
+                self._snapshot_task = asyncio.create_task(self._snapshot_loop())
+        return self
+
+    async def close(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+            try:
+                await self._snapshot_task
+            except asyncio.CancelledError:
+                pass
+            self._snapshot_task = None
+        if self._dirty:
+            await self.save_snapshot()
+
+    @staticmethod
+    def _read_snapshot(path: str) -> Dict[str, dict]:
+        with open(path, encoding="utf-8") as f:
+            documents = json.load(f)
+        users = {}
+        for user in documents:
+            user["_id"] = ObjectId(user["_id"])
+            if user.get("created_at"):
+                user["created_at"] = datetime.fromisoformat(user["created_at"])
+            users[user["username"]] = user
+        return users
+
+    def _write_snapshot(self, documents: List[dict]):
+        temporary = f"{self.snapshot_path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(documents, f, default=str, ensure_ascii=False)
+        os.replace(temporary, self.snapshot_path)
+
+    async def save_snapshot(self):
+        """Write all users to the snapshot file without blocking the event loop"""
+        if not self.snapshot_path:
+            return
+        # Copy on the loop, nested seen-sets included, so the writer thread never sees a document mid-update
+        documents = [_copy_document(user) for user in self._users.values()]
+        self._dirty = False
+        try:
+            await asyncio.to_thread(self._write_snapshot, documents)
+        except Exception:
+            self._dirty = True
+            raise
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_seconds)
+            if self._dirty:
+                try:
+                    await self.save_snapshot()
+                except Exception as e:
+                    logger.error("Error writing user snapshot: %s", e)
+
+    async def find_user(self, username: str, projection: Optional[dict] = None) -> Optional[dict]:
+        user = self._users.get(username)
+        return _project(user, projection) if user is not None else None
+
+    async def insert_user(self, user: dict):
+        if user["username"] in self._users:
+            raise DuplicateUserError(user["username"])
+        user.setdefault("_id", ObjectId())
+        self._users[user["username"]] = dict(user)
+        self._dirty = True
+
+    async def increment_user(self, username: str, deltas: Dict[str, int], projection: Optional[dict] = None,
+                             bits: Optional[Dict[str, int]] = None, fields: Optional[dict] = None,
+                             unset: Optional[List[str]] = None) -> Optional[dict]:
+        user = self._users.get(username)
+        if user is None:
+            return None
+        for field, delta in deltas.items():
+            user[field] = user.get(field, 0) + delta
+        for path, value in (fields or {}).items():
+            parent, key = _parent(user, path)
+            parent[key] = copy.deepcopy(value)
+        for path, value in (bits or {}).items():
+            parent, key = _parent(user, path)
+            parent[key] = parent.get(key, 0) | value
+        for path in unset or ():
+            parent, key = _parent(user, path)
+            parent.pop(key, None)
+        self._dirty = True
+        return _project(user, projection)
+
+    async def apply_increments(self, batch: Dict[str, Dict[str, int]]) -> List[str]:
+        for username, deltas in batch.items():
+            # Like an update without upsert, increments for deleted users are dropped
+            await self.increment_user(username, deltas)
+        return []
+
+    async def consume_question_token(self, token_id: str, expires_at: float) -> bool:
+        if token_id in self._answered_tokens:
+            return False
+        if len(self._answered_tokens) >= self._answered_tokens_limit:
+            now = time.time()
+            self._answered_tokens = {key: expiry for key, expiry in self._answered_tokens.items() if expiry > now}
+            # Pruning again only after the map doubles keeps it amortized O(1) per answer
+            self._answered_tokens_limit = max(1024, 2 * len(self._answered_tokens))
+        self._answered_tokens[token_id] = expires_at
+        return True
+
+    async def delete_user(self, username: str) -> bool:
+        if self._users.pop(username, None) is None:
+            return False
+        self._dirty = True
+        return True
+
+    async def user_scores(self) -> Dict[str, int]:
+        return {username: user.get("score", 0) for username, user in self._users.items()}
+
+    async def list_destinations(self) -> List[dict]:
+        return list(self._destinations or [])
+
+    async def count_destinations(self) -> int:
+        return len(self._destinations or [])
+
+    async def count_documents(self) -> Dict[str, int]:
+        return {"cities": len(self._destinations or []), "users": len(self._users)}
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from app.catalog import CatalogData, DestinationCatalog
+
+logger = logging.getLogger(__name__)
+
+
+class AliasTable:
+    """Vose's alias method: O(n) to build, O(1) per weighted draw"""
+
+    __slots__ = ("probability", "alias", "weights", "total")
+
+    def __init__(self, weights: List[float]):
+        n = len(weights)
+        self.weights = weights
+        self.total = sum(weights)
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+        if n == 0 or self.total <= 0:
+            return
+        scaled = [weight * n / self.total for weight in weights]
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # Whatever is left is 1 up to rounding error
+        for i in small + large:
+            self.probability[i] = 1.0
+
+    def __len__(self):
+        return len(self.probability)
+
+    def draw(self) -> int:
+        slot = random.randrange(len(self.probability))
+        return slot if random.random() < self.probability[slot] else self.alias[slot]
+
+
+class AdaptiveSampler:
+    """Picks question answers in proportion to how often players miss them.
+
+    Each city's weight is its smoothed error rate, (wrong + 1) / (answered + 2),
+    floored at `min_weight` so well-known cities still come up. Draws use an
+    alias table built for the current catalog snapshot; answers recorded
+    since the last build add up how far the weights have moved, and once
+    that exceeds `drift_threshold` of the total weight a background task
+    rebuilds the table. A city drawn within the last `recent_window` draws
+    is kept only with probability `recent_factor`, otherwise redrawn.
+
+    Statistics are kept per process and keyed by city, so they survive
+    catalog reloads.
+    """
+
+    def __init__(self, catalog: DestinationCatalog, drift_threshold: float = 0.05,
+                 recent_window: int = 20, recent_factor: float = 0.2, min_weight: float = 0.05):
+        self.catalog = catalog
+        self.drift_threshold = drift_threshold
+        self.recent_window = recent_window
+        self.recent_factor = recent_factor
+        self.min_weight = min_weight
+
+        self._stats: Dict[str, List[int]] = {}  # city -> [answered, correct]
+        self._table: Optional[AliasTable] = None
+        self._table_data: Optional[CatalogData] = None
+        self._drift = 0.0
+        self._recent: Deque[int] = deque()
+        self._recent_counts: Dict[int, int] = {}
+        self._rebuild_needed = asyncio.Event()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.rebuilds = 0
+        self.built_at = 0.0
+
+    def weight(self, city: str) -> float:
+        answered, correct = self._stats.get(city, (0, 0))
+        return max(self.min_weight, (answered - correct + 1) / (answered + 2))
+
+    def record(self, city: str, correct: bool):
+        """Count one answer to a question about `city`"""
+        before = self.weight(city)
+        stats = self._stats.get(city)
+        if stats is None:
+            stats = self._stats[city] = [0, 0]
+        stats[0] += 1
+        if correct:
+            stats[1] += 1
+        table = self._table
+        if table is not None:
+            self._drift += abs(self.weight(city) - before)
+            if self._drift > self.drift_threshold * table.total:
+                self._rebuild_needed.set()
+
+    def _remember(self, slot: int):
+        window = min(self.recent_window, len(self._table) // 4)
+        if window <= 0:
+            return
+        self._recent.append(slot)
+        self._recent_counts[slot] = self._recent_counts.get(slot, 0) + 1
+        while len(self._recent) > window:
+            oldest = self._recent.popleft()
+            remaining = self._recent_counts[oldest] - 1
+            if remaining:
+                self._recent_counts[oldest] = remaining
+            else:
+                del self._recent_counts[oldest]
+
+    def draw(self, data: CatalogData) -> Optional[int]:
+        """A weighted answer slot of `data`, or None while no table exists for it"""
+        table = self._table
+        if table is None or self._table_data is not data:
+            self._rebuild_needed.set()
+            return None
+        # Rejection keeps draws O(1) on average: recent cities pass with recent_factor
+        for _ in range(8):
+            slot = table.draw()
+            if slot not in self._recent_counts or random.random() < self.recent_factor:
+                break
+        self._remember(slot)
+        return slot
+
+    def _weights(self, data: CatalogData) -> List[float]:
+        # Answers recorded from here on count towards the drift of the next table
+        self._drift = 0.0
+        return [self.weight(city) for city in data.cities]
+
+    def _install(self, data: CatalogData, table: AliasTable):
+        self._table = table
+        self._table_data = data
+        self._recent.clear()
+        self._recent_counts.clear()
+        self.rebuilds += 1
+        self.built_at = time.time()
+
+    def rebuild(self) -> int:
+        """Build the alias table for the current catalog snapshot; returns its size"""
+        data = self.catalog.data
+        self._install(data, AliasTable(self._weights(data)))
+        return len(data.cities)
+
+    async def _rebuild_loop(self):
+        while True:
+            await self._rebuild_needed.wait()
+            self._rebuild_needed.clear()
+            if not self.catalog.loaded:
+                continue
+            try:
+                data = self.catalog.data
+                # Building is O(n), so large catalogs are done off the event loop
+                table = await asyncio.to_thread(AliasTable, self._weights(data))
+                self._install(data, table)
+                logger.debug("Rebuilt the question alias table for %d destinations", len(table))
+            except Exception as e:
+                logger.error("Error rebuilding the question alias table: %s", e)
+
+    def start(self):
+        if self._rebuild_task is None:
+            self._rebuild_task = asyncio.create_task(self._rebuild_loop())
+        self._rebuild_needed.set()
+
+    async def stop(self):
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            try:
+                await self._rebuild_task
+            except asyncio.CancelledError:
+                pass
+            self._rebuild_task = None
+
+    def stats(self, limit: int = 50) -> dict:
+        """Summary of the table plus the `limit` cities with the highest weight"""
+        table = self._table
+        cities = sorted(self._stats, key=lambda city: (-self.weight(city), city))[:limit]
+        return {
+            "destinations": len(table) if table is not None else 0,
+            "tracked_cities": len(self._stats),
+            "answers": sum(answered for answered, _ in self._stats.values()),
+            "rebuilds": self.rebuilds,
+            "built_at": self.built_at or None,
+            "drift": round(self._drift / table.total, 4) if table is not None and table.total else 0.0,
+            "cities": [
+                {
+                    "city": city,
+                    "answered": self._stats[city][0],
+                    "correct": self._stats[city][1],
+                    "weight": round(self.weight(city), 4),
+                    "probability": round(self.weight(city) / table.total, 6) if table is not None and table.total else None,
+                }
+                for city in cities
+            ],
+        }
@@ -0,0 +1,165 @@
+"""Per-user sets of the destinations a player has already been asked about.
+
+A seen-set is a bitset indexed by catalog slot. In the user document it is a
+sparse map of 64-bit words under the fingerprint of the catalog the slots
+refer to, `seen.<fingerprint>.<word>`, so answering a question sets its bit
+with `$bit` in the same atomic update as the score counters, whatever was
+stored before, and only words with a bit set take space. Sets written against
+another catalog are dropped by the next answer after they were read.
+"""
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from bson import Int64
+
+from app.catalog import EMPTY_CATALOG, CatalogData
+
+WORD_BITS = 64
+_WORD_MASK = (1 << WORD_BITS) - 1
+_SIGN_BIT = 1 << (WORD_BITS - 1)
+
+# Fields of the user document that hold the seen-set; seen_catalog is the fingerprint
+# field of the earlier layout, in which `seen` held the words directly
+SEEN_PROJECTION = {"_id": 0, "seen": 1, "seen_catalog": 1}
+
+
+def catalog_fingerprint(data: CatalogData) -> str:
+    """Identifies the slot order of a catalog snapshot"""
+    digest = hashlib.blake2b(digest_size=8)
+    for city in data.cities:
+        digest.update(city.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def to_int64(word: int) -> Int64:
+    """An unsigned 64-bit word as the signed BSON integer MongoDB stores"""
+    return Int64(word - (1 << WORD_BITS) if word & _SIGN_BIT else word)
+
+
+class SeenSet:
+    __slots__ = ("fingerprint", "words", "stale", "obsolete", "expires")
+
+    def __init__(self, fingerprint: str, words, stale: bool, obsolete: List[str], expires: float):
+        self.fingerprint = fingerprint
+        self.words = words  # numpy uint64 array, bit `slot % 64` of word `slot // 64`
+        # Every slot was seen and `words` started over, so the next write replaces the stored set
+        self.stale = stale
+        # Stored fields of other catalogs (or the earlier layout) for the next write to remove
+        self.obsolete = obsolete
+        self.expires = expires
+
+
+class SeenSets:
+    """LRU cache of seen-sets by username, and the unseen-first slot picker.
+
+    Entries expire after `ttl_seconds` so answers handled by other workers
+    are picked up; this worker's own answers update its entry in place.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, SeenSet]" = OrderedDict()
+        self._fingerprint: Tuple[CatalogData, str] = (EMPTY_CATALOG, catalog_fingerprint(EMPTY_CATALOG))
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def fingerprint(self, data: CatalogData) -> str:
+        built_for, fingerprint = self._fingerprint
+        if built_for is not data:
+            fingerprint = catalog_fingerprint(data)
+            self._fingerprint = (data, fingerprint)
+        return fingerprint
+
+    def get(self, username: str, data: CatalogData) -> Optional[SeenSet]:
+        """The cached seen-set of `username` for `data`, or None when it must be read"""
+        entry = self._entries.get(username)
+        if entry is None or entry.expires < time.monotonic() or entry.fingerprint != self.fingerprint(data):
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(username)
+        self.hits += 1
+        return entry
+
+    def load(self, username: str, document: dict, data: CatalogData) -> SeenSet:
+        """Cache the seen-set stored in a user document (read with SEEN_PROJECTION)"""
+        # Imported here so NumPy stays off the cold-start path until a player asks for a question
+        import numpy as np
+
+        fingerprint = self.fingerprint(data)
+        words = np.zeros((len(data.cities) + WORD_BITS - 1) // WORD_BITS, dtype="<u8")
+        stored = document.get("seen") or {}
+        current = stored.get(fingerprint)
+        for key, value in (current.items() if isinstance(current, dict) else ()):
+            index = int(key)
+            if 0 <= index < len(words):
+                words[index] = int(value) & _WORD_MASK
+        obsolete = [f"seen.{key}" for key in stored if key != fingerprint]
+        if "seen_catalog" in document:
+            obsolete.append("seen_catalog")
+        entry = SeenSet(fingerprint, words, False, obsolete, time.monotonic() + self.ttl_seconds)
+        if self.ttl_seconds > 0:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def pick(self, entry: SeenSet, data: CatalogData) -> int:
+        """A random slot the player has not seen; once all are seen the set resets"""
+        import numpy as np
+
+        total = len(data.cities)
+        words = entry.words
+        # While most slots are unseen a few random probes find one without scanning the set
+        for _ in range(8):
+            slot = random.randrange(total)
+            if not (int(words[slot // WORD_BITS]) >> (slot % WORD_BITS)) & 1:
+                return slot
+        # Complement the words, unpack them to one byte per slot and draw among the set ones
+        unseen = np.unpackbits((~words).view(np.uint8), bitorder="little")[:total]
+        slots = np.flatnonzero(unseen)
+        if not len(slots):
+            entry.words[:] = 0
+            entry.stale = True
+            self.resets += 1
+            return random.randrange(total)
+        return int(slots[random.randrange(len(slots))])
+
+    def mark(self, username: str, slot: int, data: CatalogData) -> dict:
+        """Record `slot` as seen; returns the user update, as increment_user keyword arguments"""
+        fingerprint = self.fingerprint(data)
+        word, bit = divmod(slot, WORD_BITS)
+        value = to_int64(1 << bit)
+        update = {"bits": {f"seen.{fingerprint}.{word}": value}}
+        entry = self._entries.get(username)
+        if entry is not None and entry.fingerprint == fingerprint:
+            entry.words[word] |= entry.words.dtype.type(1 << bit)
+            if entry.stale:
+                # Every destination was seen, so start over whatever is stored
+                entry.stale = False
+                update = {"fields": {f"seen.{fingerprint}": {str(word): value}}}
+            if entry.obsolete:
+                update["unset"], entry.obsolete = entry.obsolete, []
+        return update
+
+    def invalidate(self, username: str):
+        self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "resets": self.resets,
+        }
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import math
+import secrets
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.catalog import CatalogData
+
+logger = logging.getLogger(__name__)
+
+# Rough per-session footprint used for the memory cap: the object, its slot list,
+# its dict entries in the store and the wheel, plus the encoded question it holds
+SESSION_OVERHEAD_BYTES = 640
+SLOT_BYTES = 36
+
+
+class SessionStoreFull(Exception):
+    pass
+
+
+class GameSession:
+    """One timed game of `len(slots)` rounds, each about a different destination"""
+
+    __slots__ = ("id", "username", "data", "slots", "difficulty", "answered", "correct",
+                 "started", "deadline", "question", "finished_at", "written", "timer_tick", "size")
+
+    def __init__(self, session_id: str, username: Optional[str], data: CatalogData, slots: List[int],
+                 difficulty: str, time_limit: float):
+        self.id = session_id
+        self.username = username
+        self.data = data  # the catalog snapshot the slots refer to, kept even if the catalog reloads
+        self.slots = slots
+        self.difficulty = difficulty
+        self.answered = 0
+        self.correct = 0
+        self.started = time.monotonic()
+        self.deadline = self.started + time_limit
+        self.question: Optional[bytes] = None  # encoded question of the current round once asked
+        self.finished_at: Optional[float] = None
+        self.written = False
+        self.timer_tick = 0
+        self.size = 0
+
+    @property
+    def rounds(self) -> int:
+        return len(self.slots)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def remaining(self, now: Optional[float] = None) -> float:
+        end = self.finished_at if self.finished_at is not None else self.deadline
+        return max(0.0, end - (time.monotonic() if now is None else now))
+
+    def result(self) -> Dict[str, int]:
+        """The increments this session adds to its user"""
+        return {"score": self.correct, "correct_answers": self.correct, "total_answers": self.answered}
+
+    def status(self) -> dict:
+        return {
+            "session_id": self.id,
+            "username": self.username,
+            "difficulty": self.difficulty,
+            "rounds": self.rounds,
+            "answered": self.answered,
+            "correct": self.correct,
+            "remaining_seconds": round(self.remaining(), 3),
+            "finished": self.finished,
+        }
+
+
+class TimerWheel:
+    """Hashed timing wheel: `slots` buckets of `tick_seconds` each.
+
+    Scheduling and cancelling are O(1); advancing visits only the buckets of
+    the ticks that passed. Timers further out than one turn of the wheel stay
+    in their bucket until the turn in which they are due.
+    """
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 512):
+        self.tick_seconds = tick_seconds
+        self._buckets: List[Dict[str, int]] = [{} for _ in range(max(1, slots))]
+        self._tick = self.tick_of(time.monotonic())
+
+    def tick_of(self, when: float) -> int:
+        return math.ceil(when / self.tick_seconds)
+
+    def schedule(self, key: str, when: float) -> int:
+        # Never schedule into a tick that was already processed
+        tick = max(self.tick_of(when), self._tick + 1)
+        self._buckets[tick % len(self._buckets)][key] = tick
+        return tick
+
+    def cancel(self, key: str, tick: int):
+        self._buckets[tick % len(self._buckets)].pop(key, None)
+
+    def advance(self, now: float) -> List[str]:
+        """The keys of every timer due up to `now`"""
+        target = self.tick_of(now)
+        due = []
+        # After a long stall one lap covers every bucket
+        for tick in range(max(self._tick + 1, target - len(self._buckets) + 1), target + 1):
+            bucket = self._buckets[tick % len(self._buckets)]
+            expired = [key for key, key_tick in bucket.items() if key_tick <= target]
+            for key in expired:
+                del bucket[key]
+            due += expired
+        self._tick = max(self._tick, target)
+        return due
+
+
+class SessionStore:
+    """In-process store of timed game sessions.
+
+    A session's single timer fires at its deadline, which ends it if the
+    player has not finished, and again `result_ttl_seconds` after it ended,
+    which removes it. Results are written to the users collection once per
+    session: by the request that answers the last round, or by the expiry
+    task, which writes everything that ended in a tick in one batch through
+    Repository.apply_increments. New sessions are refused while the
+    estimated memory of the live ones exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, result_ttl_seconds: float = 60.0,
+                 tick_seconds: float = 1.0, wheel_slots: int = 512, drain_timeout_seconds: float = 5.0,
+                 on_written: Optional[Callable[[Dict[str, Dict[str, int]]], None]] = None):
+        self.max_bytes = max_bytes
+        self.result_ttl_seconds = result_ttl_seconds
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.on_written = on_written
+        self.wheel = TimerWheel(tick_seconds, wheel_slots)
+        self._sessions: Dict[str, GameSession] = {}
+        self.bytes = 0
+        self._expiry_task: Optional[asyncio.Task] = None
+        self._get_database = None
+        self.started = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.refused = 0
+        self.failed_writes = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _resize(self, session: GameSession):
+        size = (SESSION_OVERHEAD_BYTES + SLOT_BYTES * len(session.slots) + len(session.id)
+                + len(session.username or "") + len(session.question or b""))
+        self.bytes += size - session.size
+        session.size = size
+
+    def _schedule(self, session: GameSession, when: float):
+        self.wheel.cancel(session.id, session.timer_tick)
+        session.timer_tick = self.wheel.schedule(session.id, when)
+
+    def create(self, username: Optional[str], data: CatalogData, slots: List[int], difficulty: str,
+               time_limit: float) -> GameSession:
+        if self.bytes >= self.max_bytes:
+            self.refused += 1
+            raise SessionStoreFull()
+        session = GameSession(secrets.token_urlsafe(16), username, data, slots, difficulty, time_limit)
+        self._sessions[session.id] = session
+        self._resize(session)
+        self._schedule(session, session.deadline)
+        self.started += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[GameSession]:
+        return self._sessions.get(session_id)
+
+    def set_question(self, session: GameSession, question: Optional[bytes]):
+        session.question = question
+        self._resize(session)
+
+    def finish(self, session: GameSession, now: Optional[float] = None):
+        """End a session; it stays readable for result_ttl_seconds"""
+        if session.finished:
+            return
+        now = time.monotonic() if now is None else now
+        session.finished_at = min(now, session.deadline)
+        if session.answered < session.rounds:
+            self.timed_out += 1
+        else:
+            self.completed += 1
+        self.set_question(session, None)
+        # Nothing to write for anonymous or unanswered sessions
+        session.written = not session.username or not session.answered
+        self._schedule(session, now + self.result_ttl_seconds)
+
+    def remove(self, session: GameSession):
+        if self._sessions.pop(session.id, None) is not None:
+            self.wheel.cancel(session.id, session.timer_tick)
+            self.bytes -= session.size
+
+    async def write_results(self, repository, sessions: List[GameSession]) -> int:
+        """Write the results of ended sessions in one batch; returns the number written"""
+        pending = [session for session in sessions if session.finished and not session.written]
+        if not pending:
+            return 0
+        batch: Dict[str, Dict[str, int]] = {}
+        for session in pending:
+            # Two sessions of one player that end together merge into one update
+            deltas = batch.setdefault(session.username, {"score": 0, "correct_answers": 0, "total_answers": 0})
+            for field, value in session.result().items():
+                deltas[field] += value
+        failed = set(await repository.apply_increments(batch))
+        if failed:
+            self.failed_writes += len(failed)
+            logger.error("Writing session results failed for %d of %d users", len(failed), len(batch))
+        for session in pending:
+            session.written = session.username not in failed
+        written = {username: deltas for username, deltas in batch.items() if username not in failed}
+        if written and self.on_written is not None:
+            self.on_written(written)
+        return len(written)
+
+    async def expire(self, repository, now: Optional[float] = None) -> int:
+        """Run the timers due by `now`: end sessions past their deadline, remove old ones"""
+        now = time.monotonic() if now is None else now
+        due = [session for session in map(self._sessions.get, self.wheel.advance(now)) if session is not None]
+        removable = []
+        for session in due:
+            if session.finished:
+                removable.append(session)
+            else:
+                self.finish(session, now)
+        try:
+            await self.write_results(repository, due)
+        except Exception as e:
+            self.failed_writes += 1
+            logger.error("Error writing session results: %s", e)
+        for session in removable:
+            if session.written:
+                self.remove(session)
+            else:
+                # Keep the result until it has been written
+                self._schedule(session, now + self.result_ttl_seconds)
+        return len(due)
+
+    async def _expiry_loop(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick_seconds)
+            try:
+                await self.expire(await self._get_database())
+            except Exception as e:
+                logger.error("Error expiring game sessions: %s", e)
+
+    def start(self, get_database):
+        """Start the task that drives the timer wheel"""
+        self._get_database = get_database
+        if self._expiry_task is None:
+            self._expiry_task = asyncio.create_task(self._expiry_loop())
+
+    async def stop(self):
+        """Stop the expiry task, ending live sessions and writing their results"""
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+            try:
+                await self._expiry_task
+            except asyncio.CancelledError:
+                pass
+            self._expiry_task = None
+        sessions = list(self._sessions.values())
+        for session in sessions:
+            self.finish(session)
+        if self._get_database is not None and any(not session.written for session in sessions):
+            try:
+                repository = await self._get_database()
+                await asyncio.wait_for(self.write_results(repository, sessions), timeout=self.drain_timeout_seconds)
+            except Exception as e:
+                logger.error("Error writing results of %d game sessions: %s", len(sessions), e)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "started": self.started,
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "refused": self.refused,
+            "failed_writes": self.failed_writes,
+        }
@@ -0,0 +1,115 @@
+"""Nearest-neighbour table of destinations, used to pick distractors by difficulty.
+
+Each destination is described by the words of its clues, fun facts and
+trivia, weighted with TF-IDF. The weights are kept sparse, as row entries
+(CSR) plus per-term postings, so memory grows with the words actually
+used rather than destinations x vocabulary. Cosine similarities are
+accumulated a block of rows at a time from the postings of the terms in
+the block, and only the `k` most similar destinations of each one are
+kept, so picking look-alike distractors is a table lookup. Cities in the
+same country get a fixed bonus so they rank first.
+"""
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r"[^\W\d_]{3,}")
+_STOP_WORDS = frozenset("""
+about after also among and are around been but built can city country during each famous for from has have
+here home its known largest more most one only over some than that the their there this through was were
+what when where which while who with world worlds your
+""".split())
+
+# Similarity cells computed per block of rows; with the argpartition scratch about 16 bytes each
+BLOCK_CELLS = 1 << 22
+
+# Added to the cosine similarity (at most 1) of destinations in the same country
+SAME_COUNTRY_BONUS = 1.0
+
+
+def _words(texts: List[str]) -> List[str]:
+    return [word for text in texts for word in _WORD.findall(text.lower()) if word not in _STOP_WORDS]
+
+
+def tfidf_rows(documents: List[List[str]], max_features: int = 4096) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Sparse L2-normalised TF-IDF rows for tokenised documents, over the `max_features` most common terms.
+
+    Returns CSR arrays (row offsets, term columns, weights) and the number of terms.
+    """
+    document_frequency: Dict[str, int] = {}
+    for words in documents:
+        for word in set(words):
+            document_frequency[word] = document_frequency.get(word, 0) + 1
+    vocabulary = sorted(document_frequency, key=lambda word: (-document_frequency[word], word))[:max_features]
+    columns = {word: column for column, word in enumerate(vocabulary)}
+
+    offsets = [0]
+    row_columns: List[int] = []
+    row_counts: List[int] = []
+    for words in documents:
+        counts: Dict[int, int] = {}
+        for word in words:
+            column = columns.get(word)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        for column in sorted(counts):
+            row_columns.append(column)
+            row_counts.append(counts[column])
+        offsets.append(len(row_columns))
+
+    indptr = np.array(offsets, dtype=np.int64)
+    indices = np.array(row_columns, dtype=np.int64)
+    frequencies = np.array([document_frequency[word] for word in vocabulary], dtype=np.float32)
+    idf = np.log((1.0 + len(documents)) / (1.0 + frequencies)) + 1.0
+    weights = np.log1p(np.array(row_counts, dtype=np.float32)) * idf[indices]
+    rows = np.repeat(np.arange(len(documents)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(documents))).astype(np.float32)
+    np.divide(weights, norms[rows], out=weights, where=norms[rows] > 0)
+    return indptr, indices, weights, len(vocabulary)
+
+
+def build_neighbour_table(countries: List[str], texts: List[List[str]], k: int = 16,
+                          block_size: int = 0) -> np.ndarray:
+    """(destinations, k) array of slots, most similar first; -1 pads rows of tiny catalogs"""
+    total = len(countries)
+    k = max(0, min(k, total - 1))
+    table = np.full((total, k), -1, dtype=np.int32)
+    if k == 0:
+        return table
+
+    indptr, indices, weights, terms = tfidf_rows([_words(slot_texts) for slot_texts in texts])
+    rows = np.repeat(np.arange(total), np.diff(indptr))
+    # Postings: the same entries ordered by term, so each term's destinations are one slice
+    order = np.argsort(indices, kind="stable")
+    posting_rows = rows[order]
+    posting_weights = weights[order]
+    posting_offsets = np.zeros(terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=terms), out=posting_offsets[1:])
+
+    # By default blocks shrink as the catalog grows so the scratch memory stays bounded
+    block_size = block_size or max(16, BLOCK_CELLS // total)
+    _, country_ids = np.unique(np.array(countries, dtype=object), return_inverse=True)
+    for start in range(0, total, block_size):
+        stop = min(start + block_size, total)
+        similarity = np.zeros((stop - start, total), dtype=np.float32)
+        entries = slice(indptr[start], indptr[stop])
+        block_rows = rows[entries] - start
+        block_terms = indices[entries]
+        block_weights = weights[entries]
+        # Group the block's entries by term; each term adds an outer product onto its postings
+        by_term = np.argsort(block_terms, kind="stable")
+        term_starts = np.flatnonzero(np.diff(block_terms[by_term], prepend=-1))
+        for first, last in zip(term_starts, np.append(term_starts[1:], len(by_term))):
+            members = by_term[first:last]
+            term = block_terms[members[0]]
+            postings = slice(posting_offsets[term], posting_offsets[term + 1])
+            similarity[np.ix_(block_rows[members], posting_rows[postings])] += np.outer(
+                block_weights[members], posting_weights[postings])
+        similarity += SAME_COUNTRY_BONUS * (country_ids[start:stop, None] == country_ids[None, :])
+        # A destination is never its own distractor
+        similarity[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        nearest = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarity, nearest, axis=1), axis=1, kind="stable")
+        table[start:stop] = np.take_along_axis(nearest, order, axis=1)
+    return table
@@ -0,0 +1,370 @@
+"""Memory-mapped binary snapshot of the destination catalog.
+
+Every worker of a multi-process deployment maps the same read-only file, so
+the destination data lives once in the page cache instead of once per
+process, and only one worker reads the cities collection per refresh.
+
+Layout (little-endian; every section starts on a 4-byte boundary):
+
+    header        magic, format version, destination count, content version,
+                  created_at, string count, list item count
+    records       9 x u32 per destination: city, country, option string ids,
+                  then (start, count) into the list items for clues, fun
+                  facts and trivia
+    list items    u32 string ids
+    string index  u32 offsets into the string blob, one more than strings
+    string blob   the JSON encoding of every distinct string
+
+Strings are stored JSON-encoded so the pre-encoded response fragments are
+plain slices of the map; Python strings are decoded only when asked for.
+
+A new snapshot is written to a temporary file and renamed over the old one.
+Workers compare the content version in the header with the one they mapped
+and remap when it changed; the old mapping stays valid until it is no
+longer referenced.
+
+Usage (from the backend directory):
+    python -m app.snapshot catalog.snap --from-file data.json
+    python -m app.snapshot catalog.snap          # from the cities collection
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, List, Optional
+
+import orjson
+
+from app.catalog import CatalogData, DestinationCatalog, EncodedDestinations, build_catalog_data
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GTCATLG\x00"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<8sIIQdII")
+_RECORD_FIELDS = 9
+_CITY, _COUNTRY, _OPTION, _CLUES, _FUN_FACTS, _TRIVIA = 0, 1, 2, 3, 5, 7
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def encode_snapshot(data: CatalogData, created_at: Optional[float] = None) -> bytes:
+    """Serialize a catalog into the snapshot format"""
+    strings: Dict[bytes, int] = {}
+
+    def string_id(encoded: bytes) -> int:
+        sid = strings.get(encoded)
+        if sid is None:
+            sid = strings[encoded] = len(strings)
+        return sid
+
+    records: List[int] = []
+    items: List[int] = []
+    encoded = data.encoded
+    for slot in range(len(data.cities)):
+        records += (string_id(encoded.cities[slot]), string_id(orjson.dumps(data.countries[slot])),
+                    string_id(encoded.options[slot]))
+        for values in (encoded.clues[slot], encoded.fun_facts[slot], [orjson.dumps(t) for t in data.trivia[slot]]):
+            records += (len(items), len(values))
+            items += (string_id(value) for value in values)
+
+    blob = b"".join(strings)
+    offsets, position = [0], 0
+    for value in strings:
+        position += len(value)
+        offsets.append(position)
+
+    body = b"".join((
+        struct.pack(f"<{len(records)}I", *records),
+        struct.pack(f"<{len(items)}I", *items),
+        struct.pack(f"<{len(offsets)}I", *offsets),
+        blob,
+    ))
+    version = int.from_bytes(hashlib.blake2b(body, digest_size=8).digest(), "little")
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(data.cities), version,
+                          time.time() if created_at is None else created_at, len(strings), len(items))
+    return header + body
+
+
+def write_snapshot(path: str, data: CatalogData) -> int:
+    """Atomically replace the snapshot at `path` and return its content version"""
+    payload = encode_snapshot(data)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return _HEADER.unpack_from(payload)[3]
+
+
+def read_header(path: str) -> Optional[tuple]:
+    """(content version, created_at) of the snapshot at `path`, or None if there is none"""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(raw) < _HEADER.size:
+        return None
+    magic, format_version, _, version, created_at, _, _ = _HEADER.unpack(raw)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        return None
+    return version, created_at
+
+
+class _Column:
+    """Read-only sequence over one string field of the snapshot records"""
+
+    __slots__ = ("_snapshot", "_field", "_raw")
+
+    def __init__(self, snapshot: "MappedSnapshot", field: int, raw: bool):
+        self._snapshot = snapshot
+        self._field = field
+        self._raw = raw
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def __getitem__(self, slot: int):
+        snapshot = self._snapshot
+        if slot < 0:
+            slot += snapshot.count
+        if not 0 <= slot < snapshot.count:
+            raise IndexError(slot)
+        value = snapshot.string(snapshot.records[slot * _RECORD_FIELDS + self._field])
+        return value if self._raw else orjson.loads(value)
+
+    def __iter__(self):
+        return (self[slot] for slot in range(len(self)))
+
+
+class _ListColumn(_Column):
+    """Read-only sequence over one list field; each item is a new list"""
+
+    __slots__ = ()
+
+    def __getitem__(self, slot: int):
+        snapshot = self._snapshot
+        if slot < 0:
+            slot += snapshot.count
+        if not 0 <= slot < snapshot.count:
+            raise IndexError(slot)
+        base = slot * _RECORD_FIELDS + self._field
+        start, count = snapshot.records[base], snapshot.records[base + 1]
+        values = [snapshot.string(sid) for sid in snapshot.items[start:start + count]]
+        return values if self._raw else [orjson.loads(value) for value in values]
+
+
+class MappedSnapshot:
+    """A snapshot file mapped read-only into this process"""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise SnapshotError("Destination snapshots can only be mapped on little-endian hosts")
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise SnapshotError(f"{path} is too short to be a destination snapshot")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, count, version, created_at, strings, items = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a destination snapshot")
+        if format_version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} has format {format_version}, expected {FORMAT_VERSION}")
+        self.path = path
+        self.count = count
+        self.version = version
+        self.created_at = created_at
+
+        if _HEADER.size + 4 * (count * _RECORD_FIELDS + items + strings + 1) > len(self._map):
+            raise SnapshotError(f"{path} is truncated")
+        view = memoryview(self._map)
+        position = _HEADER.size
+        end = position + 4 * count * _RECORD_FIELDS
+        self.records = view[position:end].cast("I")
+        position, end = end, end + 4 * items
+        self.items = view[position:end].cast("I")
+        position, end = end, end + 4 * (strings + 1)
+        self._offsets = view[position:end].cast("I")
+        self._blob_start = end
+        if end + self._offsets[-1] > len(self._map):
+            raise SnapshotError(f"{path} is truncated")
+
+    def string(self, sid: int) -> bytes:
+        offsets = self._offsets
+        start = self._blob_start
+        return self._map[start + offsets[sid]:start + offsets[sid + 1]]
+
+    def catalog_data(self) -> CatalogData:
+        """A CatalogData whose columns read from the map on access"""
+        cities = _Column(self, _CITY, raw=False)
+        encoded = EncodedDestinations(
+            _Column(self, _CITY, raw=True),
+            _Column(self, _OPTION, raw=True),
+            _ListColumn(self, _CLUES, raw=True),
+            _ListColumn(self, _FUN_FACTS, raw=True),
+        )
+        return CatalogData(
+            cities,
+            _Column(self, _COUNTRY, raw=False),
+            _ListColumn(self, _CLUES, raw=False),
+            _ListColumn(self, _FUN_FACTS, raw=False),
+            _ListColumn(self, _TRIVIA, raw=False),
+            {city: slot for slot, city in enumerate(cities)},
+            self.created_at,
+            "shared",
+            encoded,
+            f"{self.version:016x}",
+        )
+
+
+class SharedCatalogSnapshot:
+    """Keeps a DestinationCatalog on the shared snapshot at `path`.
+
+    Every `check_seconds` each worker reads the snapshot header and remaps
+    the file when its content version changed. Once the snapshot is older
+    than `max_age_seconds` (or missing), one worker, chosen with a
+    non-blocking file lock, reloads the destinations from the repository
+    and publishes a new snapshot; the others pick it up on their next check.
+    """
+
+    def __init__(self, catalog: DestinationCatalog, path: str, max_age_seconds: float = 300.0,
+                 check_seconds: float = 5.0):
+        self.catalog = catalog
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self.check_seconds = check_seconds
+        self.version: Optional[int] = None
+        self.remaps = 0
+        self.publishes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def stats(self) -> dict:
+        return {"path": self.path, "version": f"{self.version:016x}" if self.version is not None else None,
+                "remaps": self.remaps, "publishes": self.publishes}
+
+    def map(self) -> bool:
+        """Map the snapshot if its content differs from the mapped one; True when the catalog changed"""
+        header = read_header(self.path)
+        if header is None or header[0] == self.version:
+            return False
+        snapshot = MappedSnapshot(self.path)
+        self.catalog.set_data(snapshot.catalog_data())
+        self.version = snapshot.version
+        self.remaps += 1
+        logger.info("Mapped destination snapshot %016x with %d destinations", snapshot.version, snapshot.count)
+        return True
+
+    def is_stale(self) -> bool:
+        header = read_header(self.path)
+        if header is None:
+            return True
+        return self.max_age_seconds > 0 and time.time() - header[1] > self.max_age_seconds
+
+    async def publish(self, repository, force: bool = False) -> bool:
+        """Rebuild the snapshot from the repository unless another worker is doing it"""
+        lock = await asyncio.to_thread(self._try_lock)
+        if lock is False:
+            return False
+        try:
+            # Another worker may have published while we waited for the lock
+            if not force and not self.is_stale():
+                self.map()
+                return False
+            data = build_catalog_data(await repository.list_destinations())
+            version = await asyncio.to_thread(write_snapshot, self.path, data)
+            self.publishes += 1
+            logger.info("Published destination snapshot %016x with %d destinations", version, len(data.cities))
+            self.map()
+            return True
+        finally:
+            if lock is not None:
+                os.close(lock)
+
+    def _try_lock(self):
+        """File descriptor holding the publish lock, None without locking support, False if taken"""
+        if fcntl is None:
+            return None
+        descriptor = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(descriptor)
+            return False
+        return descriptor
+
+    async def sync(self, get_database):
+        """Map a newer snapshot, publishing one first if it is missing or stale"""
+        if self.is_stale():
+            await self.publish(await get_database())
+        self.map()
+
+    async def _sync_loop(self, get_database):
+        while True:
+            await asyncio.sleep(self.check_seconds)
+            try:
+                await self.sync(get_database)
+            except Exception as e:
+                logger.error("Error syncing destination snapshot: %s", e)
+
+    def start(self, get_database):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop(get_database))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _load_from_database(args) -> CatalogData:
+    from app.database import ConnectionManager
+    from app.repository import MongoRepository
+
+    manager = ConnectionManager(args.mongodb_uri, database_name=args.database)
+    repository = MongoRepository(manager)
+    try:
+        await repository.connect()
+        return build_catalog_data(await repository.list_destinations())
+    finally:
+        await repository.close()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="snapshot file to write")
+    parser.add_argument("--from-file", help="build from a JSON array of destinations instead of MongoDB")
+    parser.add_argument("--mongodb-uri", default=os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="city_data")
+    args = parser.parse_args()
+
+    if args.from_file:
+        with open(args.from_file, encoding="utf-8") as f:
+            data = build_catalog_data(orjson.loads(f.read()), source="file")
+    else:
+        data = asyncio.run(_load_from_database(args))
+    version = write_snapshot(args.path, data)
+    print(f"Wrote {len(data.cities)} destinations to {args.path} (version {version:016x})")
+
+
+if __name__ == "__main__":
+    main()
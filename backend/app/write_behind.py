@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCORE_FIELDS = ("score", "correct_answers", "total_answers")
+
+
+class ScoreWriteBuffer:
+    """Coalesces per-user score increments in memory and writes them in batches.
+
+    Every answer adds to the pending $inc for its user. A background task
+    flushes the pending deltas every `flush_interval_ms`, or sooner once
+    `max_pending_events` answers are waiting, through
+    Repository.apply_increments in batches of at most `max_batch_ops` users
+    (unordered UpdateOne($inc) bulk writes on MongoDB). Deltas that fail to write
+    are merged back and retried on the next flush. Until its write returns, a
+    batch being flushed still counts in merge() and pending_score(), so reads
+    never miss it.
+    """
+
+    def __init__(self, flush_interval_ms: int = 250, max_pending_events: int = 500,
+                 max_batch_ops: int = 1000, drain_timeout_seconds: float = 5.0):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending_events = max(1, max_pending_events)
+        self.max_batch_ops = max(1, max_batch_ops)
+        self.drain_timeout_seconds = drain_timeout_seconds
+
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._inflight: Dict[str, Dict[str, int]] = {}
+        self._pending_events = 0
+        self._flush_now = asyncio.Event()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._get_database = None
+        self.flushed_events = 0
+        self.flushed_ops = 0
+        self.failed_flushes = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            "pending_users": len(self._pending),
+            "pending_events": self._pending_events,
+            "flushed_events": self.flushed_events,
+            "flushed_ops": self.flushed_ops,
+            "failed_flushes": self.failed_flushes,
+        }
+
+    def add(self, username: str, correct: bool):
+        """Queue one answer for a user"""
+        deltas = self._pending.get(username)
+        if deltas is None:
+            deltas = self._pending[username] = {"score": 0, "correct_answers": 0, "total_answers": 0}
+        deltas["total_answers"] += 1
+        if correct:
+            deltas["score"] += 1
+            deltas["correct_answers"] += 1
+        self._pending_events += 1
+        if self._pending_events >= self.max_pending_events:
+            self._flush_now.set()
+
+    def pending_score(self, username: str) -> int:
+        score = 0
+        for deltas in (self._pending.get(username), self._inflight.get(username)):
+            if deltas:
+                score += deltas["score"]
+        return score
+
+    def merge(self, user: dict) -> dict:
+        """Add any unflushed deltas, including those being written, to a user document read from the database"""
+        username = user.get("username")
+        for deltas in (self._pending.get(username), self._inflight.get(username)):
+            if deltas:
+                for field in SCORE_FIELDS:
+                    user[field] = user.get(field, 0) + deltas[field]
+        return user
+
+    def discard(self, username: str):
+        """Forget pending deltas, e.g. after the user was deleted"""
+        deltas = self._pending.pop(username, None)
+        if deltas:
+            self._pending_events -= deltas["total_answers"]
+        self._inflight.pop(username, None)
+
+    def _restore(self, batch: Dict[str, Dict[str, int]]):
+        """Merge deltas that could not be written back into the pending set"""
+        for username, deltas in batch.items():
+            pending = self._pending.get(username)
+            if pending is None:
+                self._pending[username] = deltas
+            else:
+                for field in SCORE_FIELDS:
+                    pending[field] += deltas[field]
+            self._pending_events += deltas["total_answers"]
+
+    async def flush(self, repository) -> int:
+        """Write everything pending and return the number of update operations sent"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            events, self._pending_events = self._pending_events, 0
+            self._inflight = batch
+
+            usernames: List[str] = list(batch)
+            sent = 0
+            try:
+                for start in range(0, len(usernames), self.max_batch_ops):
+                    chunk = usernames[start:start + self.max_batch_ops]
+                    try:
+                        failed = set(await repository.apply_increments({username: batch[username] for username in chunk}))
+                    except (Exception, asyncio.CancelledError):
+                        # Nothing from this chunk on was written; users deleted meanwhile stay dropped
+                        self._restore({username: self._inflight[username] for username in usernames[start:]
+                                       if username in self._inflight})
+                        self.failed_flushes += 1
+                        raise
+                    # Written deltas are now in the database, failed ones go back to pending
+                    restore = {}
+                    for username in chunk:
+                        deltas = self._inflight.pop(username, None)
+                        if deltas is not None and username in failed:
+                            restore[username] = deltas
+                    if failed:
+                        self._restore(restore)
+                        self.failed_flushes += 1
+                        logger.error("Score flush failed for %d of %d users", len(failed), len(chunk))
+                    sent += len(chunk)
+            finally:
+                self._inflight = {}
+
+            self.flushed_events += events
+            self.flushed_ops += sent
+            return sent
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            if not self._pending:
+                continue
+            try:
+                await self.flush(await self._get_database())
+            except Exception as e:
+                logger.error("Error flushing score updates: %s", e)
+
+    def start(self, get_database):
+        """Start the periodic flush task"""
+        self._get_database = get_database
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and drain what is still pending, within drain_timeout_seconds"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._pending and self._get_database is not None:
+            try:
+                repository = await self._get_database()
+                await asyncio.wait_for(self.flush(repository), timeout=self.drain_timeout_seconds)
+                logger.info("Drained pending score updates")
+            except Exception as e:
+                logger.error("Error draining %d pending score updates: %s", self._pending_events, e)
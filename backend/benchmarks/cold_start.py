@@ -0,0 +1,126 @@
+"""Cold-start benchmark for the API.
+
+Each run starts a fresh interpreter the way a new serverless instance would:
+- import time: how long `import app.main` takes in a clean process
+- time to first byte: from spawning uvicorn until the first byte of a
+  GET /game/question response arrives
+
+Usage (from the backend directory):
+    python -m benchmarks.cold_start --runs 10 --output cold_start.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _benchmark_env(cold_start: bool) -> dict:
+    env = dict(os.environ)
+    env["COLD_START_MODE"] = "true" if cold_start else "false"
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def measure_import(env: dict) -> float:
+    """Seconds spent importing app.main in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _first_byte(port: int, path: str, deadline: float) -> float:
+    """Poll until the server answers and return the time the first byte arrived"""
+    request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode()
+    while time.perf_counter() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as sock:
+                # Once connected, wait for the response for as long as the deadline allows
+                sock.settimeout(max(deadline - time.perf_counter(), 0.001))
+                sock.sendall(request)
+                if sock.recv(1):
+                    return time.perf_counter()
+        except OSError:
+            time.sleep(0.005)
+    raise TimeoutError(f"Server did not answer {path} in time")
+
+
+def measure_ttfb(env: dict, path: str, timeout: float) -> float:
+    """Seconds from spawning uvicorn to the first response byte for `path`"""
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        return _first_byte(port, path, start + timeout) - start
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+def _summary(samples) -> dict:
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 2),
+        "median_ms": round(statistics.median(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def run(runs: int, path: str, timeout: float, cold_start: bool) -> dict:
+    env = _benchmark_env(cold_start)
+    import_times = [measure_import(env) for _ in range(runs)]
+    ttfb_times = [measure_ttfb(env, path, timeout) for _ in range(runs)]
+    return {
+        "cold_start_mode": cold_start,
+        "path": path,
+        "python": sys.version.split()[0],
+        "import": _summary(import_times),
+        "time_to_first_byte": _summary(ttfb_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/game/question")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for the first byte")
+    parser.add_argument("--full-startup", action="store_true", help="benchmark with COLD_START_MODE disabled")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.runs, args.path, args.timeout, cold_start=not args.full_startup)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""Load and latency benchmark for the API.
+
+Drives `app.main:app` in-process through httpx's ASGI transport, or a running
+server with --url, against a MongoDB stand-in seeded from data.json. It uses
+mongomock-motor by default, a real local MongoDB with --mongodb-uri, or the
+in-process embedded store with --storage embedded.
+
+Scenarios:
+- question_storm: GET /game/question
+- answer_storm: POST /game/answer for registered players
+- registration_burst: POST /users with fresh usernames
+- mixed_gameplay: questions, answers and profile reads in game-like proportions
+- cors_preflight: browser preflights (OPTIONS with Origin) for POST /game/answer
+
+For each scenario it reports requests per second, p50/p95/p99 latency,
+errors, and database round trips per request (in-process runs only).
+Results can be saved as JSON and compared against an earlier run.
+
+Usage (from the backend directory):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.load --requests 2000 --concurrency 50 --output bench.json
+    python -m benchmarks.load --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(BACKEND_DIR, "data.json")
+
+SCENARIOS = ("question_storm", "answer_storm", "registration_burst", "mixed_gameplay", "cors_preflight")
+
+
+class RoundTripCounter:
+    """Counts calls that reach the database through the proxies below"""
+
+    def __init__(self):
+        self.count = 0
+
+
+def _counted(method, counter: RoundTripCounter):
+    def call(*args, **kwargs):
+        counter.count += 1
+        return method(*args, **kwargs)
+    return call
+
+
+class CountingCollection:
+    """Collection wrapper that counts every method call as one round trip"""
+
+    def __init__(self, collection, counter: RoundTripCounter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        value = getattr(self._collection, name)
+        return _counted(value, self._counter) if callable(value) else value
+
+
+class CountingDatabase:
+    """Database wrapper whose collections and commands are counted"""
+
+    def __init__(self, database, counter: RoundTripCounter):
+        self._database = database
+        self._counter = counter
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._counter)
+
+    def __getattr__(self, name):
+        value = getattr(self._database, name)
+        if hasattr(value, "find_one"):  # attribute access to a collection (db.users)
+            return CountingCollection(value, self._counter)
+        return _counted(value, self._counter) if callable(value) else value
+
+
+class CountingClient:
+    """Client wrapper whose databases count their round trips"""
+
+    def __init__(self, client, counter: RoundTripCounter):
+        self._client = client
+        self._counter = counter
+
+    def __getitem__(self, name):
+        return CountingDatabase(self._client[name], self._counter)
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        if hasattr(value, "list_collection_names"):  # attribute access to a database (client.admin)
+            return CountingDatabase(value, self._counter)
+        return value
+
+
+def _bit_updater(doc, field_name, value):
+    if isinstance(doc, dict):
+        result = doc.get(field_name, 0)
+        for operation, operand in value.items():
+            if operation == "and":
+                result &= operand
+            elif operation == "or":
+                result |= operand
+            elif operation == "xor":
+                result ^= operand
+        doc[field_name] = result
+
+
+def patch_mongomock():
+    """Teach mongomock the $bit update operator, which MongoDB has but mongomock lacks"""
+    from mongomock import collection
+
+    collection._updaters.setdefault("$bit", _bit_updater)
+
+
+def load_destinations() -> List[dict]:
+    with open(DATA_PATH, encoding="utf-8") as f:
+        documents = json.load(f)
+    seen, unique = set(), []
+    for doc in documents:
+        if doc["city"] not in seen:
+            seen.add(doc["city"])
+            unique.append(doc)
+    return unique
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+class BenchmarkTarget:
+    """The app under test plus the hooks needed to seed and measure it"""
+
+    def __init__(self, url: Optional[str], mongodb_uri: Optional[str], storage: str = "mongodb"):
+        self.url = url
+        self.mongodb_uri = mongodb_uri
+        self.storage = storage
+        self.counter = RoundTripCounter()
+        self.app = None
+        self.client = None
+        self._lifespan = None
+        self.cities: List[str] = [doc["city"] for doc in load_destinations()]
+        self.issue_token: Optional[Callable[[str], str]] = None
+
+    async def __aenter__(self):
+        import httpx
+
+        if self.url:
+            # Answers need question tokens signed with the server's SECRET_KEY; without it
+            # they carry correct_city, which the server only takes with QUESTION_TOKEN_REQUIRED=false
+            if os.getenv("SECRET_KEY"):
+                sys.path.insert(0, BACKEND_DIR)
+                from app.question_tokens import QuestionTokenSigner
+                self.issue_token = QuestionTokenSigner(os.environ["SECRET_KEY"]).issue
+            self.client = httpx.AsyncClient(base_url=self.url, timeout=30)
+            return self
+
+        os.environ.setdefault("LOG_LEVEL", "ERROR")
+        os.environ["COLD_START_MODE"] = "false"
+        os.environ["STORAGE_BACKEND"] = self.storage
+        if self.mongodb_uri:
+            os.environ["MONGODB_URI"] = self.mongodb_uri
+        sys.path.insert(0, BACKEND_DIR)
+        import app.main as main
+
+        if self.storage == "embedded":
+            # Nothing to seed: destinations come from data.json and there is no database to count
+            return await self._start(main)
+
+        if self.mongodb_uri:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            raw_client = AsyncIOMotorClient(self.mongodb_uri)
+        else:
+            from mongomock_motor import AsyncMongoMockClient
+            patch_mongomock()
+            raw_client = AsyncMongoMockClient()
+
+        database = raw_client[main.connection_manager.database_name]
+        await database.cities.delete_many({})
+        await database.users.delete_many({"username": {"$regex": "^bench_"}})
+        await database.cities.insert_many(load_destinations())
+
+        main.connection_manager._client = CountingClient(raw_client, self.counter)
+        return await self._start(main)
+
+    async def _start(self, main):
+        import httpx
+
+        self.app = main.app
+        self.issue_token = main.question_tokens.issue
+        self._lifespan = main.app.router.lifespan_context(main.app)
+        await self._lifespan.__aenter__()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=30)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        if self._lifespan is not None:
+            await self._lifespan.__aexit__(None, None, None)
+
+    @property
+    def counts_round_trips(self) -> bool:
+        return self.app is not None and self.storage != "embedded"
+
+
+async def register_players(client, count: int, prefix: str) -> List[str]:
+    usernames = [f"{prefix}{i}_{random.randrange(1 << 30)}" for i in range(count)]
+    for username in usernames:
+        await client.post("/users", json={"username": username})
+    return usernames
+
+
+def scenario_requests(name: str, target: BenchmarkTarget, players: List[str]) -> Callable:
+    """Return a coroutine factory issuing one request of the given scenario"""
+    cities = target.cities
+    registration_ids = iter(range(10 ** 9))
+
+    async def question(client):
+        return await client.get("/game/question")
+
+    async def answer(client):
+        city = random.choice(cities)
+        selected = city if random.random() < 0.6 else random.choice(cities)
+        question = {"token": target.issue_token(city)} if target.issue_token else {"correct_city": city}
+        return await client.post(
+            "/game/answer",
+            params={"username": random.choice(players)},
+            json={"selected_city": selected, **question},
+        )
+
+    async def register(client):
+        return await client.post("/users", json={"username": f"bench_new_{next(registration_ids)}_{random.randrange(1 << 30)}"})
+
+    async def profile(client):
+        return await client.get(f"/users/{random.choice(players)}")
+
+    async def preflight(client):
+        return await client.options("/game/answer", headers={
+            "Origin": "https://globetrotter.example",
+            "Access-Control-Request-Method": "POST",
+            "Access-Control-Request-Headers": "content-type",
+        })
+
+    async def mixed(client):
+        roll = random.random()
+        if roll < 0.55:
+            return await question(client)
+        if roll < 0.9:
+            return await answer(client)
+        if roll < 0.97:
+            return await profile(client)
+        return await register(client)
+
+    return {
+        "question_storm": question,
+        "answer_storm": answer,
+        "registration_burst": register,
+        "mixed_gameplay": mixed,
+        "cors_preflight": preflight,
+    }[name]
+
+
+async def run_scenario(target: BenchmarkTarget, name: str, total: int, concurrency: int, players: List[str]) -> dict:
+    make_request = scenario_requests(name, target, players)
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await make_request(target.client)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    round_trips_before = target.counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    round_trips = target.counter.count - round_trips_before
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+        "db_round_trips_per_request": round(round_trips / len(ordered), 3) if target.counts_round_trips and ordered else None,
+    }
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    results: Dict[str, dict] = {}
+    async with BenchmarkTarget(args.url, args.mongodb_uri, args.storage) as target:
+        players = await register_players(target.client, args.players, "bench_player_")
+        for name in args.scenarios:
+            # A short warm-up so pools and caches are in their steady state
+            await run_scenario(target, name, min(50, args.requests), min(5, args.concurrency), players)
+            results[name] = await run_scenario(target, name, args.requests, args.concurrency, players)
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+        for username in players:
+            await target.client.delete(f"/users/{username}")
+
+    return {
+        "commit": current_commit(),
+        "target": args.url or (f"in-process ({args.storage})" if args.storage == "embedded"
+                               else "in-process (mongodb)" if args.mongodb_uri else "in-process (mongomock)"),
+        "python": sys.version.split()[0],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scenarios": results,
+    }
+
+
+def compare(current: dict, baseline: dict) -> str:
+    """Render a side-by-side comparison of two result files"""
+    lines = [f"baseline {baseline.get('commit')} -> current {current.get('commit')}"]
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        parts = []
+        for key in ("rps", "p50_ms", "p95_ms", "p99_ms", "db_round_trips_per_request"):
+            old, new = before.get(key), result.get(key)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            parts.append(f"{key} {old} -> {new} ({change})")
+        lines.append(f"{name}: " + ", ".join(parts))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--players", type=int, default=100, help="users registered before the run")
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--mongodb-uri", help="seed and use this MongoDB instead of mongomock")
+    parser.add_argument("--storage", choices=("mongodb", "embedded"), default="mongodb",
+                        help="storage backend of the in-process app")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare against an earlier results file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import asyncio
+
+from app.admission import AdmissionMiddleware, ConcurrencyLimiter, TokenBuckets
+
+
+def http_scope(method, path, query=b""):
+    return {"type": "http", "method": method, "path": path, "query_string": query,
+            "headers": [], "client": ("10.0.0.1", 1234)}
+
+
+async def call(app, scope):
+    """Run one request through an ASGI app; returns (status, headers)"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"])
+
+
+def make_app(release: asyncio.Event = None):
+    async def app(scope, receive, send):
+        if release is not None:
+            await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+    return app
+
+
+def test_token_bucket_limits_after_the_burst():
+    """Test that a bucket allows its burst and then reports the wait until the next token"""
+    buckets = TokenBuckets(rate=1.0, burst=2)
+    assert buckets.take("a") == 0
+    assert buckets.take("a") == 0
+    assert 0 < buckets.take("a") <= 1.0
+    assert buckets.take("b") == 0
+    assert buckets.limited == 1
+
+
+def test_rate_limited_request_gets_429_with_retry_after():
+    """Test that a client over its bucket is answered 429 without reaching the route"""
+    middleware = AdmissionMiddleware(make_app(), {("GET", "/leaderboard"): ConcurrencyLimiter(4)},
+                                     ip_buckets=TokenBuckets(rate=0.5, burst=1))
+
+    async def scenario():
+        first = await call(middleware, http_scope("GET", "/leaderboard"))
+        second = await call(middleware, http_scope("GET", "/leaderboard"))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first[0] == 200
+    assert second[0] == 429
+    assert second[1][b"retry-after"] == b"2"
+
+
+def test_limiter_sheds_with_503_and_retry_after():
+    """Test that requests beyond the limit and the queue are shed with 503"""
+    limiter = ConcurrencyLimiter(1, max_queue=0)
+
+    async def scenario():
+        release = asyncio.Event()
+        middleware = AdmissionMiddleware(make_app(release), {("GET", "/users/{username}"): limiter},
+                                         retry_after_seconds=3)
+        held = asyncio.create_task(call(middleware, http_scope("GET", "/users/alice")))
+        await asyncio.sleep(0)
+        shed = await call(middleware, http_scope("GET", "/users/bob"))
+        release.set()
+        return await held, shed
+
+    held, shed = asyncio.run(scenario())
+    assert held[0] == 200
+    assert shed == (503, {b"content-type": b"application/json", b"retry-after": b"3"})
+    assert limiter.rejected == 1
+    assert limiter.in_flight == 0
+
+
+def test_queued_request_gets_the_released_slot():
+    """Test that a request waiting in the queue is admitted when a slot frees up"""
+    limiter = ConcurrencyLimiter(1, max_queue=1, queue_timeout=1.0)
+
+    async def scenario():
+        assert await limiter.acquire()
+        waiting = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1
+        limiter.release()
+        return await waiting
+
+    assert asyncio.run(scenario()) is True
+    assert limiter.in_flight == 1
+    assert limiter.queued == 1
+
+
+def test_limit_adapts_to_database_latency():
+    """Test that the limit shrinks while the database is slow and grows back once it recovers"""
+    limiter = ConcurrencyLimiter(40, target_db_latency=0.1, adjust_interval=0, smoothing=1.0)
+
+    async def scenario():
+        for _ in range(3):
+            await limiter.acquire()
+            limiter.release(db_seconds=0.5)
+        shrunk = limiter.limit
+        for _ in range(3):
+            await limiter.acquire()
+            limiter.release(db_seconds=0.01)
+        return shrunk
+
+    shrunk = asyncio.run(scenario())
+    assert shrunk == int(int(int(40 * 0.75) * 0.75) * 0.75)
+    assert limiter.limit == shrunk + 3
+    assert limiter.min_limit <= shrunk
+
+
+def test_routes_match_by_template():
+    """Test that templated routes are limited by segment and other paths pass through"""
+    profile, rank = ConcurrencyLimiter(1), ConcurrencyLimiter(1)
+    middleware = AdmissionMiddleware(make_app(), {("GET", "/users/{username}"): profile,
+                                                  ("GET", "/users/{username}/rank"): rank})
+    assert middleware.limiter_for("GET", "/users/alice") is profile
+    assert middleware.limiter_for("GET", "/users/alice/rank") is rank
+    assert middleware.limiter_for("DELETE", "/users/alice") is None
+    assert middleware.limiter_for("GET", "/users/") is None
+    assert middleware.limiter_for("GET", "/health") is None
+
+
+def test_every_database_route_is_limited():
+    """Test that no route that can reach the database skips admission control"""
+    from fastapi.routing import APIRoute
+
+    from app import main
+
+    unlimited = {"/", "/health", "/metrics", "/debug", "/debug/database"}
+    for route in main.app.routes:
+        if not isinstance(route, APIRoute) or route.path in unlimited or route.path.startswith("/admin/"):
+            continue
+        for method in route.methods:
+            assert (method, route.path) in main.admission_limiters, f"{method} {route.path}"
@@ -89,6 +89,9 @@ class TestGlobetrotterAPI:
         assert data["status"] == "healthy"
         assert data["database"] == "connected"
         assert "cities_count" in data
+        assert data["backend"] in ("mongodb", "embedded")
+        assert "catalog_snapshot" in data
+        assert "POST /game/answer" in data["admission"]
 
     def test_debug_endpoint(self):
         """Test the debug endpoint returns debugging information"""
@@ -135,6 +138,22 @@ class TestGlobetrotterAPI:
         except Exception as e:
             logger.warning(f"Could not delete test user {unique_username}: {str(e)}")
 
+    def test_user_conditional_get(self):
+        """Test ETag and If-None-Match handling for user reads"""
+        unique_username = f"{TEST_USERNAME}_etag_{int(time.time())}"
+        make_request("POST", "/users", {"username": unique_username}, expected_status=200)
+        try:
+            response = make_request("GET", f"/game/challenge/{unique_username}", expected_status=200)
+            etag = response.headers["etag"]
+            assert "s-maxage" in response.headers["cache-control"]
+
+            cached = requests.get(f"{API_URL}/game/challenge/{unique_username}",
+                                  headers={"If-None-Match": etag}, timeout=10)
+            assert cached.status_code == 304
+            assert cached.content == b""
+        finally:
+            make_request("DELETE", f"/users/{unique_username}")
+
     def test_game_question(self):
         """Test that the game question endpoint returns valid questions"""
         response = make_request("GET", "/game/question", expected_status=200)
@@ -156,6 +175,162 @@ class TestGlobetrotterAPI:
         
         assert "correct_answer" in data
 
+    def test_game_questions_batch(self):
+        """Test that a batch of questions covers distinct destinations and honours exclude"""
+        response = make_request("GET", "/game/questions?count=5&exclude=Paris", expected_status=200)
+        questions = response.json()["questions"]
+        assert len(questions) == 5
+
+        answers = [question["correct_answer"] for question in questions]
+        assert len(set(answers)) == len(answers)
+        assert "Paris" not in answers
+        for question in questions:
+            assert "token" in question
+            assert len(question["options"]) == 4
+
+    def test_game_question_difficulty(self):
+        """Test that every difficulty returns a well-formed question and unknown ones are rejected"""
+        for difficulty in ("easy", "medium", "hard"):
+            response = make_request("GET", f"/game/question?difficulty={difficulty}", expected_status=200)
+            question = response.json()
+            cities = [option["city"] for option in question["options"]]
+            assert len(cities) == 4 and len(set(cities)) == 4
+            assert question["correct_answer"] in cities
+            assert "token" in question
+        make_request("GET", "/game/question?difficulty=impossible", expected_status=422)
+
+    def test_question_stats_require_admin(self):
+        """Test that the sampling statistics are not served without the admin token"""
+        make_request("GET", "/admin/questions/stats", expected_status=403)
+
+    def test_game_questions_stream(self):
+        """Test the NDJSON streaming mode of the batch endpoint"""
+        response = make_request("GET", "/game/questions?count=3&stream=true", expected_status=200)
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [line for line in response.text.splitlines() if line]
+        assert len(lines) == 3
+
+    def test_answer_with_question_token(self):
+        """Test that answers are checked against the signed question token"""
+        question = make_request("GET", "/game/question", expected_status=200).json()
+        assert "token" in question
+
+        response = make_request("POST", "/game/answer", {
+            "selected_city": question["correct_answer"],
+            "token": question["token"],
+        }, expected_status=200)
+        assert response.json()["correct"] is True
+
+        # A tampered token is rejected instead of trusting the client
+        make_request("POST", "/game/answer", {
+            "selected_city": question["correct_answer"],
+            "token": question["token"][:-4] + "AAAA",
+        }, expected_status=400)
+
+    def test_question_token_scores_once(self):
+        """Test that replaying a question token does not score again"""
+        unique_username = f"{TEST_USERNAME}_replay_{int(time.time())}"
+        make_request("POST", "/users", {"username": unique_username}, expected_status=200)
+        try:
+            question = make_request("GET", "/game/question", expected_status=200).json()
+            answer = {"selected_city": question["correct_answer"], "token": question["token"]}
+            make_request("POST", f"/game/answer?username={unique_username}", answer, expected_status=200)
+            make_request("POST", f"/game/answer?username={unique_username}", answer, expected_status=409)
+            assert make_request("GET", f"/users/{unique_username}", expected_status=200).json()["score"] == 1
+        finally:
+            make_request("DELETE", f"/users/{unique_username}")
+
+    def test_game_question_unseen(self):
+        """Test that a player is not asked about the same destination twice in a row"""
+        unique_username = f"{TEST_USERNAME}_seen_{int(time.time())}"
+        make_request("POST", "/users", {"username": unique_username}, expected_status=200)
+        try:
+            asked = []
+            for _ in range(2):
+                question = make_request("GET", f"/game/question?username={unique_username}", expected_status=200).json()
+                asked.append(question["correct_answer"])
+                make_request("POST", f"/game/answer?username={unique_username}", {
+                    "selected_city": question["correct_answer"],
+                    "token": question["token"],
+                }, expected_status=200)
+            assert asked[0] != asked[1]
+            # The seen-set is internal and not part of the public user document
+            assert "seen" not in make_request("GET", f"/users/{unique_username}", expected_status=200).json()
+        finally:
+            make_request("DELETE", f"/users/{unique_username}")
+
+        make_request("GET", f"/game/question?username={unique_username}", expected_status=404)
+
+    def test_game_session(self):
+        """Test a timed session: its result is written to the user once the last round is answered"""
+        unique_username = f"{TEST_USERNAME}_session_{int(time.time())}"
+        make_request("POST", "/users", {"username": unique_username}, expected_status=200)
+        try:
+            session = make_request("POST", "/game/session", {
+                "username": unique_username, "rounds": 2, "time_limit_seconds": 60,
+            }, expected_status=200).json()
+            session_id = session["session_id"]
+            assert session["rounds"] == 2
+            assert not session["finished"]
+
+            for round_number in (1, 2):
+                question = make_request("GET", f"/game/session/{session_id}/question", expected_status=200).json()
+                assert question["round"] == round_number
+                assert "correct_answer" not in question["question"]
+                result = make_request("POST", f"/game/session/{session_id}/answer", {
+                    "selected_city": question["question"]["options"][0]["city"],
+                }, expected_status=200).json()
+                assert result["session"]["answered"] == round_number
+                if round_number == 1:
+                    # Nothing is written before the session ends
+                    assert result["user"] is None
+
+            assert result["session"]["finished"]
+            assert result["user"]["total_answers"] == 2
+            make_request("GET", f"/game/session/{session_id}/question", expected_status=410)
+        finally:
+            make_request("DELETE", f"/users/{unique_username}")
+
+        make_request("GET", "/game/session/unknown", expected_status=404)
+
+    def test_leaderboard(self):
+        """Test the leaderboard returns ranked entries and honours the page size"""
+        response = make_request("GET", "/leaderboard?limit=5", expected_status=200)
+        data = response.json()
+        assert "total_players" in data
+        assert len(data["entries"]) <= 5
+
+        scores = [entry["score"] for entry in data["entries"]]
+        assert scores == sorted(scores, reverse=True)
+        for entry in data["entries"]:
+            assert "rank" in entry
+            assert "username" in entry
+
+    def test_user_rank(self):
+        """Test that a new user gets a rank and percentile"""
+        unique_username = f"{TEST_USERNAME}_rank_{int(time.time())}"
+        make_request("POST", "/users", {"username": unique_username}, expected_status=200)
+        try:
+            response = make_request("GET", f"/users/{unique_username}/rank", expected_status=200)
+            data = response.json()
+            assert data["username"] == unique_username
+            assert data["score"] == 0
+            assert data["rank"] >= 1
+            assert 0 <= data["percentile"] <= 100
+        finally:
+            make_request("DELETE", f"/users/{unique_username}")
+
+    def test_metrics(self):
+        """Test the metrics endpoint and the Server-Timing header"""
+        question = make_request("GET", "/game/question", expected_status=200)
+        assert "server-timing" in question.headers
+        assert "db;dur=" in question.headers["server-timing"]
+
+        response = make_request("GET", "/metrics", expected_status=200)
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "globetrotter_http_request_duration_seconds_bucket" in response.text
+        assert 'route="/game/question"' in response.text
+
     @pytest.mark.skipif(not os.getenv("RUN_PERFORMANCE_TESTS"), 
                         reason="Performance tests are skipped by default")
     def test_question_performance(self):
@@ -0,0 +1,35 @@
+import asyncio
+
+from app.catalog import DestinationCatalog
+
+
+class StaticRepository:
+    def __init__(self, documents):
+        self.documents = documents
+
+    async def list_destinations(self):
+        return [dict(doc) for doc in self.documents]
+
+
+def destination(city, country="France", clues=("A clue",)):
+    return {"city": city, "country": country, "clues": list(clues), "fun_fact": ["A fact"], "trivia": []}
+
+
+def test_reload_keeps_an_unchanged_snapshot():
+    """Test that a refresh returning the same destinations does not swap the snapshot"""
+    repository = StaticRepository([destination("Paris"), destination("Lyon")])
+    catalog = DestinationCatalog(ttl_seconds=0)
+
+    async def scenario():
+        await catalog.load(repository)
+        first = catalog.data
+        await catalog.load(repository)
+        assert catalog.data is first
+
+        repository.documents[1] = destination("Lyon", clues=("Another clue",))
+        await catalog.load(repository)
+        assert catalog.data is not first
+        assert catalog.data.clues[1] == ["Another clue"]
+        await catalog.stop_background_refresh()
+
+    asyncio.run(scenario())
@@ -0,0 +1,127 @@
+import asyncio
+
+from app.cors import CORSMiddleware
+
+ORIGIN = b"https://globetrotter.example"
+
+
+def http_scope(method, path, headers=()):
+    return {"type": "http", "method": method, "path": path, "query_string": b"", "headers": list(headers)}
+
+
+def preflight_headers(origin=ORIGIN):
+    return [(b"origin", origin), (b"access-control-request-method", b"POST"),
+            (b"access-control-request-headers", b"content-type")]
+
+
+async def call(app, scope):
+    """Run one request through an ASGI app; returns (status, header list, body)"""
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages[0]["status"], messages[0]["headers"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def make_app(fail=False):
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["method"])
+        if fail:
+            raise RuntimeError("boom")
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b"{}"})
+    app.calls = calls
+    return app
+
+
+def make_middleware(app, allow_origins=("*",)):
+    return CORSMiddleware(app, allow_origins=allow_origins, allow_methods=("GET", "POST"),
+                          allow_headers=("Content-Type",), expose_headers=("ETag",), max_age=600)
+
+
+def run(middleware, scope):
+    return asyncio.run(call(middleware, scope))
+
+
+def test_preflight_is_answered_without_reaching_the_app():
+    """Test that a preflight gets 204 with the allowed methods, headers and max age from the middleware"""
+    app = make_app()
+    status, headers, body = run(make_middleware(app), http_scope("OPTIONS", "/game/answer", preflight_headers()))
+    assert status == 204
+    assert body == b""
+    assert dict(headers) == {
+        b"access-control-allow-origin": b"*",
+        b"access-control-allow-methods": b"GET, POST",
+        b"access-control-allow-headers": b"Content-Type",
+        b"access-control-max-age": b"600",
+        b"content-length": b"0",
+    }
+    assert app.calls == []
+
+
+def test_options_without_request_method_is_not_a_preflight():
+    app = make_app()
+    status, _, _ = run(make_middleware(app), http_scope("OPTIONS", "/game/answer", [(b"origin", ORIGIN)]))
+    assert status == 200
+    assert app.calls == ["OPTIONS"]
+
+
+def test_allowed_origin_is_echoed_with_vary():
+    """Test that with an origin list the matching origin is echoed and responses vary on Origin"""
+    middleware = make_middleware(make_app(), allow_origins=[ORIGIN.decode()])
+
+    status, headers, _ = run(middleware, http_scope("GET", "/leaderboard", [(b"origin", ORIGIN)]))
+    assert status == 200
+    assert (b"access-control-allow-origin", ORIGIN) in headers
+    assert (b"vary", b"Origin") in headers
+    assert (b"access-control-expose-headers", b"ETag") in headers
+
+    status, headers, _ = run(middleware, http_scope("OPTIONS", "/game/answer", preflight_headers()))
+    assert status == 204
+    assert (b"access-control-allow-origin", ORIGIN) in headers
+    assert (b"vary", b"Origin") in headers
+
+
+def test_denied_origin_gets_no_cors_headers():
+    """Test that other origins get no allow-origin header and their preflights are refused"""
+    app = make_app()
+    middleware = make_middleware(app, allow_origins=[ORIGIN.decode()])
+    other = b"https://evil.example"
+
+    status, headers, _ = run(middleware, http_scope("GET", "/leaderboard", [(b"origin", other)]))
+    assert status == 200
+    assert [name for name, _ in headers if name.startswith(b"access-control-")] == []
+    assert (b"vary", b"Origin") in headers
+
+    status, headers, body = run(middleware, http_scope("OPTIONS", "/game/answer", preflight_headers(other)))
+    assert status == 400
+    assert body == b"Disallowed CORS origin"
+    assert app.calls == ["GET"]
+
+
+def test_same_origin_request_still_varies_on_origin():
+    """Test that a response cached without an Origin header is not reused for a cross-origin request"""
+    _, headers, _ = run(make_middleware(make_app(), allow_origins=[ORIGIN.decode()]), http_scope("GET", "/health"))
+    assert headers[-1] == (b"vary", b"Origin")
+
+
+def test_wildcard_responses_do_not_vary():
+    _, headers, _ = run(make_middleware(make_app()), http_scope("GET", "/health", [(b"origin", ORIGIN)]))
+    assert (b"access-control-allow-origin", b"*") in headers
+    assert b"vary" not in dict(headers)
+
+
+def test_unhandled_error_keeps_cors_headers():
+    """Test that a 500 from an unhandled error is still readable by the browser"""
+    status, headers, body = run(make_middleware(make_app(fail=True)),
+                                http_scope("GET", "/leaderboard", [(b"origin", ORIGIN)]))
+    assert status == 500
+    assert (b"access-control-allow-origin", b"*") in headers
+    assert body == b'{"detail":"Internal Server Error"}'
@@ -0,0 +1,84 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from app.ingest import ingest, iter_json_array
+
+
+def parse(text, chunk_size):
+    return list(iter_json_array(io.StringIO(text), chunk_size=chunk_size))
+
+
+def destination(city, clues=("A clue",)):
+    return {"city": city, "country": "France", "clues": list(clues), "fun_fact": ["A fact"], "trivia": ["Trivia"]}
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 64])
+def test_iter_json_array_across_chunk_boundaries(chunk_size):
+    """Test that elements split across reads, numbers included, are decoded whole"""
+    text = '[12345, "abc", {"city": "Paris", "clues": ["x", "y"]}, -0.5e3, true, null, [1, [2]] ]'
+    assert parse(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4, 64])
+@pytest.mark.parametrize("text", ["[]", " [ ] ", "[\n  1\n]"])
+def test_iter_json_array_small_arrays(text, chunk_size):
+    assert parse(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 64])
+@pytest.mark.parametrize("text", ["[1 2]", "[1,,2]", "[1,]", "[,1]", "[1", "[1,", '{"city": "Paris"}', "", "[tru]"])
+def test_iter_json_array_rejects_malformed_input(text, chunk_size):
+    with pytest.raises(ValueError):
+        parse(text, chunk_size)
+
+
+def run_ingest(existing, records, **options):
+    """ingest() against an in-memory database seeded with `existing`; returns (report, cities)"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["ingest_test"]
+
+    async def scenario():
+        if existing:
+            await ingest(db, existing)
+        report = await ingest(db, records, **options)
+        cities = {doc["city"]: doc async for doc in db.cities.find({}, {"_id": 0})}
+        return report, cities
+
+    return asyncio.run(scenario())
+
+
+def test_ingest_inserts_updates_and_prunes():
+    """Test that only new and changed destinations are written and missing ones pruned"""
+    existing = [destination("Paris"), destination("Lyon"), destination("Nice")]
+    records = [destination("Paris"), destination("Lyon", clues=("Another clue",)), destination("Rome"),
+               destination("Rome", clues=("Duplicate",))]
+    report, cities = run_ingest(existing, records, prune=True)
+    assert (report.inserted, report.updated, report.unchanged, report.deleted, report.duplicates) == (1, 1, 1, 1, 1)
+    assert sorted(cities) == ["Lyon", "Paris", "Rome"]
+    assert cities["Lyon"]["clues"] == ["Another clue"]
+    assert cities["Rome"]["clues"] == ["A clue"]
+
+
+def test_ingest_prune_keeps_cities_of_invalid_records():
+    """Test that a malformed record does not get its existing city deleted"""
+    existing = [destination("Paris"), destination("Lyon")]
+    report, cities = run_ingest(existing, [destination("Paris"), {"city": "Lyon", "country": "France"}], prune=True)
+    assert report.invalid == 1
+    assert report.deleted == 0
+    assert sorted(cities) == ["Lyon", "Paris"]
+
+
+def test_ingest_does_not_prune_after_an_unnamed_invalid_record():
+    existing = [destination("Paris"), destination("Lyon")]
+    report, cities = run_ingest(existing, [destination("Paris"), {"country": "France"}], prune=True)
+    assert report.deleted == 0
+    assert sorted(cities) == ["Lyon", "Paris"]
+
+
+def test_ingest_dry_run_writes_nothing():
+    report, cities = run_ingest([destination("Paris")], [destination("Rome")], prune=True, dry_run=True)
+    assert (report.inserted, report.deleted) == (1, 1)
+    assert sorted(cities) == ["Paris"]
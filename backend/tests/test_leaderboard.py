@@ -0,0 +1,32 @@
+import asyncio
+
+from app.leaderboard import Leaderboard
+
+
+class SlowRepository:
+    """Returns the scores it was created with, letting the leaderboard change during the read"""
+
+    def __init__(self, scores, during_read):
+        self.scores = scores
+        self.during_read = during_read
+
+    async def user_scores(self):
+        scores = dict(self.scores)
+        await asyncio.sleep(0)
+        self.during_read()
+        return scores
+
+
+def test_reconcile_keeps_updates_made_during_the_read():
+    """Test that a reconcile does not roll back scores written while it awaited the database"""
+    leaderboard = Leaderboard()
+    leaderboard.update("bob", 3)
+
+    def during_read():
+        leaderboard.update("alice", 5)
+        leaderboard.remove("bob")
+
+    asyncio.run(leaderboard.reconcile(SlowRepository({"alice": 4, "bob": 3, "carol": 1}, during_read)))
+    assert leaderboard.score_of("alice") == 5
+    assert leaderboard.score_of("bob") is None
+    assert leaderboard.score_of("carol") == 1
@@ -0,0 +1,25 @@
+import asyncio
+import json
+
+from app.repository import EmbeddedRepository
+
+
+def test_embedded_snapshot_copies_nested_fields(tmp_path):
+    """Test that the snapshot writer gets documents the event loop can keep updating"""
+    data_path = tmp_path / "data.json"
+    data_path.write_text(json.dumps([{"city": "Paris", "country": "France", "clues": [], "fun_fact": [], "trivia": []}]))
+    repository = EmbeddedRepository(str(data_path), snapshot_path=str(tmp_path / "users.json"), snapshot_seconds=0)
+    written = []
+    repository._write_snapshot = written.extend
+
+    async def scenario():
+        await repository.connect()
+        await repository.insert_user({"username": "alice", "score": 0})
+        await repository.increment_user("alice", {"score": 1}, bits={"seen.0": 1}, fields={"seen_catalog": "a"})
+        await repository.save_snapshot()
+        # Answers after the copy must not reach the documents handed to the writer thread
+        await repository.increment_user("alice", {"score": 1}, bits={"seen.0": 2, "seen.1": 1})
+
+    asyncio.run(scenario())
+    assert written[0]["score"] == 1
+    assert written[0]["seen"] == {"0": 1}
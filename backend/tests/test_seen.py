@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from app.catalog import build_catalog_data
+from app.repository import EmbeddedRepository
+from app.seen import SEEN_PROJECTION, SeenSets
+
+CITIES = [{"city": f"City {i}", "country": "Country", "clues": ["A clue"]} for i in range(70)]
+
+
+def make_repository(tmp_path):
+    data_path = tmp_path / "data.json"
+    data_path.write_text(json.dumps(CITIES))
+    return EmbeddedRepository(str(data_path))
+
+
+def test_mark_is_one_update_whatever_is_stored(tmp_path):
+    """Test that an answer records its bit in one update, for new users and sets of another catalog"""
+    repository = make_repository(tmp_path)
+    data = build_catalog_data(CITIES)
+    seen_sets = SeenSets()
+
+    async def scenario():
+        await repository.connect()
+        # A set written against another catalog in the earlier layout, unknown to this worker
+        await repository.insert_user({"username": "alice", "score": 0, "seen": {"0": 3}, "seen_catalog": "old"})
+        user = await repository.increment_user("alice", {"score": 1}, **seen_sets.mark("alice", 65, data))
+        assert user["score"] == 1
+
+        # Once read, the stale fields are dropped by the next answer
+        entry = seen_sets.load("alice", await repository.find_user("alice", SEEN_PROJECTION), data)
+        assert int(entry.words[1]) == 2
+        await repository.increment_user("alice", {"score": 1}, **seen_sets.mark("alice", 3, data))
+        return await repository.find_user("alice")
+
+    user = asyncio.run(scenario())
+    fingerprint = seen_sets.fingerprint(data)
+    assert user["score"] == 2
+    assert user["seen"] == {fingerprint: {"0": 8, "1": 2}}
+    assert "seen_catalog" not in user
+
+
+def test_mark_after_all_seen_replaces_the_set(tmp_path):
+    """Test that once every destination was seen the stored set starts over"""
+    repository = make_repository(tmp_path)
+    data = build_catalog_data(CITIES[:2])
+    seen_sets = SeenSets()
+    fingerprint = seen_sets.fingerprint(data)
+
+    async def scenario():
+        await repository.connect()
+        await repository.insert_user({"username": "bob", "score": 0, "seen": {fingerprint: {"0": 3}}})
+        entry = seen_sets.load("bob", await repository.find_user("bob", SEEN_PROJECTION), data)
+        slot = seen_sets.pick(entry, data)
+        await repository.increment_user("bob", {"score": 0}, **seen_sets.mark("bob", slot, data))
+        return slot, await repository.find_user("bob")
+
+    slot, user = asyncio.run(scenario())
+    assert seen_sets.resets == 1
+    assert user["seen"] == {fingerprint: {"0": 1 << slot}}
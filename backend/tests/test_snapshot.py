@@ -0,0 +1,109 @@
+import struct
+
+import pytest
+
+from app.catalog import DestinationCatalog, build_catalog_data
+from app.snapshot import (FORMAT_VERSION, MappedSnapshot, SharedCatalogSnapshot, SnapshotError, encode_snapshot,
+                          read_header, write_snapshot)
+
+DESTINATIONS = [
+    {"city": "Paris", "country": "France", "clues": ["Iron lady", "Croissants"], "fun_fact": ["Eiffel"],
+     "trivia": ["Lights"]},
+    {"city": "Québec City", "country": "Canada", "clues": ["Château \"Frontenac\""], "fun_fact": [], "trivia": []},
+    {"city": "Tokyo", "country": "Japan", "clues": ["Croissants"], "fun_fact": ["Shibuya", "Sushi"],
+     "trivia": ["Largest metro"]},
+]
+
+
+def as_lists(data):
+    """The columns of a CatalogData as plain lists, whatever they are backed by"""
+    encoded = data.encoded
+    return (list(data.cities), list(data.countries), list(data.clues), list(data.fun_facts), list(data.trivia),
+            dict(data.index), list(encoded.cities), list(encoded.options), list(encoded.clues),
+            list(encoded.fun_facts))
+
+
+def test_round_trip_matches_the_source_catalog(tmp_path):
+    """Test that a written and mapped snapshot reads back exactly the catalog it was built from"""
+    data = build_catalog_data(DESTINATIONS)
+    path = str(tmp_path / "catalog.snap")
+    version = write_snapshot(path, data)
+
+    snapshot = MappedSnapshot(path)
+    mapped = snapshot.catalog_data()
+    assert snapshot.version == version
+    assert snapshot.count == len(DESTINATIONS)
+    assert read_header(path)[0] == version
+    assert as_lists(mapped) == as_lists(data)
+    assert mapped.cities[-1] == "Tokyo"
+    assert mapped.fingerprint == f"{version:016x}"
+    with pytest.raises(IndexError):
+        mapped.clues[len(DESTINATIONS)]
+
+
+def test_empty_catalog_round_trips(tmp_path):
+    path = str(tmp_path / "catalog.snap")
+    write_snapshot(path, build_catalog_data([]))
+    assert as_lists(MappedSnapshot(path).catalog_data()) == ([], [], [], [], [], {}, [], [], [], [])
+
+
+def test_content_version_depends_only_on_the_destinations():
+    """Test that equal catalogs get equal versions and any change gets a new one"""
+    def version(documents, created_at):
+        return struct.unpack_from("<Q", encode_snapshot(build_catalog_data(documents), created_at), 16)[0]
+
+    changed = [dict(DESTINATIONS[0], clues=["Iron lady"])] + DESTINATIONS[1:]
+    assert version(DESTINATIONS, 1.0) == version(DESTINATIONS, 2.0)
+    assert version(DESTINATIONS, 1.0) != version(changed, 1.0)
+
+
+@pytest.mark.parametrize("keep", [0, 20, 60, -1])
+def test_truncated_snapshot_is_rejected(tmp_path, keep):
+    """Test that a file cut short anywhere, header or body, is refused instead of mapped"""
+    payload = encode_snapshot(build_catalog_data(DESTINATIONS))
+    path = tmp_path / "catalog.snap"
+    path.write_bytes(payload[:keep])
+    with pytest.raises(SnapshotError):
+        MappedSnapshot(str(path))
+
+
+def test_format_version_mismatch_is_rejected(tmp_path):
+    """Test that a snapshot of another format version is neither mapped nor reported by read_header"""
+    payload = bytearray(encode_snapshot(build_catalog_data(DESTINATIONS)))
+    struct.pack_into("<I", payload, 8, FORMAT_VERSION + 1)
+    path = tmp_path / "catalog.snap"
+    path.write_bytes(bytes(payload))
+
+    with pytest.raises(SnapshotError, match="format"):
+        MappedSnapshot(str(path))
+    assert read_header(str(path)) is None
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    path = tmp_path / "catalog.snap"
+    path.write_bytes(b"[" + b" " * 100 + b"]")
+    with pytest.raises(SnapshotError, match="not a destination snapshot"):
+        MappedSnapshot(str(path))
+
+
+def test_shared_snapshot_remaps_only_when_the_version_changes(tmp_path):
+    """Test that workers keep their mapping until a snapshot with other content is published"""
+    path = str(tmp_path / "catalog.snap")
+    catalog = DestinationCatalog()
+    shared = SharedCatalogSnapshot(catalog, path)
+    assert shared.map() is False
+
+    write_snapshot(path, build_catalog_data(DESTINATIONS))
+    assert shared.map() is True
+    first = catalog.data
+    assert list(first.cities) == ["Paris", "Québec City", "Tokyo"]
+
+    # Republishing the same destinations keeps the current mapping
+    write_snapshot(path, build_catalog_data(DESTINATIONS))
+    assert shared.map() is False
+    assert catalog.data is first
+
+    write_snapshot(path, build_catalog_data(DESTINATIONS[:2]))
+    assert shared.map() is True
+    assert list(catalog.data.cities) == ["Paris", "Québec City"]
+    assert shared.remaps == 2
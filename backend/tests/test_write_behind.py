@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.write_behind import ScoreWriteBuffer
+
+
+class FakeRepository:
+    """Records apply_increments calls; can fail, report failed users or hold a write open"""
+
+    def __init__(self, fail=False, failed_users=(), release: asyncio.Event = None):
+        self.fail = fail
+        self.failed_users = list(failed_users)
+        self.release = release
+        self.started = asyncio.Event()
+        self.calls = []
+
+    async def apply_increments(self, increments):
+        self.calls.append({username: dict(deltas) for username, deltas in increments.items()})
+        self.started.set()
+        if self.release is not None:
+            await self.release.wait()
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        return [username for username in increments if username in self.failed_users]
+
+
+def test_repeated_increments_coalesce_into_one_update():
+    """Test that several answers of one user are written as a single $inc"""
+    buffer = ScoreWriteBuffer()
+    for correct in (True, True, False):
+        buffer.add("alice", correct)
+    buffer.add("bob", False)
+    repository = FakeRepository()
+
+    sent = asyncio.run(buffer.flush(repository))
+    assert sent == 2
+    assert repository.calls == [{
+        "alice": {"score": 2, "correct_answers": 2, "total_answers": 3},
+        "bob": {"score": 0, "correct_answers": 0, "total_answers": 1},
+    }]
+    assert len(buffer) == 0
+    assert buffer.stats()["flushed_events"] == 4
+
+
+def test_failed_flush_restores_pending_deltas():
+    """Test that deltas of a failed write go back to pending and are written by the next flush"""
+    buffer = ScoreWriteBuffer()
+    buffer.add("alice", True)
+    buffer.add("alice", True)
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await buffer.flush(FakeRepository(fail=True))
+        assert buffer.pending_score("alice") == 2
+        assert buffer.stats()["pending_events"] == 2
+        buffer.add("alice", True)
+        repository = FakeRepository()
+        await buffer.flush(repository)
+        return repository
+
+    repository = asyncio.run(scenario())
+    assert repository.calls == [{"alice": {"score": 3, "correct_answers": 3, "total_answers": 3}}]
+    assert buffer.failed_flushes == 1
+    assert len(buffer) == 0
+
+
+def test_users_reported_failed_are_retried():
+    """Test that only the users apply_increments reports as failed stay pending"""
+    buffer = ScoreWriteBuffer()
+    buffer.add("alice", True)
+    buffer.add("bob", True)
+
+    asyncio.run(buffer.flush(FakeRepository(failed_users=["bob"])))
+    assert buffer.pending_score("alice") == 0
+    assert buffer.pending_score("bob") == 1
+    assert buffer.failed_flushes == 1
+
+
+def test_increments_during_a_flush_are_merged_and_kept():
+    """Test that answers arriving while a batch is written count in reads and go out with the next flush"""
+    buffer = ScoreWriteBuffer()
+    buffer.add("alice", True)
+
+    async def scenario():
+        repository = FakeRepository(release=asyncio.Event())
+        flushing = asyncio.create_task(buffer.flush(repository))
+        await repository.started.wait()
+
+        # The in-flight batch and the new answer both show up in reads
+        buffer.add("alice", True)
+        assert buffer.pending_score("alice") == 2
+        merged = buffer.merge({"username": "alice", "score": 10, "correct_answers": 10, "total_answers": 12})
+        assert merged == {"username": "alice", "score": 12, "correct_answers": 12, "total_answers": 14}
+
+        repository.release.set()
+        await flushing
+        assert buffer.pending_score("alice") == 1
+        repository.release = None
+        await buffer.flush(repository)
+        return repository
+
+    repository = asyncio.run(scenario())
+    assert repository.calls == [{"alice": {"score": 1, "correct_answers": 1, "total_answers": 1}}] * 2
+    assert len(buffer) == 0
+
+
+def test_stop_drains_pending_increments():
+    """Test that stopping the flush task writes out whatever is still pending"""
+    buffer = ScoreWriteBuffer(flush_interval_ms=60_000)
+    repository = FakeRepository()
+
+    async def get_database():
+        return repository
+
+    async def scenario():
+        buffer.start(get_database)
+        buffer.add("alice", True)
+        buffer.add("bob", False)
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert repository.calls == [{
+        "alice": {"score": 1, "correct_answers": 1, "total_answers": 1},
+        "bob": {"score": 0, "correct_answers": 0, "total_answers": 1},
+    }]
+    assert len(buffer) == 0
+    assert buffer._flush_task is None
+
+
+def test_max_pending_events_triggers_an_early_flush():
+    """Test that the flush task writes as soon as max_pending_events answers are waiting"""
+    buffer = ScoreWriteBuffer(flush_interval_ms=60_000, max_pending_events=3)
+    repository = FakeRepository()
+
+    async def get_database():
+        return repository
+
+    async def scenario():
+        buffer.start(get_database)
+        for _ in range(3):
+            buffer.add("alice", True)
+        await asyncio.wait_for(repository.started.wait(), timeout=1.0)
+        await asyncio.sleep(0)
+        await buffer.stop()
+
+    asyncio.run(scenario())
+    assert repository.calls == [{"alice": {"score": 3, "correct_answers": 3, "total_answers": 3}}]
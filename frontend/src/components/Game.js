@@ -5,7 +5,7 @@ import Confetti from 'react-confetti';
 import html2canvas from 'html2canvas';
 import { UserContext } from '../context/UserContext';
 import { useToast } from '../hooks/useToast';
-import { getQuestion, submitAnswer } from '../services/api';
+import { getQuestions, submitAnswer } from '../services/api';
 import {
   Container,
   Card,
@@ -323,6 +323,10 @@ const ChallengeButton = styled(Button)`
   }
 `;
 
+// Rounds fetched per request, and how many past answers the server is asked to avoid
+const PREFETCH_ROUNDS = 5;
+const RECENT_CITIES = 30;
+
 const Game = () => {
   const { showToast } = useToast();
   const [question, setQuestion] = useState(null);
@@ -342,6 +346,42 @@ const Game = () => {
   const [challengeImage, setChallengeImage] = useState(null);
   const shareInputRef = useRef(null);
   const gameCardRef = useRef(null);
+  const questionQueueRef = useRef([]);
+  const recentCitiesRef = useRef([]);
+  const refillRef = useRef(null);
+
+  const refillQueue = () => {
+    if (!refillRef.current) {
+      const exclude = [
+        ...recentCitiesRef.current,
+        ...questionQueueRef.current.map((queued) => queued.correct_answer),
+      ];
+      refillRef.current = getQuestions(PREFETCH_ROUNDS, exclude)
+        .then((questions) => {
+          questionQueueRef.current.push(...questions);
+        })
+        .finally(() => {
+          refillRef.current = null;
+        });
+    }
+    return refillRef.current;
+  };
+
+  const takeQuestion = async () => {
+    if (questionQueueRef.current.length === 0) {
+      await refillQueue();
+    }
+    const next = questionQueueRef.current.shift();
+    if (!next) {
+      throw new Error('No questions available');
+    }
+    recentCitiesRef.current = [...recentCitiesRef.current, next.correct_answer].slice(-RECENT_CITIES);
+    // Fetch the next batch while this round is being played
+    if (questionQueueRef.current.length <= 1) {
+      refillQueue().catch((err) => console.error(err));
+    }
+    return next;
+  };
 
   const fetchQuestion = async () => {
     setLoading(true);
@@ -352,7 +392,7 @@ const Game = () => {
     setShowConfetti(false);
     
     try {
-      const data = await getQuestion();
+      const data = await takeQuestion();
       setQuestion(data);
     } catch (err) {
       setError('Failed to load question. Please try again.');
@@ -508,7 +548,8 @@ const Game = () => {
       const data = await submitAnswer(
         option.city,
         question.correct_answer,
-        user?.username
+        user?.username,
+        question.token
       );
       
       setResult({
@@ -61,20 +61,34 @@ export const getUser = async (username) => {
   }
 };
 
-export const getQuestion = async () => {
+export const getQuestion = async (difficulty = null) => {
   try {
-    const response = await api.get('/game/question');
+    const response = await api.get('/game/question', {
+      params: difficulty ? { difficulty } : {}
+    });
     return response.data;
   } catch (error) {
     throw error.response?.data || { detail: 'Failed to get question' };
   }
 };
 
-export const submitAnswer = async (selectedCity, correctCity, username = null) => {
+export const getQuestions = async (count, exclude = [], difficulty = null) => {
+  try {
+    const response = await api.get('/game/questions', {
+      params: { count, exclude: exclude.join(','), ...(difficulty ? { difficulty } : {}) }
+    });
+    return response.data.questions;
+  } catch (error) {
+    throw error.response?.data || { detail: 'Failed to get questions' };
+  }
+};
+
+export const submitAnswer = async (selectedCity, correctCity, username = null, token = null) => {
   try {
     const response = await api.post('/game/answer', {
       selected_city: selectedCity,
       correct_city: correctCity,
+      token,
     }, {
       params: username ? { username } : {}
     });